@@ -1,9 +1,65 @@
 """
 Functions for interacting with the Adracare API.
 """
+import sys
 import requests
 import json
 import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class NoteRecord:
+    """
+    Compact representation of a single encounter note.
+    
+    Notes are held for the whole run, so the record uses __slots__ instead of
+    a per-note dict and shares repeated identifiers via sys.intern. The raw
+    HTML is released as soon as the plain text has been extracted.
+    """
+    
+    __slots__ = (
+        "id",
+        "notes",
+        "text",
+        "created_at",
+        "updated_at",
+        "patient_id",
+        "created_by_account_id",
+        "local_patient_id",
+        "external_patient_id"
+    )
+    
+    def __init__(self, id, notes, created_at, updated_at, patient_id, created_by_account_id,
+                 local_patient_id=None, external_patient_id=None, text=None):
+        self.id = id
+        self.notes = notes
+        self.text = text
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.patient_id = _intern(patient_id)
+        self.created_by_account_id = _intern(created_by_account_id)
+        self.local_patient_id = local_patient_id
+        self.external_patient_id = _intern(external_patient_id)
+    
+    def set_text(self, text):
+        """
+        Store the extracted plain text and drop the raw HTML.
+        
+        Args:
+            text (str): Plain text extracted from the note HTML
+        """
+        self.text = text
+        self.notes = None
+    
+    def __repr__(self):
+        return f"NoteRecord(id={self.id!r}, patient_id={self.patient_id!r}, created_at={self.created_at!r})"
+
+
+def _intern(value):
+    """Intern repeated identifier strings so every note shares one copy."""
+    return sys.intern(value) if isinstance(value, str) else value
 
 
 def get_auth_token(api_base_url, username, password):
@@ -66,6 +122,45 @@ def get_encounter_notes(api_base_url, auth_token, patient_id):
         return {"error": f"Exception occurred: {str(e)}", "data": []}
 
 
+def extract_note_record(item):
+    """
+    Build a note record from one element of the encounter_notes data array.
+    
+    Args:
+        item: One element of the response's "data" array
+        
+    Returns:
+        NoteRecord or None: The note, or None if the element is malformed
+    """
+    try:
+        # Check if item is a dictionary
+        if not isinstance(item, dict):
+            logger.warning("Expected note item to be a dict, got: %s", type(item))
+            return None
+        
+        # Get the note ID with validation
+        note_id = item.get("id", "")
+        
+        # Get attributes with validation
+        attributes = item.get("attributes", {})
+        if not isinstance(attributes, dict):
+            logger.warning("Expected 'attributes' to be a dict, got: %s", type(attributes))
+            attributes = {}
+        
+        # Create note record with safe gets ; TO TEST TIME ERROR ISSUE modified creaetd_at to updated_at
+        return NoteRecord(
+            id=note_id,
+            notes=attributes.get("notes", ""),
+            created_at=attributes.get("updated_at", ""),
+            updated_at=attributes.get("updated_at", ""),
+            patient_id=attributes.get("patient_id", ""),
+            created_by_account_id=attributes.get("created_by_account_id", "")
+        )
+    except Exception as e:
+        logger.warning("Error processing note: %s", e)
+        return None
+
+
 def extract_notes_data(encounter_notes_response):
     """
     Extract relevant note data from the API response.
@@ -74,7 +169,7 @@ def extract_notes_data(encounter_notes_response):
         encounter_notes_response: JSON response from the Adracare API
         
     Returns:
-        list: List of dictionaries containing note data
+        list: List of NoteRecord objects
     """
     notes_data = []
     
@@ -91,38 +186,11 @@ def extract_notes_data(encounter_notes_response):
         print(f"Warning: Expected 'data' to be a list, got: {type(data_array)}")
         return notes_data
     
-    # Process each item in the data array
+    # Process each item in the data array, continuing past malformed notes
     for item in data_array:
-        try:
-            # Check if item is a dictionary
-            if not isinstance(item, dict):
-                print(f"Warning: Expected note item to be a dict, got: {type(item)}")
-                continue
-            
-            # Get the note ID with validation
-            note_id = item.get("id", "")
-            
-            # Get attributes with validation
-            attributes = item.get("attributes", {})
-            if not isinstance(attributes, dict):
-                print(f"Warning: Expected 'attributes' to be a dict, got: {type(attributes)}")
-                attributes = {}
-            
-            # Create note data dictionary with safe gets ; TO TEST TIME ERROR ISSUE modified creaetd_at to updated_at
-            note_data = {
-                "id": note_id,
-                "notes": attributes.get("notes", ""),
-                "created_at": attributes.get("updated_at", ""),
-                "updated_at": attributes.get("updated_at", ""),
-                "patient_id": attributes.get("patient_id", ""),
-                "created_by_account_id": attributes.get("created_by_account_id", "")
-            }
-            
+        note_data = extract_note_record(item)
+        if note_data is not None:
             notes_data.append(note_data)
-        except Exception as e:
-            print(f"Error processing note: {str(e)}")
-            # Continue to the next note instead of failing
-            continue
     
     return notes_data
 
@@ -0,0 +1,151 @@
+"""
+Hedged requests against tail latency.
+
+Some encounter_notes requests stall for reasons unrelated to their size and
+hold a concurrency slot until they time out. A hedger tracks the latency of
+completed requests; when a request runs longer than a high percentile of
+that latency, a duplicate is issued, whichever finishes first is used and
+the other is cancelled. The number of duplicates is capped at a fraction of
+all requests so hedging never multiplies the load on the API.
+"""
+import time
+import asyncio
+from collections import deque
+
+
+class RequestHedger:
+    """
+    Issue a backup request when the first one is slower than usual.
+    """
+
+    def __init__(self, percentile=95, max_fraction=0.05, min_samples=20, min_delay=1.0, window=1000):
+        """
+        Initialize the hedger.
+
+        Args:
+            percentile (float): Latency percentile after which a duplicate is sent
+            max_fraction (float): Largest share of requests that may be duplicated
+            min_samples (int): Completed requests observed before hedging starts
+            min_delay (float): Seconds waited at least before a duplicate is sent
+            window (int): Number of recent latencies the percentile is taken over
+        """
+        self.percentile = percentile
+        self.max_fraction = max_fraction
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def delay(self):
+        """
+        Return how long to wait before hedging a request.
+
+        Returns:
+            float or None: Seconds, or None while too few latencies are known
+        """
+        if len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+    def _may_hedge(self):
+        """Tell whether one more duplicate stays within max_fraction of requests."""
+        return self.hedged + 1 <= self.max_fraction * self.requests
+
+    async def _timed(self, make_request):
+        """Run one request and record its latency if it succeeded."""
+        started = time.perf_counter()
+        result = await make_request()
+        if "error" not in result:
+            self.latencies.append(time.perf_counter() - started)
+        return result
+
+    async def run(self, make_request):
+        """
+        Run a request, hedging it if it is slow.
+
+        Args:
+            make_request: Callable returning a new request coroutine; called a
+                second time for the duplicate. Its result is a dict that holds
+                "error" if the request failed.
+
+        Returns:
+            dict: The first successful result, or the primary's error if both failed
+        """
+        self.requests += 1
+        primary = asyncio.ensure_future(self._timed(make_request))
+        backup = None
+        delay = self.delay()
+        if delay is None:
+            return await primary
+
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._may_hedge():
+                return await primary
+
+            self.hedged += 1
+            backup = asyncio.ensure_future(self._timed(make_request))
+            pending = {primary, backup}
+            failed = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if "error" not in result:
+                        if task is backup:
+                            self.hedge_wins += 1
+                        return result
+                    if task is primary or failed is None:
+                        failed = result
+            return failed
+        finally:
+            # Cancel whichever request lost (both, if the caller was cancelled), and
+            # wait for it so its connection is released before the result is used
+            pending = [task for task in (primary, backup) if task is not None and not task.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self):
+        """
+        Summarize the hedging done so far.
+
+        Returns:
+            dict: Request, hedge and win counts, the share hedged and the current delay
+        """
+        delay = self.delay()
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedged_fraction": round(self.hedged / self.requests, 4) if self.requests else 0.0,
+            "delay_seconds": round(delay, 3) if delay is not None else None
+        }
+
+
+_request_hedger = None
+
+
+def configure_request_hedger(enabled=False, **options):
+    """
+    Replace the shared request hedger.
+
+    Args:
+        enabled (bool): Create a hedger; if False hedging is disabled
+        **options: percentile, max_fraction, min_samples and min_delay for RequestHedger
+
+    Returns:
+        RequestHedger or None: The new shared hedger, or None if disabled
+    """
+    global _request_hedger
+    _request_hedger = RequestHedger(**options) if enabled else None
+    return _request_hedger
+
+
+def get_request_hedger():
+    """Return the shared request hedger, or None if hedging is disabled."""
+    return _request_hedger
@@ -0,0 +1,323 @@
+"""
+On-disk cache of encounter_notes responses for conditional requests.
+
+Each response body is stored gzip-compressed with the ETag and Last-Modified
+validators the API sent for it, indexed in a small SQLite file. Later
+requests for the same URL carry If-None-Match / If-Modified-Since, and a
+304 Not Modified is answered from disk instead of downloading the notes
+again. Responses without validators can optionally be served outright for a
+fixed time-to-live.
+"""
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import aiofiles
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class CachedBodyWriter:
+    """
+    Compress a response body to disk as it streams past.
+
+    The body is written to a temporary file and only becomes visible in the
+    cache when `commit` is called, so an interrupted download never leaves a
+    truncated entry behind.
+    """
+
+    def __init__(self, cache, url, etag, last_modified):
+        """
+        Initialize the writer.
+
+        Args:
+            cache (ResponseCache): Cache the body is stored in
+            url (str): Request URL the body belongs to
+            etag (str): ETag response header, if any
+            last_modified (str): Last-Modified response header, if any
+        """
+        self.cache = cache
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.path = cache.body_path(url)
+        self.temp_path = f"{self.path}.{os.getpid()}.{id(self)}.tmp"
+        self.size = 0
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self._file = None
+
+    async def tee(self, chunks):
+        """
+        Yield each chunk unchanged while compressing it into the cache.
+
+        Args:
+            chunks: Async iterator of response body bytes
+        """
+        self._file = await aiofiles.open(self.temp_path, "wb")
+        async for chunk in chunks:
+            compressed = self._compressor.compress(chunk)
+            if compressed:
+                await self._file.write(compressed)
+                self.size += len(compressed)
+            yield chunk
+
+    async def commit(self):
+        """Finish the compressed file and add it to the cache."""
+        tail = self._compressor.flush()
+        await self._file.write(tail)
+        await self._file.close()
+        self.size += len(tail)
+        os.replace(self.temp_path, self.path)
+        self.cache.store(self.url, self.etag, self.last_modified, self.size)
+
+    async def abort(self):
+        """Discard the partially written body."""
+        if self._file is not None:
+            await self._file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class ResponseCache:
+    """
+    Size-bounded on-disk HTTP response cache keyed by URL.
+    """
+
+    def __init__(self, directory="http_cache", max_bytes=512 * 2**20, ttl=0):
+        """
+        Initialize the cache.
+
+        Args:
+            directory (str): Directory holding the index and compressed bodies
+            max_bytes (int): Compressed bytes kept before least recently used entries are evicted
+            ttl (int): Seconds a response without validators is served without asking
+                the API again; 0 disables this and such responses are not cached
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.index_path = os.path.join(directory, "index.db")
+        self.conn = None
+        self.total_bytes = 0
+        self.fresh_hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def open(self):
+        """Open the cache index, creating the directory if needed."""
+        os.makedirs(self.directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.index_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                stored_at REAL,
+                last_used REAL,
+                size INTEGER
+            )
+            """
+        )
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def body_path(self, url):
+        """Return the path of the compressed body stored for url."""
+        return os.path.join(self.directory, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json.gz")
+
+    def lookup(self, url):
+        """
+        Find the cached response for url.
+
+        Returns:
+            dict or None: The entry ("url", "etag", "last_modified", "stored_at"),
+            or None if nothing usable is cached
+        """
+        row = self.conn.execute(
+            "SELECT etag, last_modified, stored_at FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            return None
+        if not os.path.exists(self.body_path(url)):
+            self.discard(url)
+            return None
+        return {"url": url, "etag": row[0], "last_modified": row[1], "stored_at": row[2]}
+
+    def is_fresh(self, entry):
+        """Tell whether an entry without validators may be served without a request."""
+        if entry["etag"] or entry["last_modified"]:
+            return False
+        return self.ttl > 0 and time.time() - entry["stored_at"] < self.ttl
+
+    def conditional_headers(self, entry):
+        """Return the If-None-Match / If-Modified-Since headers for an entry."""
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    async def read_body(self, entry):
+        """
+        Yield the decompressed body of a cached response.
+
+        Args:
+            entry (dict): Entry returned by lookup
+        """
+        decompressor = zlib.decompressobj(31)
+        async with aiofiles.open(self.body_path(entry["url"]), "rb") as f:
+            while True:
+                chunk = await f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+        data = decompressor.flush()
+        if not decompressor.eof:
+            raise ValueError(f"Cached body for {entry['url']} is truncated")
+        if data:
+            yield data
+
+    def writer(self, url, headers):
+        """
+        Start caching a 200 response if it can be reused later.
+
+        Args:
+            url (str): Request URL
+            headers: Response headers
+
+        Returns:
+            CachedBodyWriter or None: None if the response has no validators and
+            TTL mode is off, or the API asked for it not to be stored
+        """
+        if "no-store" in headers.get("Cache-Control", "").lower():
+            return None
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified and self.ttl <= 0:
+            return None
+        return CachedBodyWriter(self, url, etag, last_modified)
+
+    def store(self, url, etag, last_modified, size):
+        """Record a stored body in the index and evict old entries if over budget."""
+        previous = self.conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+        if previous:
+            self.total_bytes -= previous[0]
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+            (url, etag, last_modified, now, now, size)
+        )
+        self.total_bytes += size
+        self.stores += 1
+        self._evict()
+        self.conn.commit()
+
+    def touch(self, entry, revalidated):
+        """
+        Count a response served from the cache and mark it recently used.
+
+        Args:
+            entry (dict): Entry that was served
+            revalidated (bool): True if the API answered 304, False if served by TTL
+        """
+        if revalidated:
+            self.revalidated += 1
+        else:
+            self.fresh_hits += 1
+        self.conn.execute("UPDATE responses SET last_used = ? WHERE url = ?", (time.time(), entry["url"]))
+        self.conn.commit()
+
+    def discard(self, url):
+        """Remove the entry for url and its body."""
+        row = self.conn.execute("SELECT size FROM responses WHERE url = ?", (url,)).fetchone()
+        if row:
+            self.total_bytes -= row[0]
+            self.conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+            self.conn.commit()
+        path = self.body_path(url)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        if self.total_bytes <= self.max_bytes:
+            return
+        cursor = self.conn.execute("SELECT url, size FROM responses ORDER BY last_used ASC")
+        victims = []
+        for url, size in cursor:
+            if self.total_bytes <= self.max_bytes:
+                break
+            victims.append(url)
+            self.total_bytes -= size
+        for url in victims:
+            self.conn.execute("DELETE FROM responses WHERE url = ?", (url,))
+            path = self.body_path(url)
+            if os.path.exists(path):
+                os.remove(path)
+        self.evictions += len(victims)
+
+    def stats(self):
+        """
+        Summarize how many requests the cache answered.
+
+        Returns:
+            dict: Hit, miss, store and eviction counts, the hit rate and the cache size
+        """
+        hits = self.fresh_hits + self.revalidated
+        requests = hits + self.misses
+        return {
+            "hits": hits,
+            "revalidated": self.revalidated,
+            "fresh_hits": self.fresh_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": round(hits / requests, 4) if requests else 0.0,
+            "entries": self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0],
+            "bytes": self.total_bytes
+        }
+
+    def close(self):
+        """Close the cache index."""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
+_response_cache = None
+
+
+def configure_response_cache(directory, max_bytes, ttl=0):
+    """
+    Replace the shared response cache.
+
+    Args:
+        directory (str): Cache directory; empty disables caching
+        max_bytes (int): Compressed bytes kept before eviction
+        ttl (int): Seconds responses without validators are served without a request
+
+    Returns:
+        ResponseCache or None: The new shared cache, or None if disabled
+    """
+    global _response_cache
+    if _response_cache is not None:
+        _response_cache.close()
+    _response_cache = None
+    if directory:
+        _response_cache = ResponseCache(directory, max_bytes, ttl)
+        _response_cache.open()
+    return _response_cache
+
+
+def get_response_cache():
+    """Return the shared response cache, or None if caching is disabled."""
+    return _response_cache
@@ -0,0 +1,159 @@
+"""
+Incremental parsing of large JSON:API responses.
+
+The Adracare encounter_notes endpoint returns a single object whose "data"
+member holds every note. Buffering the whole body and decoding it at once
+means the raw document and the complete parsed tree are alive together; this
+parser instead walks the "data" array one element at a time as bytes arrive.
+"""
+import json
+import time
+import codecs
+
+_WHITESPACE = " \t\n\r"
+
+# Characters that can continue a number: a number followed by one may be cut off
+_NUMBER_CONTINUATION = ".eE+-0123456789"
+
+
+class StreamingArrayParser:
+    """
+    Yield the elements of one top-level array from a stream of JSON bytes.
+
+    Every other top-level member (for example "links" or "meta") is decoded
+    normally and made available in `envelope` once iteration finishes. The
+    time spent decoding, excluding waits for data, is kept in `decode_seconds`.
+    """
+
+    def __init__(self, chunks, array_key="data", compact_threshold=1 << 20):
+        """
+        Initialize the parser.
+
+        Args:
+            chunks: Async iterator of bytes (e.g. response.content.iter_chunked(n))
+            array_key (str): Top-level member whose array elements are yielded
+            compact_threshold (int): Consumed characters kept before the buffer is trimmed
+        """
+        self.chunks = chunks.__aiter__()
+        self.array_key = array_key
+        self.compact_threshold = compact_threshold
+        self.envelope = {}
+        self.bytes_read = 0
+        self.decode_seconds = 0.0
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    async def _fill(self):
+        """Read the next chunk into the buffer. Returns False at end of stream."""
+        if self._eof:
+            return False
+        try:
+            chunk = await self.chunks.__anext__()
+        except StopAsyncIteration:
+            self._eof = True
+            self._buf += self._decoder.decode(b"", final=True)
+            return False
+
+        self.bytes_read += len(chunk)
+        if self._pos > self.compact_threshold:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        self._buf += self._decoder.decode(chunk)
+        return True
+
+    async def _peek(self):
+        """Skip whitespace and return the next character, or '' at end of stream."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not await self._fill():
+                return ""
+
+    def _error(self, message):
+        """Build the error for a document that is not the expected JSON, as json.loads would raise."""
+        return json.JSONDecodeError(message, self._buf, self._pos)
+
+    async def _expect(self, char):
+        found = await self._peek()
+        if found != char:
+            raise self._error(f"Expected '{char}', found {found or 'end of stream'!r}")
+        self._pos += 1
+
+    async def _decode_value(self):
+        """
+        Decode one complete JSON value starting at the current position.
+
+        A value that ends exactly at the end of the buffer is only accepted at
+        end of stream, and a number followed by a character that could extend
+        it (as "12." is followed by "75" in the next chunk) waits for more
+        input, so numbers and literals are never cut short.
+        """
+        await self._peek()
+        while True:
+            started = time.perf_counter()
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                self.decode_seconds += time.perf_counter() - started
+                if self._eof:
+                    raise
+            else:
+                self.decode_seconds += time.perf_counter() - started
+                cut_short = (end < len(self._buf) and self._buf[end] in _NUMBER_CONTINUATION and
+                             isinstance(value, (int, float)) and not isinstance(value, bool))
+                if (end < len(self._buf) and not cut_short) or self._eof:
+                    self._pos = end
+                    return value
+            if not await self._fill():
+                # Retry once with the final buffer; a genuine error propagates
+                started = time.perf_counter()
+                value, end = self._json.raw_decode(self._buf, self._pos)
+                self.decode_seconds += time.perf_counter() - started
+                self._pos = end
+                return value
+
+    async def items(self):
+        """
+        Iterate over the elements of the array member.
+
+        Yields:
+            Each decoded element, in document order
+        """
+        await self._expect("{")
+        if await self._peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = await self._decode_value()
+            if not isinstance(key, str):
+                raise self._error("Expected an object key")
+            await self._expect(":")
+
+            if key == self.array_key and await self._peek() == "[":
+                self._pos += 1
+                if await self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield await self._decode_value()
+                        separator = await self._peek()
+                        self._pos += 1
+                        if separator == "]":
+                            break
+                        if separator != ",":
+                            raise self._error(f"Expected ',' or ']' in '{key}' array, found {separator!r}")
+            else:
+                self.envelope[key] = await self._decode_value()
+
+            separator = await self._peek()
+            self._pos += 1
+            if separator == "}":
+                return
+            if separator != ",":
+                raise self._error(f"Expected ',' or '}}' after member '{key}', found {separator!r}")
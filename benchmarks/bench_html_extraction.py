@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Golden-corpus check and benchmark for extract_text_from_html.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_html_extraction
+    python -m benchmarks.bench_html_extraction --update-golden
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from benchmarks.html_corpus import golden_corpus
+from utils.text_processing import extract_text_from_html, extract_texts_from_html, ExtractionCache, _strip_markup
+
+GOLDEN_FILE = os.path.join(os.path.dirname(__file__), "golden", "html_extraction.json")
+
+
+def load_golden():
+    """Load the golden (html, text) pairs."""
+    with open(GOLDEN_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def update_golden(size):
+    """Regenerate the golden file using the BeautifulSoup engine as the reference."""
+    documents = list(dict.fromkeys(golden_corpus(size)))
+    pairs = [{"html": doc, "text": extract_text_from_html(doc, engine="bs4")} for doc in documents]
+    os.makedirs(os.path.dirname(GOLDEN_FILE), exist_ok=True)
+    with open(GOLDEN_FILE, "w", encoding="utf-8") as f:
+        json.dump(pairs, f, indent=1)
+    print(f"Wrote {len(pairs)} golden documents to {GOLDEN_FILE}")
+
+
+def check_golden(pairs):
+    """
+    Compare both engines against the golden output.
+
+    Returns:
+        int: Number of mismatches
+    """
+    mismatches = 0
+    for engine in ("bs4", "stream"):
+        for pair in pairs:
+            actual = extract_text_from_html(pair["html"], engine=engine)
+            if actual != pair["text"]:
+                mismatches += 1
+                print(f"[{engine}] mismatch for {pair['html'][:60]!r}: {actual[:60]!r} != {pair['text'][:60]!r}")
+    return mismatches
+
+
+def time_engine(documents, engine, repeat):
+    """Return the mean time per document in microseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for doc in documents:
+            extract_text_from_html(doc, engine=engine)
+    return (time.perf_counter() - start) / (repeat * len(documents)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--update-golden", action="store_true", help="regenerate the golden corpus output")
+    parser.add_argument("--size", type=int, default=300, help="number of corpus documents to generate")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions over the corpus")
+    args = parser.parse_args()
+
+    if args.update_golden:
+        update_golden(args.size)
+        return
+
+    pairs = load_golden()
+    mismatches = check_golden(pairs)
+    print(f"Golden corpus: {len(pairs)} documents, {mismatches} mismatches")
+
+    documents = golden_corpus(args.size)
+    fast_path = sum(1 for doc in documents if _strip_markup(doc) is not None)
+    print(f"Fast path coverage: {fast_path}/{len(documents)} documents")
+
+    for label, subset in (("all documents", documents),
+                          ("fast path only", [doc for doc in documents if _strip_markup(doc) is not None])):
+        bs4_us = time_engine(subset, "bs4", args.repeat)
+        stream_us = time_engine(subset, "stream", args.repeat)
+        print(f"{label}:")
+        print(f"  bs4:    {bs4_us:8.1f} us/note")
+        print(f"  stream: {stream_us:8.1f} us/note ({bs4_us / stream_us:.1f}x faster)")
+
+    cache = ExtractionCache()
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        extract_texts_from_html(documents, cache=cache)
+    batch_us = (time.perf_counter() - start) / (args.repeat * len(documents)) * 1e6
+    print(f"batch (stream + cache): {batch_us:8.1f} us/note, {cache.stats()}")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
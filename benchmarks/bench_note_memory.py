@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Memory held by accumulated notes: per-note dicts versus NoteRecord.
+
+Builds a synthetic run of encounter_notes responses, decodes each one with
+json.loads the way the fetcher does, and measures the memory retained once
+every note is ready for SQL generation. With --budget-mb the NoteRecords
+are also collected in a NoteBuffer that spills past the budget, as main.py
+does with NOTE_MEMORY_BUDGET_MB. Run from the repository root:
+
+    python -m benchmarks.bench_note_memory --notes 1000000 --budget-mb 256
+"""
+import gc
+import json
+import time
+import uuid
+import random
+import argparse
+import tracemalloc
+from functools import partial
+from api.adracare import extract_notes_data
+from benchmarks.html_corpus import generate_note_html
+from utils.text_processing import extract_texts_from_html
+from utils.spill import MemoryBudget, NoteBuffer
+
+
+def synthetic_responses(total_notes, notes_per_patient, seed):
+    """
+    Yield (patient_id, response_body) pairs totalling total_notes notes.
+
+    Args:
+        total_notes (int): Number of notes to generate
+        notes_per_patient (int): Notes in each patient's response
+        seed (int): Random seed
+    """
+    rng = random.Random(seed)
+    accounts = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(200)]
+    remaining = total_notes
+    while remaining > 0:
+        count = min(notes_per_patient, remaining)
+        remaining -= count
+        patient_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        data = []
+        for _ in range(count):
+            timestamp = f"2024-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}T12:{rng.randint(10, 59)}:00.000-06:00"
+            data.append({
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "type": "encounter_notes",
+                "attributes": {
+                    "notes": generate_note_html(rng),
+                    "created_at": timestamp,
+                    "updated_at": timestamp,
+                    "patient_id": patient_id,
+                    "created_by_account_id": rng.choice(accounts)
+                }
+            })
+        yield patient_id, json.dumps({"data": data})
+
+
+def build_dicts(responses):
+    """Accumulate notes the way the pipeline did before NoteRecord."""
+    notes = []
+    for patient_id, body in responses:
+        for item in json.loads(body)["data"]:
+            attributes = item["attributes"]
+            notes.append({
+                "id": item["id"],
+                "notes": attributes.get("notes", ""),
+                "created_at": attributes.get("updated_at", ""),
+                "updated_at": attributes.get("updated_at", ""),
+                "patient_id": attributes.get("patient_id", ""),
+                "created_by_account_id": attributes.get("created_by_account_id", ""),
+                "local_patient_id": 1,
+                "external_patient_id": patient_id
+            })
+    return notes
+
+
+def build_records(responses):
+    """Accumulate notes as NoteRecord objects with the HTML released."""
+    notes = []
+    for patient_id, body in responses:
+        records = extract_notes_data(json.loads(body))
+        for record, text in zip(records, extract_texts_from_html([record.notes for record in records])):
+            record.local_patient_id = 1
+            record.external_patient_id = patient_id
+            record.set_text(text)
+        notes.extend(records)
+    return notes
+
+
+def build_buffer(responses, budget):
+    """Accumulate NoteRecords in a NoteBuffer that spills past the budget."""
+    notes = NoteBuffer(budget)
+    for patient_id, body in responses:
+        records = extract_notes_data(json.loads(body))
+        for record, text in zip(records, extract_texts_from_html([record.notes for record in records])):
+            record.local_patient_id = 1
+            record.external_patient_id = patient_id
+            record.set_text(text)
+        notes.extend(records)
+    return notes
+
+
+def measure(builder, args):
+    """Return (retained bytes, peak bytes, seconds) for one representation."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    notes = builder(synthetic_responses(args.notes, args.notes_per_patient, args.seed))
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(notes) == args.notes
+    del notes
+    return retained, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare memory retained by note representations")
+    parser.add_argument("--notes", type=int, default=1000000, help="number of synthetic notes")
+    parser.add_argument("--notes-per-patient", type=int, default=40, help="notes in each patient's response")
+    parser.add_argument("--seed", type=int, default=7, help="random seed")
+    parser.add_argument("--budget-mb", type=float, default=0, help="also measure a NoteBuffer with this budget")
+    args = parser.parse_args()
+
+    builders = [("dict", build_dicts), ("NoteRecord", build_records)]
+    budget = None
+    if args.budget_mb:
+        budget = MemoryBudget(int(args.budget_mb * 2**20))
+        builders.append(("NoteBuffer", partial(build_buffer, budget=budget)))
+
+    results = {}
+    for label, builder in builders:
+        retained, peak, elapsed = measure(builder, args)
+        results[label] = retained
+        print(f"{label:>10}: {retained / 2**20:9.1f} MiB retained ({peak / 2**20:.1f} MiB peak), "
+              f"{retained / args.notes:7.1f} bytes/note, built in {elapsed:.1f}s")
+
+    saving = 1 - results["NoteRecord"] / results["dict"]
+    print(f"NoteRecord retains {saving:.1%} less memory for {args.notes} notes")
+    if budget:
+        stats = budget.stats()
+        print(f"NoteBuffer spilled {stats['spilled_notes']} notes to {stats['segments']} segments "
+              f"({stats['spilled_bytes'] / 2**20:.1f} MiB on disk) under a {args.budget_mb:g} MiB budget")
+        budget.close()
+
+
+if __name__ == "__main__":
+    main()
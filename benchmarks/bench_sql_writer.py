@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Writing output.sql: per-note aiofiles writes versus SQLWriter.
+
+Writes the same synthetic statements the way write_sql_async used to (two
+awaited aiofiles writes per note and an fsync per patient) and through
+SQLWriter with a checkpoint per patient, for a few buffer sizes and fsync
+policies and for gzip and zstd output, and checks that every variant
+produces the same text. Run from the repository root:
+
+    python -m benchmarks.bench_sql_writer --notes 200000
+"""
+import os
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import aiofiles
+from datetime import datetime
+from benchmarks.html_corpus import generate_note_html
+from utils.text_processing import extract_text_from_html
+from utils.sql_writer import SQLWriter
+from utils.compression import open_text
+
+
+def synthetic_patients(total_notes, notes_per_patient, seed):
+    """
+    Return patients as lists of (comment, statement) pairs, as rendered by write_sql_async.
+
+    Args:
+        total_notes (int): Number of statements
+        notes_per_patient (int): Statements per patient, i.e. per checkpoint
+        seed (int): Random seed
+    """
+    rng = random.Random(seed)
+    texts = [extract_text_from_html(generate_note_html(rng)).replace("'", "''") for _ in range(500)]
+    patients = []
+    for start in range(0, total_notes, notes_per_patient):
+        patient_id = f"{rng.getrandbits(64):016x}"
+        patients.append([
+            (
+                f"-- note_id: {start + index}, patient_id: {patient_id}\n",
+                "\n        INSERT INTO patient_notes (notes, patient_id, author_user_id, created_at, updated_at)\n"
+                f"        VALUES ('{rng.choice(texts)}', 1, 1, '2024-01-01T00:00:00Z' AT TIME ZONE 'UTC', "
+                "'2024-01-01T00:00:00Z' AT TIME ZONE 'UTC')\n        RETURNING id;\n        "
+            )
+            for index in range(min(notes_per_patient, total_notes - start))
+        ])
+    return patients
+
+
+async def write_aiofiles(path, patients):
+    """The previous write path: two awaited writes per note, fsync per patient."""
+    async with aiofiles.open(path, "w") as f:
+        await f.write("-- Adracare Encounter Notes SQL Import\n")
+        await f.write(f"-- Generated at: {datetime.now().isoformat()}\n\n")
+    for notes in patients:
+        async with aiofiles.open(path, "a") as f:
+            for comment, statement in notes:
+                await f.write(comment)
+                await f.write(statement + "\n\n")
+            await f.flush()
+            os.fsync(f.fileno())
+
+
+def sql_writer_variant(buffer_size, fsync):
+    """Return a write function using SQLWriter with a checkpoint per patient."""
+    async def write(path, patients):
+        writer = SQLWriter(path, buffer_size=buffer_size, fsync=fsync)
+        for notes in patients:
+            for comment, statement in notes:
+                await writer.write(f"{comment}{statement}\n\n")
+            await writer.checkpoint()
+        await writer.close()
+    return write
+
+
+def run_variant(write, patients, directory, name="output.sql"):
+    """Return (seconds, bytes on disk, sha256 of the text without its timestamp) of one write."""
+    path = os.path.join(directory, name)
+    started = time.perf_counter()
+    asyncio.run(write(path, patients))
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(path)
+    digest = hashlib.sha256()
+    with open_text(path) as f:
+        for line in f:
+            if not line.startswith("-- Generated at:"):
+                digest.update(line.encode("utf-8"))
+    os.remove(path)
+    return elapsed, size, digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare output.sql write paths")
+    parser.add_argument("--notes", type=int, default=200000, help="number of statements")
+    parser.add_argument("--notes-per-patient", type=int, default=20, help="statements between checkpoints")
+    parser.add_argument("--buffer-kb", default="64,4096", help="comma-separated SQLWriter buffer sizes")
+    parser.add_argument("--formats", default="gz,zst", help="comma-separated compressed outputs to add (gz, zst)")
+    parser.add_argument("--seed", type=int, default=7, help="random seed")
+    parser.add_argument("--directory", help="where to write (default: a temporary directory)")
+    args = parser.parse_args()
+
+    patients = synthetic_patients(args.notes, args.notes_per_patient, args.seed)
+    variants = [("aiofiles per note", write_aiofiles, "output.sql")]
+    for size in args.buffer_kb.split(","):
+        for fsync in ("checkpoint", "never"):
+            variants.append((f"SQLWriter {size} KiB, fsync {fsync}", sql_writer_variant(int(size) * 1024, fsync),
+                             "output.sql"))
+    largest = max(int(size) for size in args.buffer_kb.split(",")) * 1024
+    for extension in filter(None, args.formats.split(",")):
+        variants.append((f"SQLWriter .sql.{extension}", sql_writer_variant(largest, "checkpoint"),
+                         f"output.sql.{extension}"))
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        baseline = None
+        for label, write, name in variants:
+            elapsed, size, digest = run_variant(write, patients, directory, name)
+            if baseline is None:
+                baseline = (elapsed, size, digest)
+            status = "same output" if digest == baseline[2] else "OUTPUT DIFFERS"
+            print(f"{label:>34}: {args.notes / elapsed:10,.0f} notes/s, {elapsed:7.2f}s "
+                  f"({baseline[0] / elapsed:5.1f}x), {size / 2**20:8.1f} MiB "
+                  f"({baseline[1] / size:4.1f}x smaller), {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Synthetic production-scale dataset for benchmarks.
+
+Seeds PostgreSQL with providers and staff (users with ab_prac_id and
+adracare_account_id), patients (external_id) and appointments, and describes
+the matching note corpus: the mock API (benchmarks/mock_api.py) generates
+every patient's notes deterministically from the same seed and dataset
+options, so nothing has to be stored and the corpus never drifts from the
+database. Scale 1 is 1,000 patients and 5 providers; with the default note
+options, scale 100 is 100,000 patients, 500 providers and about 1.5 million
+notes.
+
+Rows are streamed with COPY in chunks, so seeding millions of rows needs
+little memory. Run from the repository root:
+
+    python -m benchmarks.dataset --scale 100 --create adracare_scale100 --providers-file providers.json
+    python -m benchmarks.mock_api --dataset dataset.json --port 8765
+
+--dry-run prints the counts without touching a database.
+"""
+import io
+import json
+import random
+import argparse
+from datetime import datetime, timedelta
+import psycopg2
+from config.settings import load_config
+from benchmarks.fixtures import create_database, patient_external_ids
+from benchmarks.mock_api import SyntheticNotes, add_arguments, DEFAULT_SIZE_MIX
+
+PATIENTS_PER_SCALE = 1000
+PROVIDERS_PER_SCALE = 5
+COPY_CHUNK_ROWS = 50000
+
+FIRST_NAMES = ("Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn")
+LAST_NAMES = ("Nguyen", "Smith", "Patel", "Brown", "Martin", "Singh", "Tremblay", "Lee", "Wilson", "Roy")
+
+
+class SyntheticDataset:
+    """
+    Deterministic providers, patients and appointments matching a SyntheticNotes corpus.
+    """
+
+    def __init__(self, scale=1.0, seed=1, provider_skew=1.0, appointments=3, shared_rate=0.2, staff_per_provider=1.0,
+                 mean_notes=20, skew=1.6, max_notes=2000, size_mix=DEFAULT_SIZE_MIX, missing_rate=0.0, accounts=None):
+        """
+        Initialize the dataset.
+
+        Args:
+            scale (float): Size factor; 1 is PATIENTS_PER_SCALE patients and PROVIDERS_PER_SCALE providers
+            seed (int): Seed of the dataset and of the note corpus
+            provider_skew (float): Zipf exponent of patients per provider; 0 spreads patients
+                evenly, higher values give a few providers most of the patients
+            appointments (float): Mean appointments per patient with their main provider
+            shared_rate (float): Share of patients who also saw a second provider
+            staff_per_provider (float): Authoring accounts without a practice ID, per provider
+            mean_notes (float): Mean notes per patient in the corpus
+            skew (float): Pareto shape of notes per patient, see SyntheticNotes
+            max_notes (int): Cap on the notes of one patient
+            size_mix (str): Note body size mix, see parse_size_mix
+            missing_rate (float): Share of patients the mock API answers with 404
+            accounts (int): Authoring accounts in the corpus (default: providers and staff)
+        """
+        self.scale = scale
+        self.seed = seed
+        self.provider_skew = provider_skew
+        self.appointments = appointments
+        self.shared_rate = shared_rate
+        self.patient_count = max(1, int(round(scale * PATIENTS_PER_SCALE)))
+        self.provider_count = max(1, int(round(scale * PROVIDERS_PER_SCALE)))
+        if accounts is None:
+            accounts = self.provider_count + int(round(self.provider_count * staff_per_provider))
+        self.notes_options = {
+            "seed": seed, "mean_notes": mean_notes, "skew": skew, "max_notes": max_notes, "accounts": accounts,
+            "size_mix": size_mix, "missing_rate": missing_rate
+        }
+        self.notes = SyntheticNotes(**self.notes_options)
+        self.patients = patient_external_ids(self.patient_count, seed)
+
+    def users(self):
+        """
+        Yield the users: providers first, then the staff accounts.
+
+        Yields:
+            tuple: (email, first_name, last_name, role, country, active, ab_prac_id, adracare_account_id)
+        """
+        rng = random.Random(f"{self.seed}:users")
+        total = max(self.provider_count, len(self.notes.accounts))
+        for index in range(total):
+            provider = index < self.provider_count
+            account_id = self.notes.accounts[index] if index < len(self.notes.accounts) else None
+            yield (
+                f"{'provider' if provider else 'staff'}{index + 1}@example.test",
+                rng.choice(FIRST_NAMES),
+                rng.choice(LAST_NAMES),
+                "practitioner" if provider else "staff",
+                "CA",
+                rng.random() > 0.05 if provider else True,
+                f"AB{100000 + index}" if provider else None,
+                account_id
+            )
+
+    def appointment_rows(self):
+        """
+        Yield the appointments, patient by patient.
+
+        Patients are spread over providers by a Zipf distribution, so a few
+        providers have large panels; some patients also saw a second provider.
+
+        Yields:
+            tuple: (patient index, provider index, updated_at)
+        """
+        rng = random.Random(f"{self.seed}:appointments")
+        weights = [1 / (rank + 1) ** self.provider_skew for rank in range(self.provider_count)]
+        cumulative = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+        start = datetime(2020, 1, 1)
+        span = int((datetime(2026, 1, 1) - start).total_seconds())
+        providers = range(self.provider_count)
+        for patient in range(self.patient_count):
+            main = rng.choices(providers, cum_weights=cumulative)[0]
+            # Geometric number of visits with the main provider, at least one
+            visits = 1
+            while rng.random() > 1 / max(1.0, self.appointments):
+                visits += 1
+            for _ in range(visits):
+                yield patient, main, start + timedelta(seconds=rng.randrange(span))
+            if self.provider_count > 1 and rng.random() < self.shared_rate:
+                other = rng.choices(providers, cum_weights=cumulative)[0]
+                if other != main:
+                    yield patient, other, start + timedelta(seconds=rng.randrange(span))
+
+    def note_counts(self):
+        """
+        Summarize the note corpus without generating it.
+
+        Returns:
+            dict: Total notes, patients with notes, and the median, 99th percentile and
+            largest notes per patient
+        """
+        counts = sorted(self.notes.note_count(patient) for patient in self.patients)
+        return {
+            "total": sum(counts),
+            "patients_with_notes": sum(1 for count in counts if count),
+            "median": counts[len(counts) // 2],
+            "p99": counts[min(len(counts) - 1, int(len(counts) * 0.99))],
+            "max": counts[-1]
+        }
+
+    def seed_database(self, conn):
+        """
+        Append the dataset to a database with COPY.
+
+        New rows take IDs above the current maximum of each table, and the
+        sequences are moved past them, so existing rows are left alone.
+
+        Args:
+            conn: psycopg2 connection to a database with the users, patients and
+                appointments tables
+
+        Returns:
+            dict: "provider_ids" (user IDs for providers.json) and the rows copied per table
+        """
+        with conn, conn.cursor() as cursor:
+            cursor.execute("LOCK TABLE users, patients, appointments IN EXCLUSIVE MODE")
+            offsets = {}
+            for table in ("users", "patients", "appointments"):
+                cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+                offsets[table] = cursor.fetchone()[0]
+
+            users = _copy(cursor, "users (id, email, first_name, last_name, role, country, active, ab_prac_id, "
+                          "adracare_account_id)",
+                          ((offsets["users"] + index + 1, *user) for index, user in enumerate(self.users())))
+            patients = _copy(cursor, "patients (id, external_id)",
+                             ((offsets["patients"] + index + 1, external_id)
+                              for index, external_id in enumerate(self.patients)))
+            appointments = _copy(cursor, "appointments (id, patient_id, user_id, updated_at)", (
+                (offsets["appointments"] + index + 1, offsets["patients"] + patient + 1,
+                 offsets["users"] + provider + 1, updated_at)
+                for index, (patient, provider, updated_at) in enumerate(self.appointment_rows())
+            ))
+
+            for table in ("users", "patients", "appointments"):
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"
+                )
+            cursor.execute("ANALYZE users")
+            cursor.execute("ANALYZE patients")
+            cursor.execute("ANALYZE appointments")
+        return {
+            "provider_ids": [str(offsets["users"] + index + 1) for index in range(self.provider_count)],
+            "rows": {"users": users, "patients": patients, "appointments": appointments}
+        }
+
+    def manifest(self, seeded=None, database=None):
+        """
+        Describe the dataset for the mock API and for benchmark reports.
+
+        Args:
+            seeded (dict): Result of seed_database, if the dataset was seeded
+            database (str): Name of the seeded database
+
+        Returns:
+            dict: Parameters, the SyntheticNotes options ("notes"), counts and provider IDs
+        """
+        return {
+            "created_at": datetime.now().isoformat(),
+            "database": database,
+            "parameters": {
+                "scale": self.scale, "provider_skew": self.provider_skew, "appointments": self.appointments,
+                "shared_rate": self.shared_rate
+            },
+            "notes": self.notes_options,
+            "counts": {
+                "providers": self.provider_count,
+                "accounts": len(self.notes.accounts),
+                "patients": self.patient_count,
+                "notes": self.note_counts(),
+                "rows": seeded["rows"] if seeded else None
+            },
+            "provider_ids": seeded["provider_ids"] if seeded else None
+        }
+
+
+def _copy_value(value):
+    """Render a value in COPY's text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def _copy(cursor, target, rows):
+    """
+    Stream rows into a table with COPY, COPY_CHUNK_ROWS at a time.
+
+    Returns:
+        int: Rows copied
+    """
+    copied = 0
+    buffer = io.StringIO()
+    pending = 0
+    for row in rows:
+        buffer.write("\t".join(_copy_value(value) for value in row))
+        buffer.write("\n")
+        pending += 1
+        if pending == COPY_CHUNK_ROWS:
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {target} FROM STDIN", buffer)
+            copied += pending
+            buffer = io.StringIO()
+            pending = 0
+    if pending:
+        buffer.seek(0)
+        cursor.copy_expert(f"COPY {target} FROM STDIN", buffer)
+        copied += pending
+    return copied
+
+
+def dataset_from_arguments(args):
+    """Build the SyntheticDataset described by the command line options."""
+    return SyntheticDataset(args.scale, args.seed, args.provider_skew, args.appointments, args.shared_rate,
+                            args.staff_per_provider, args.mean_notes, args.skew, args.max_notes, args.size_mix,
+                            args.missing_rate, args.accounts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed PostgreSQL with a synthetic production-scale dataset")
+    parser.add_argument("--scale", type=float, default=1, help=f"size factor; 1 is {PATIENTS_PER_SCALE:,} patients")
+    parser.add_argument("--provider-skew", type=float, default=1.0, help="Zipf exponent of patients per provider")
+    parser.add_argument("--appointments", type=float, default=3, help="mean appointments per patient")
+    parser.add_argument("--shared-rate", type=float, default=0.2, help="share of patients seen by a second provider")
+    parser.add_argument("--staff-per-provider", type=float, default=1.0, help="authoring accounts without a practice ID")
+    add_arguments(parser)
+    parser.set_defaults(accounts=None)
+    parser.add_argument("--create", metavar="NAME", help="create database NAME with the schema and seed it "
+                        "(default: seed the configured DB_DATABASE)")
+    parser.add_argument("--manifest", default="dataset.json", help="file describing the dataset for the mock API")
+    parser.add_argument("--providers-file", help="also write the provider IDs to this providers.json")
+    parser.add_argument("--dry-run", action="store_true", help="print the counts without touching a database")
+    args = parser.parse_args()
+
+    dataset = dataset_from_arguments(args)
+    seeded = None
+    database = None
+    if not args.dry_run:
+        if args.create:
+            db_config = create_database(args.create)
+        else:
+            db_config = load_config()["db_config"]
+        database = db_config["database"]
+        print(f"Seeding {dataset.patient_count:,} patients and {dataset.provider_count:,} providers into {database}")
+        conn = psycopg2.connect(**db_config)
+        try:
+            seeded = dataset.seed_database(conn)
+        finally:
+            conn.close()
+        for table, rows in seeded["rows"].items():
+            print(f"  {table}: {rows:,} rows")
+        if args.providers_file:
+            with open(args.providers_file, "w") as f:
+                json.dump({"provider_ids": seeded["provider_ids"]}, f, indent=2)
+            print(f"Provider IDs written to {args.providers_file}")
+
+    manifest = dataset.manifest(seeded, database)
+    notes = manifest["counts"]["notes"]
+    print(f"Note corpus: {notes['total']:,} notes for {notes['patients_with_notes']:,} patients "
+          f"(median {notes['median']}, p99 {notes['p99']}, max {notes['max']} per patient)")
+    if not args.dry_run:
+        with open(args.manifest, "w") as f:
+            json.dump(manifest, f, indent=2)
+        print(f"Serve the notes with: python -m benchmarks.mock_api --dataset {args.manifest}")
+
+
+if __name__ == "__main__":
+    main()
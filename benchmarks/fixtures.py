@@ -0,0 +1,147 @@
+"""
+PostgreSQL databases for benchmarks.
+
+Creates databases next to the configured one with the subset of the
+application schema the import and load touch (users, patients,
+appointments, patient_notes); temporary_database drops its database again
+when the benchmark is done. benchmarks/dataset.py fills them. Connection
+settings come from the same DB_* variables as the import; the user needs
+the CREATEDB privilege.
+"""
+import os
+import uuid
+import random
+from contextlib import contextmanager
+import psycopg2
+from config.settings import load_config
+
+SCHEMA = [
+    """
+    CREATE TABLE users (
+        id SERIAL PRIMARY KEY,
+        email TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        role TEXT,
+        country TEXT,
+        active BOOLEAN NOT NULL DEFAULT true,
+        ab_prac_id TEXT,
+        adracare_account_id TEXT
+    )
+    """,
+    "CREATE INDEX users_adracare_account_id ON users (adracare_account_id)",
+    """
+    CREATE TABLE patients (
+        id SERIAL PRIMARY KEY,
+        external_id TEXT
+    )
+    """,
+    "CREATE INDEX patients_external_id ON patients (external_id)",
+    """
+    CREATE TABLE appointments (
+        id SERIAL PRIMARY KEY,
+        patient_id INTEGER REFERENCES patients (id),
+        user_id INTEGER REFERENCES users (id),
+        updated_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+    """,
+    "CREATE INDEX appointments_user_id ON appointments (user_id)",
+    "CREATE INDEX appointments_patient_id ON appointments (patient_id)",
+    """
+    CREATE TABLE patient_notes (
+        id SERIAL PRIMARY KEY,
+        notes TEXT,
+        patient_id INTEGER,
+        author_user_id INTEGER,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP
+    )
+    """
+]
+
+
+def server_config():
+    """Return the connection settings of the configured server's maintenance database."""
+    return {**load_config()["db_config"], "database": os.getenv("BENCH_ADMIN_DATABASE", "postgres")}
+
+
+def create_database(name, admin_config=None):
+    """
+    Create a database with the schema.
+
+    Args:
+        name (str): Name of the new database
+        admin_config (dict): Connection settings of a database to issue CREATE DATABASE
+            from (default: server_config())
+
+    Returns:
+        dict: Connection settings of the new database
+    """
+    admin_config = admin_config or server_config()
+    admin = psycopg2.connect(**admin_config)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        admin.close()
+    config = {**admin_config, "database": name}
+    conn = psycopg2.connect(**config)
+    try:
+        with conn, conn.cursor() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+    finally:
+        conn.close()
+    return config
+
+
+def drop_database(name, admin_config=None):
+    """Disconnect everyone from a database and drop it."""
+    admin = psycopg2.connect(**(admin_config or server_config()))
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = %s AND pid <> pg_backend_pid()",
+                (name,)
+            )
+            cursor.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    finally:
+        admin.close()
+
+
+@contextmanager
+def temporary_database(admin_config=None, prefix="adracare_bench"):
+    """
+    Create an empty database with the schema and drop it afterwards.
+
+    Args:
+        admin_config (dict): Connection settings of a database to issue CREATE/DROP
+            DATABASE from (default: server_config())
+        prefix (str): Start of the database name
+
+    Yields:
+        dict: Connection settings of the new database
+    """
+    admin_config = admin_config or server_config()
+    name = f"{prefix}_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+    try:
+        yield create_database(name, admin_config)
+    finally:
+        drop_database(name, admin_config)
+
+
+def patient_external_ids(count, seed=1):
+    """
+    Return Adracare-style patient IDs.
+
+    Args:
+        count (int): Number of patients
+        seed (int): Seed of the dataset
+
+    Returns:
+        list: UUID strings, the same for the same arguments
+    """
+    rng = random.Random(f"{seed}:patients")
+    return [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(count)]
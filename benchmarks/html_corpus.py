@@ -0,0 +1,111 @@
+"""
+Synthetic encounter note HTML modelled on the templates seen in Adracare.
+
+No real patient data is used; the documents only reproduce the markup
+patterns (editor output, pasted Word content, tables, entities, images)
+that the text extractor has to handle.
+"""
+import random
+
+TEMPLATES = [
+    # SOAP note from the rich text editor
+    (
+        "<p><strong>Subjective:</strong> {name} presents with {complaint} for {days} days.&nbsp;"
+        "Denies fever, chills or night sweats. Reports &quot;{quote}&quot;.</p>"
+        "<p><strong>Objective:</strong> BP {bp}, HR {hr}, Temp {temp}&deg;C, SpO<sub>2</sub> {spo2}%.</p>"
+        "<ul><li>Lungs: clear bilaterally</li><li>Heart: S1/S2 normal, no murmurs</li>"
+        "<li>Abdomen: soft, non-tender</li></ul>"
+        "<p><strong>Assessment:</strong> {assessment}</p>"
+        "<p><strong>Plan:</strong><br>1. {plan}<br/>2. Follow up in {weeks} weeks or sooner if symptoms worsen.<br />"
+        "3. Patient&#39;s questions answered; agrees with plan.</p>"
+    ),
+    # Intake form rendered as a table
+    (
+        "<h3>Intake Form</h3><table border=\"1\" style=\"width:100%;border-collapse:collapse\">"
+        "<tr><td><b>Reason for visit</b></td><td>{complaint}</td></tr>"
+        "<tr><td><b>Medications</b></td><td>{medication} {dose} mg daily</td></tr>"
+        "<tr><td><b>Allergies</b></td><td>NKDA</td></tr>"
+        "<tr><td><b>Pharmacy</b></td><td>{pharmacy} &ndash; {city}, AB</td></tr>"
+        "</table><p>Consent obtained for virtual care &amp; record sharing.</p>"
+    ),
+    # No-show boilerplate
+    "<p>Patient did not attend scheduled appointment. Left voicemail; will re-book.</p>",
+    "<p>No show.</p>",
+    # Content pasted from Word with conditional comments and Office namespaces
+    (
+        "<!--[if gte mso 9]><xml><o:OfficeDocumentSettings></o:OfficeDocumentSettings></xml><![endif]-->"
+        "<p class=\"MsoNormal\"><span style=\"font-family:'Calibri',sans-serif\">"
+        "Referral letter to Dr. {doctor} regarding {complaint}.<o:p></o:p></span></p>"
+        "<p class=\"MsoNormal\">Thank you for seeing this patient &#8211; {assessment}<o:p>&nbsp;</o:p></p>"
+    ),
+    # Prescription summary with an embedded signature image
+    (
+        "<div class=\"rx\"><p>Rx: {medication} {dose} mg PO {frequency} x {days} days, "
+        "dispense {quantity}, refills: {refills}</p>"
+        "<p>Signed electronically</p><img src=\"data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAAB\" "
+        "alt=\"signature\" width=\"120\"></div>"
+    ),
+    # Plain text note with smart punctuation and no markup at all
+    "Phone call with {name}. Results reviewed — {assessment}. They’re comfortable with the plan.",
+    # Notes that exercise the BeautifulSoup fallback
+    "<p>BP < 140/90 target discussed; A1c goal <7%.</p>",
+    "<p>Shared education link</p><script>trackClick('edu');</script><style>p{{margin:0}}</style>",
+]
+
+# Documents where the two engines once disagreed, added to every golden corpus
+EDGE_CASES = [
+    "<BR>Plan: rest</BR>Follow up",
+    "<BR>A</br>b",
+]
+
+FIELDS = {
+    "name": ["Patient", "Pt", "Client"],
+    "complaint": ["low back pain", "sore throat", "anxiety", "rash on left forearm", "medication refill"],
+    "days": [2, 3, 5, 7, 10, 14],
+    "quote": ["it hurts when I bend", "I can't sleep", "much better this week"],
+    "bp": ["118/76", "132/84", "145/92"],
+    "hr": [64, 72, 88, 101],
+    "temp": ["36.8", "37.2", "38.1"],
+    "spo2": [96, 98, 99],
+    "assessment": ["likely viral pharyngitis", "mechanical low back pain", "generalized anxiety disorder",
+                   "contact dermatitis"],
+    "plan": ["Ibuprofen 400 mg PO q6h PRN", "Sertraline 50 mg daily", "Topical hydrocortisone 1% BID"],
+    "weeks": [1, 2, 4, 6],
+    "medication": ["Amoxicillin", "Sertraline", "Ramipril", "Metformin"],
+    "dose": [5, 50, 250, 500],
+    "pharmacy": ["Shoppers Drug Mart", "London Drugs", "Rexall"],
+    "city": ["Calgary", "Edmonton", "Red Deer"],
+    "doctor": ["Smith", "Nguyen", "Tremblay"],
+    "frequency": ["daily", "BID", "TID"],
+    "quantity": [10, 30, 90],
+    "refills": [0, 1, 2],
+}
+
+
+def generate_note_html(rng):
+    """
+    Render one synthetic note.
+
+    Args:
+        rng (random.Random): Source of randomness
+
+    Returns:
+        str: Note HTML
+    """
+    template = rng.choice(TEMPLATES)
+    return template.format(**{key: rng.choice(values) for key, values in FIELDS.items()})
+
+
+def golden_corpus(size=500, seed=1234):
+    """
+    Build the deterministic document set used for golden comparisons.
+
+    Args:
+        size (int): Number of documents to generate
+        seed (int): Random seed
+
+    Returns:
+        list: HTML documents, followed by EDGE_CASES
+    """
+    rng = random.Random(seed)
+    return [generate_note_html(rng) for _ in range(size)] + EDGE_CASES
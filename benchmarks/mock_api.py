@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Adracare API, for load and throughput testing.
+
+Implements POST /account_token and GET /patients/{id}/encounter_notes with
+the behaviour the fetcher relies on: JSON:API pagination (page[size] and
+page[number], links.next/last, meta.total_count), sparse fieldsets,
+filter[id], filter[updated_at][gte], sort=-updated_at (echoed in meta.sort)
+and ETag revalidation.
+Latency, payload sizes, server errors, 429 throttling, unknown patients and
+token expiry are all configurable, so each performance feature of main.py
+can be measured reproducibly without touching the real API or PHI.
+
+Every patient ID is valid: a patient's notes are generated from a hash of
+the seed and the ID, so runs are repeatable, nothing is stored, and the
+same counts can be seeded into a database (see benchmarks/dataset.py, whose
+dataset.json --dataset reads the dataset options from). Run from the
+repository root and point ADRA_BASE_URL at it:
+
+    python -m benchmarks.mock_api --port 8765 --latency lognormal:-3:0.6 --throttle-rate 0.01
+    GET /__stats returns request, status and byte counts as JSON.
+"""
+import json
+import math
+import uuid
+import random
+import asyncio
+import hashlib
+import argparse
+from functools import lru_cache
+from urllib.parse import urlencode
+from datetime import datetime, timedelta, timezone
+from aiohttp import web
+from benchmarks.html_corpus import generate_note_html
+
+# Repeats of a template per note, with their weights: most notes are a single
+# template, some are long consults, a few carry pasted documents
+DEFAULT_SIZE_MIX = "0.75:1,0.2:4,0.05:24"
+
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution.
+
+    Args:
+        spec (str): "fixed:S", "uniform:LOW:HIGH", "exp:MEAN" or "lognormal:MU:SIGMA"
+            (seconds; lognormal parameters of the underlying normal)
+
+    Returns:
+        callable: Takes a random.Random and returns a delay in seconds
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(":")] if args else []
+    if kind == "fixed":
+        return lambda rng: values[0] if values else 0.0
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / values[0])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def parse_size_mix(spec):
+    """
+    Parse a payload size mix.
+
+    Args:
+        spec (str): Comma-separated WEIGHT:REPEATS pairs, e.g. "0.75:1,0.2:4,0.05:24"
+
+    Returns:
+        tuple: (repeats, weights)
+    """
+    pairs = [item.split(":") for item in spec.split(",") if item]
+    return [int(repeats) for _, repeats in pairs], [float(weight) for weight, _ in pairs]
+
+
+class SyntheticNotes:
+    """
+    Deterministic encounter notes for any patient ID.
+    """
+
+    def __init__(self, seed=1, mean_notes=20, skew=1.6, max_notes=2000, accounts=50, size_mix=DEFAULT_SIZE_MIX,
+                 missing_rate=0.0):
+        """
+        Initialize the generator.
+
+        Args:
+            seed (int): Seed mixed into every patient's notes
+            mean_notes (float): Mean notes per patient
+            skew (float): Pareto shape of the notes per patient; lower is more skewed,
+                values near 1 give a few patients with very many notes
+            max_notes (int): Cap on the notes of one patient
+            accounts (int): Number of authoring accounts (see account_ids)
+            size_mix (str): Payload size mix, see parse_size_mix
+            missing_rate (float): Share of patient IDs the API answers with 404
+        """
+        self.seed = seed
+        self.mean_notes = mean_notes
+        self.skew = skew
+        self.max_notes = max_notes
+        self.accounts = account_ids(accounts, seed)
+        self.repeats, self.weights = parse_size_mix(size_mix)
+        self.missing_rate = missing_rate
+        self.notes = lru_cache(maxsize=256)(self._notes)
+
+    def _rng(self, patient_id, purpose):
+        digest = hashlib.sha256(f"{self.seed}:{purpose}:{patient_id}".encode()).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def missing(self, patient_id):
+        """Tell whether the API answers 404 for a patient."""
+        return self.missing_rate > 0 and self._rng(patient_id, "missing").random() < self.missing_rate
+
+    def note_count(self, patient_id):
+        """
+        Return the number of notes of a patient.
+
+        Args:
+            patient_id (str): Adracare patient ID
+
+        Returns:
+            int: Note count, Pareto distributed with the configured mean
+        """
+        if self.skew <= 1:
+            raise ValueError("skew must be above 1 for the mean to exist")
+        scale = self.mean_notes * (self.skew - 1) / self.skew
+        # Shift so patients without notes occur, as they do in practice
+        count = int(scale * self._rng(patient_id, "count").paretovariate(self.skew) - scale / 2)
+        return max(0, min(self.max_notes, count))
+
+    def _notes(self, patient_id):
+        """Build a patient's note resources, oldest first."""
+        rng = self._rng(patient_id, "notes")
+        start = datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(days=rng.randrange(365))
+        notes = []
+        for index in range(self.note_count(patient_id)):
+            created = start + timedelta(days=index * rng.uniform(1, 14), seconds=rng.randrange(86400))
+            updated = created + timedelta(minutes=rng.choice((0, 0, 5, 30, 60 * 24)))
+            repeats = rng.choices(self.repeats, self.weights)[0]
+            body = "".join(generate_note_html(rng) for _ in range(repeats))
+            notes.append({
+                "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                "type": "encounter_notes",
+                "attributes": {
+                    "notes": body,
+                    "created_at": created.isoformat().replace("+00:00", "Z"),
+                    "updated_at": updated.isoformat().replace("+00:00", "Z"),
+                    "patient_id": patient_id,
+                    "created_by_account_id": rng.choice(self.accounts) if rng.random() > 0.02 else None
+                }
+            })
+        return notes
+
+
+def account_ids(count, seed=1):
+    """
+    Return the authoring account IDs notes are attributed to.
+
+    Args:
+        count (int): Number of accounts
+        seed (int): Seed of the dataset
+
+    Returns:
+        list: Account IDs, the same for the same arguments
+    """
+    rng = random.Random(f"{seed}:accounts")
+    return [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(count)]
+
+
+class MockAdracareAPI:
+    """
+    aiohttp application serving synthetic notes with injected latency and faults.
+    """
+
+    def __init__(self, notes=None, latency="fixed:0", error_rate=0.0, throttle_rate=0.0, retry_after=1,
+                 page_size=0, links="next", token_ttl=0, etags=True, sort=True, seed=1):
+        """
+        Initialize the server.
+
+        Args:
+            notes (SyntheticNotes): Note source (default: SyntheticNotes())
+            latency (str): Latency distribution per request, see parse_latency
+            error_rate (float): Share of requests answered with 500
+            throttle_rate (float): Share of requests answered with 429
+            retry_after (int): Retry-After seconds sent with 429
+            page_size (int): Page size used when the client sends none; 0 returns everything
+            links (str): Pagination style: "next", "last" (next and last links), "meta"
+                (meta.total_count only) or "cursor" (opaque page[cursor] next links and
+                meta.total_count; page[number] is ignored)
+            token_ttl (float): Seconds a token stays valid; 0 never expires
+            etags (bool): Send ETags and answer If-None-Match with 304
+            sort (bool): Apply sort=-updated_at and echo it in meta.sort; False ignores it
+            seed (int): Seed of the fault injection
+        """
+        self.notes = notes or SyntheticNotes()
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.page_size = page_size
+        self.links = links
+        self.token_ttl = token_ttl
+        self.etags = etags
+        self.sort = sort
+        self.rng = random.Random(seed)
+        self.tokens = {}
+        self.stats = {"requests": 0, "tokens": 0, "bytes": 0, "statuses": {}}
+
+    def application(self):
+        """Return the aiohttp application."""
+        app = web.Application()
+        app.router.add_post("/account_token", self.account_token)
+        app.router.add_get("/patients/{patient_id}/encounter_notes", self.encounter_notes)
+        app.router.add_get("/__stats", self.get_stats)
+        return app
+
+    def _count(self, status, size=0):
+        key = str(status)
+        self.stats["statuses"][key] = self.stats["statuses"].get(key, 0) + 1
+        self.stats["bytes"] += size
+
+    async def account_token(self, request):
+        token = uuid.uuid4().hex
+        self.tokens[token] = asyncio.get_running_loop().time()
+        self.stats["tokens"] += 1
+        return web.json_response({"jwt": token}, status=201)
+
+    def _authorized(self, request):
+        header = request.headers.get("Authorization", "")
+        issued = self.tokens.get(header[len("Bearer "):]) if header.startswith("Bearer ") else None
+        if issued is None:
+            return False
+        return not self.token_ttl or asyncio.get_running_loop().time() - issued < self.token_ttl
+
+    async def encounter_notes(self, request):
+        self.stats["requests"] += 1
+        await asyncio.sleep(self.latency(self.rng))
+        if not self._authorized(request):
+            self._count(401)
+            return web.json_response({"errors": [{"status": "401", "title": "Unauthorized"}]}, status=401)
+        draw = self.rng.random()
+        if draw < self.throttle_rate:
+            self._count(429)
+            return web.json_response({"errors": [{"status": "429", "title": "Too Many Requests"}]}, status=429,
+                                     headers={"Retry-After": str(self.retry_after)})
+        if draw < self.throttle_rate + self.error_rate:
+            self._count(500)
+            return web.json_response({"errors": [{"status": "500", "title": "Internal Server Error"}]}, status=500)
+
+        patient_id = request.match_info["patient_id"]
+        if self.notes.missing(patient_id):
+            self._count(404)
+            return web.json_response({"errors": [{"status": "404", "title": "Not Found"}]}, status=404)
+
+        query = request.query
+        notes = self.notes.notes(patient_id)
+        if "filter[id]" in query:
+            wanted = set(query["filter[id]"].split(","))
+            notes = [note for note in notes if note["id"] in wanted]
+        if "filter[updated_at][gte]" in query:
+            since = query["filter[updated_at][gte]"]
+            notes = [note for note in notes if note["attributes"]["updated_at"] >= since]
+        sort = self.sort and query.get("sort") == "-updated_at"
+        if sort:
+            notes = sorted(notes, key=lambda note: note["attributes"]["updated_at"], reverse=True)
+        fields = query.get("fields[encounter_notes]")
+        if fields is not None:
+            keep = set(fields.split(","))
+            notes = [{**note, "attributes": {key: value for key, value in note["attributes"].items() if key in keep}}
+                     for note in notes]
+
+        body = {"data": notes}
+        size = int(query.get("page[size]", self.page_size) or 0)
+        if size:
+            if self.links == "cursor":
+                cursor = query.get("page[cursor]", "")
+                number = int(cursor[1:], 16) if cursor.startswith("c") else 1
+            else:
+                number = max(1, int(query.get("page[number]", "1")))
+            pages = max(1, math.ceil(len(notes) / size))
+            body["data"] = notes[(number - 1) * size:number * size]
+            base = f"{request.path}?"
+            others = [(key, value) for key, value in query.items()
+                      if key not in ("page[number]", "page[size]", "page[cursor]")]
+
+            def page_url(page):
+                return base + urlencode(others + [("page[number]", page), ("page[size]", size)])
+
+            if self.links == "cursor":
+                body["meta"] = {"total_count": len(notes)}
+                if number < pages:
+                    body["links"] = {"next": base + urlencode(others + [("page[cursor]", f"c{number + 1:x}"),
+                                                                        ("page[size]", size)])}
+            elif self.links in ("next", "last"):
+                body["links"] = {"self": page_url(number)}
+                if number < pages:
+                    body["links"]["next"] = page_url(number + 1)
+                if self.links == "last":
+                    body["links"]["last"] = page_url(pages)
+            else:
+                body["meta"] = {"total_count": len(notes)}
+        if sort:
+            # Echo the sort applied, which lets the client stop at the sync watermark
+            body.setdefault("meta", {})["sort"] = "-updated_at"
+
+        payload = json.dumps(body).encode("utf-8")
+        headers = {}
+        if self.etags:
+            etag = '"' + hashlib.md5(payload).hexdigest() + '"'
+            headers["ETag"] = etag
+            if request.headers.get("If-None-Match") == etag:
+                self._count(304)
+                return web.Response(status=304, headers=headers)
+        self._count(200, len(payload))
+        return web.Response(body=payload, content_type="application/vnd.api+json", headers=headers)
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+
+async def start_mock_api(api=None, host="127.0.0.1", port=8765):
+    """
+    Serve a mock API from the running event loop.
+
+    Args:
+        api (MockAdracareAPI): Server to run (default: MockAdracareAPI())
+        host (str): Address to listen on
+        port (int): Port to listen on; 0 picks a free one
+
+    Returns:
+        tuple: (web.AppRunner to clean up when done, base URL)
+    """
+    api = api or MockAdracareAPI()
+    runner = web.AppRunner(api.application(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner, f"http://{host}:{runner.addresses[0][1]}"
+
+
+def add_arguments(parser):
+    """Add the dataset and fault options shared with other benchmark tools."""
+    parser.add_argument("--seed", type=int, default=1, help="dataset and fault injection seed")
+    parser.add_argument("--mean-notes", type=float, default=20, help="mean notes per patient")
+    parser.add_argument("--skew", type=float, default=1.6, help="Pareto shape of notes per patient (above 1)")
+    parser.add_argument("--max-notes", type=int, default=2000, help="cap on notes per patient")
+    parser.add_argument("--accounts", type=int, default=50, help="number of authoring accounts")
+    parser.add_argument("--size-mix", default=DEFAULT_SIZE_MIX, help="WEIGHT:REPEATS pairs of note body sizes")
+    parser.add_argument("--missing-rate", type=float, default=0.0, help="share of patients answered with 404")
+
+
+def notes_from_arguments(args):
+    """Build the SyntheticNotes described by the options of add_arguments."""
+    return SyntheticNotes(args.seed, args.mean_notes, args.skew, args.max_notes, args.accounts, args.size_mix,
+                          args.missing_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock Adracare API with synthetic encounter notes")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    add_arguments(parser)
+    parser.add_argument("--dataset", help="dataset.json from benchmarks.dataset; replaces the dataset options")
+    parser.add_argument("--latency", default="fixed:0", help="fixed:S, uniform:LOW:HIGH, exp:MEAN or lognormal:MU:SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429")
+    parser.add_argument("--page-size", type=int, default=0, help="page size when the client sends none; 0 disables")
+    parser.add_argument("--links", choices=("next", "last", "meta", "cursor"), default="next", help="pagination style")
+    parser.add_argument("--token-ttl", type=float, default=0, help="seconds a token stays valid; 0 never expires")
+    parser.add_argument("--no-etags", action="store_true", help="do not send ETags or answer 304")
+    parser.add_argument("--ignore-sort", action="store_true", help="ignore sort=-updated_at")
+    args = parser.parse_args()
+
+    if args.dataset:
+        with open(args.dataset) as f:
+            notes = SyntheticNotes(**json.load(f)["notes"])
+    else:
+        notes = notes_from_arguments(args)
+    api = MockAdracareAPI(
+        notes, args.latency, args.error_rate, args.throttle_rate, args.retry_after,
+        args.page_size, args.links, args.token_ttl, not args.no_etags, not args.ignore_sort, args.seed
+    )
+
+    async def serve():
+        runner, url = await start_mock_api(api, args.host, args.port)
+        print(f"Mock Adracare API listening on {url} (set ADRA_BASE_URL={url})")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print(json.dumps(api.stats))
+
+
+if __name__ == "__main__":
+    main()
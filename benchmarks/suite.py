@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmarks with regression baselines.
+
+Micro benchmarks time the per-note hot paths (extract_text_from_html,
+extract_notes_data, Database._format_properly_escaped_sql,
+SQLExecutor.split_sql_statements and SQLWriter). The pipeline benchmark
+seeds a throwaway PostgreSQL database with a SyntheticDataset (see
+benchmarks/fixtures.py and benchmarks/dataset.py), runs main_async against
+the mock API (benchmarks/mock_api.py) and loads the resulting SQL with
+SQLExecutor, reporting patients/s, notes/s and rows/s. Benchmarks needing a
+database are skipped, with the reason recorded, when none is reachable.
+
+Run from the repository root:
+
+    python -m benchmarks.suite run --save-baseline main
+    python -m benchmarks.suite run --output current.json
+    python -m benchmarks.suite compare main current.json --threshold 0.1
+
+compare exits with status 1 if any metric regressed by more than the threshold.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import platform
+import argparse
+import tempfile
+import contextlib
+import subprocess
+from datetime import datetime
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _metric(value, unit, higher_is_better):
+    return {"value": round(value, 4), "unit": unit, "higher_is_better": higher_is_better}
+
+
+def _best_of(repeat, function):
+    """Return the shortest of repeat timings of function()."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _synthetic_responses(args):
+    """Return (patient_id, encounter_notes response) pairs from the mock API's dataset."""
+    from benchmarks.fixtures import patient_external_ids
+    from benchmarks.mock_api import SyntheticNotes
+    notes = SyntheticNotes(seed=args.seed, mean_notes=args.mean_notes)
+    responses = []
+    total = 0
+    for patient_id in patient_external_ids(args.notes, args.seed):
+        data = notes.notes(patient_id)
+        responses.append((patient_id, {"data": data}))
+        total += len(data)
+        if total >= args.notes:
+            break
+    return responses
+
+
+def bench_html_extraction(args, db_config=None):
+    """Time extract_text_from_html per note over the golden corpus."""
+    from benchmarks.html_corpus import golden_corpus
+    from utils.text_processing import extract_text_from_html
+    documents = golden_corpus(args.notes, seed=args.seed)
+    elapsed = _best_of(args.repeat, lambda: [extract_text_from_html(document) for document in documents])
+    return {"html_extraction_us_per_note": _metric(elapsed / len(documents) * 1e6, "us/note", False)}
+
+
+def bench_extract_notes_data(args, db_config=None):
+    """Time extract_notes_data per note over decoded mock API responses."""
+    from api.adracare import extract_notes_data
+    responses = [response for _, response in _synthetic_responses(args)]
+    count = sum(len(response["data"]) for response in responses)
+    elapsed = _best_of(args.repeat, lambda: [extract_notes_data(response) for response in responses])
+    return {"extract_notes_data_us_per_note": _metric(elapsed / count * 1e6, "us/note", False)}
+
+
+def _render_sql(responses):
+    """Render notes the way write_sql_async lays out output.sql, quoting by hand."""
+    parts = []
+    for patient_id, response in responses:
+        for note in response["data"]:
+            text = note["attributes"]["notes"].replace("'", "''")
+            parts.append(
+                f"-- note_id: {note['id']}, patient_id: {patient_id}\n"
+                "\n        INSERT INTO patient_notes (notes, patient_id, author_user_id, created_at, updated_at)\n"
+                f"        VALUES ('{text}', 1, 1, '{note['attributes']['created_at']}' AT TIME ZONE 'UTC', "
+                f"'{note['attributes']['updated_at']}' AT TIME ZONE 'UTC')\n        RETURNING id;\n\n"
+            )
+    return "".join(parts)
+
+
+def bench_split_sql_statements(args, db_config=None):
+    """Time SQLExecutor.split_sql_statements per statement."""
+    from inserts import SQLExecutor
+    sql = _render_sql(_synthetic_responses(args))
+    with tempfile.TemporaryDirectory() as directory:
+        executor = SQLExecutor(log_dir=directory, tracking_file=os.path.join(directory, "tracking.json"))
+        count = len(executor.split_sql_statements(sql))
+        elapsed = _best_of(args.repeat, lambda: executor.split_sql_statements(sql))
+    return {"split_sql_statements_us_per_note": _metric(elapsed / count * 1e6, "us/note", False)}
+
+
+def bench_sql_writer(args, db_config=None):
+    """Time SQLWriter per statement, checkpointing every 20 notes without fsync."""
+    from benchmarks.bench_sql_writer import run_variant, sql_writer_variant, synthetic_patients
+    patients = synthetic_patients(args.notes, 20, args.seed)
+    write = sql_writer_variant(4 * 2**20, "never")
+    with tempfile.TemporaryDirectory() as directory:
+        elapsed = min(run_variant(write, patients, directory)[0] for _ in range(args.repeat))
+    return {"sql_writer_us_per_note": _metric(elapsed / args.notes * 1e6, "us/note", False)}
+
+
+def bench_format_sql(args, db_config):
+    """Time Database._format_properly_escaped_sql per note against a real connection."""
+    from db.database import Database
+    from utils.text_processing import extract_text_from_html
+    template = """
+        INSERT INTO patient_notes (notes, patient_id, author_user_id, created_at, updated_at)
+        VALUES (%s, %s, %s, %s AT TIME ZONE 'UTC', %s AT TIME ZONE 'UTC')
+        RETURNING id;
+        """
+    params = [
+        (extract_text_from_html(note["attributes"]["notes"]), 1, 1, note["attributes"]["created_at"],
+         note["attributes"]["updated_at"])
+        for _, response in _synthetic_responses(args) for note in response["data"]
+    ]
+    db = Database(db_config)
+    if not db.connect():
+        raise RuntimeError("cannot connect to the benchmark database")
+    try:
+        elapsed = _best_of(args.repeat, lambda: [db._format_properly_escaped_sql(template, p) for p in params])
+    finally:
+        db.close()
+    return {"format_sql_us_per_note": _metric(elapsed / len(params) * 1e6, "us/note", False)}
+
+
+@contextlib.contextmanager
+def _environment(**values):
+    """Set environment variables (and restore them) for a run of the import."""
+    previous = {key: os.environ.get(key) for key in values}
+    os.environ.update({key: str(value) for key, value in values.items()})
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def bench_pipeline(args, db_config):
+    """Run the import against the mock API and load its output into the database."""
+    import psycopg2
+    import main
+    from inserts import SQLExecutor
+    from benchmarks.dataset import SyntheticDataset
+    from benchmarks.mock_api import MockAdracareAPI, start_mock_api
+
+    dataset = SyntheticDataset(args.scale, args.seed, mean_notes=args.mean_notes)
+    conn = psycopg2.connect(**db_config)
+    try:
+        provider_ids = dataset.seed_database(conn)["provider_ids"]
+    finally:
+        conn.close()
+
+    previous_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            with open("providers.json", "w") as f:
+                json.dump({"provider_ids": provider_ids}, f)
+
+            async def run_import():
+                api = MockAdracareAPI(dataset.notes, latency=args.latency, seed=args.seed)
+                runner, url = await start_mock_api(api, port=0)
+                try:
+                    with _environment(ADRA_BASE_URL=url, ADRA_USERNAME="bench", ADRA_PASSWORD="bench"):
+                        started = time.perf_counter()
+                        await main.main_async()
+                        return time.perf_counter() - started
+                finally:
+                    await runner.cleanup()
+
+            with _environment(DB_HOST=db_config["host"], DB_PORT=db_config["port"], DB_DATABASE=db_config["database"],
+                              DB_USER=db_config["user"], DB_PASSWORD=db_config["password"], DEFAULT_AUTHOR_ID=provider_ids[0],
+                              BATCH_DELAY=0, LOG_LEVEL="WARNING", PROGRESS_TTY="false"):
+                import_seconds = asyncio.run(run_import())
+
+            with open("results.json") as f:
+                patients = len(json.load(f)["patients"])
+            with open("output.sql") as f:
+                written = sum(1 for line in f if line.startswith("-- note_id:"))
+
+            executor = SQLExecutor(db_config=db_config, log_dir="logs", tracking_file="tracking.json")
+            with _environment(PROGRESS_TTY="false"), contextlib.redirect_stdout(sys.stderr):
+                started = time.perf_counter()
+                loaded, failed, _ = executor.execute_sql_file("output.sql", mode="new")
+                load_seconds = time.perf_counter() - started
+        finally:
+            os.chdir(previous_directory)
+
+    if failed:
+        raise RuntimeError(f"{failed} statements failed to load")
+    return {
+        "pipeline_patients_per_second": _metric(patients / import_seconds, "patients/s", True),
+        "pipeline_notes_per_second": _metric(written / import_seconds, "notes/s", True),
+        "load_rows_per_second": _metric(loaded / load_seconds, "rows/s", True)
+    }
+
+
+# name: (function, needs a database)
+BENCHMARKS = {
+    "html_extraction": (bench_html_extraction, False),
+    "extract_notes_data": (bench_extract_notes_data, False),
+    "split_sql_statements": (bench_split_sql_statements, False),
+    "sql_writer": (bench_sql_writer, False),
+    "format_sql": (bench_format_sql, True),
+    "pipeline": (bench_pipeline, True)
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPOSITORY, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """
+    Run the selected benchmarks.
+
+    Returns:
+        dict: Environment, parameters, "metrics" and "skipped" benchmarks with reasons
+    """
+    from benchmarks.fixtures import temporary_database
+    selected = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        raise SystemExit(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {key: getattr(args, key) for key in ("notes", "scale", "mean_notes", "repeat", "seed",
+                                                           "latency")},
+        "metrics": {},
+        "skipped": {}
+    }
+
+    with contextlib.ExitStack() as stack:
+        db_config = None
+        if any(BENCHMARKS[name][1] for name in selected):
+            if args.no_db:
+                db_reason = "--no-db"
+            else:
+                try:
+                    db_config = stack.enter_context(temporary_database())
+                except Exception as e:
+                    db_reason = f"no database: {str(e).strip().splitlines()[0]}"
+        for name in selected:
+            function, needs_db = BENCHMARKS[name]
+            if needs_db and db_config is None:
+                report["skipped"][name] = db_reason
+                print(f"{name}: skipped ({db_reason})")
+                continue
+            metrics = function(args, db_config)
+            report["metrics"].update(metrics)
+            for metric, result in metrics.items():
+                print(f"{metric}: {result['value']} {result['unit']}")
+    return report
+
+
+def _load_report(name):
+    """Load a report from a path or a baseline name."""
+    path = name if os.path.exists(name) else os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold):
+    """
+    Compare two reports.
+
+    Args:
+        baseline (dict): Reference report
+        current (dict): Report to check
+        threshold (float): Relative change beyond which a metric is flagged
+
+    Returns:
+        tuple: (table text, list of regressed metric names)
+    """
+    lines = [f"{'Metric':<36}{'Baseline':>12}{'Current':>12}{'Change':>9}  Unit"]
+    regressions = []
+    for metric, base in baseline["metrics"].items():
+        result = current["metrics"].get(metric)
+        if result is None:
+            lines.append(f"{metric:<36}{base['value']:>12}{'-':>12}{'':>9}  {base['unit']} (not measured)")
+            continue
+        change = (result["value"] - base["value"]) / base["value"] if base["value"] else 0.0
+        worse = -change if base["higher_is_better"] else change
+        flag = ""
+        if worse > threshold:
+            regressions.append(metric)
+            flag = "  REGRESSION"
+        elif -worse > threshold:
+            flag = "  improved"
+        lines.append(f"{metric:<36}{base['value']:>12}{result['value']:>12}{change:>+9.1%}  {base['unit']}{flag}")
+    return "\n".join(lines), regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmarks with regression baselines")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--only", help=f"comma-separated subset of: {', '.join(BENCHMARKS)}")
+    run_parser.add_argument("--notes", type=int, default=2000, help="notes used by the micro benchmarks")
+    run_parser.add_argument("--scale", type=float, default=0.2,
+                            help="size of the pipeline benchmark's dataset; 1 is 1,000 patients (see benchmarks.dataset)")
+    run_parser.add_argument("--mean-notes", type=float, default=20, help="mean notes per patient")
+    run_parser.add_argument("--latency", default="fixed:0", help="mock API latency distribution")
+    run_parser.add_argument("--repeat", type=int, default=3, help="repetitions of each micro benchmark (best is kept)")
+    run_parser.add_argument("--seed", type=int, default=1, help="dataset seed")
+    run_parser.add_argument("--no-db", action="store_true", help="skip the benchmarks that need PostgreSQL")
+    run_parser.add_argument("--output", help="write the report to this file")
+    run_parser.add_argument("--save-baseline", metavar="NAME", help=f"write the report to {BASELINE_DIR}/NAME.json")
+
+    compare_parser = commands.add_parser("compare", help="compare a report with a baseline")
+    compare_parser.add_argument("baseline", help="baseline name or report path")
+    compare_parser.add_argument("current", help="baseline name or report path")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="relative change flagged (default 0.10)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = run(args)
+        paths = [args.output] if args.output else []
+        if args.save_baseline:
+            os.makedirs(BASELINE_DIR, exist_ok=True)
+            paths.append(os.path.join(BASELINE_DIR, f"{args.save_baseline}.json"))
+        for path in paths:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Report written to {path}")
+    else:
+        table, regressions = compare(_load_report(args.baseline), _load_report(args.current), args.threshold)
+        print(table)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -124,9 +124,69 @@ def load_config(fetch_patient_ids=False, db=None):
             "database": os.getenv("DB_DATABASE", "rocketdoctor_development"),
             "user": os.getenv("DB_USER", "postgres"),
             "password": os.getenv("DB_PASSWORD", "")
-        }
+        },
+        "note_ledger": {
+            "path": os.getenv("NOTE_LEDGER_PATH", "processed_notes.db"),
+            "capacity": int(os.getenv("NOTE_FILTER_CAPACITY", "2000000")),
+            "error_rate": float(os.getenv("NOTE_FILTER_ERROR_RATE", "0.001"))
+        },
+        "http_cache": {
+            "directory": os.getenv("HTTP_CACHE_DIR", ""),
+            "max_bytes": int(os.getenv("HTTP_CACHE_MAX_MB", "512")) * 2**20,
+            "ttl": int(os.getenv("HTTP_CACHE_TTL", "0"))
+        },
+        "request_hedging": {
+            "enabled": os.getenv("REQUEST_HEDGING", "false").lower() in ("1", "true", "yes"),
+            "percentile": float(os.getenv("HEDGE_PERCENTILE", "95")),
+            "max_fraction": float(os.getenv("HEDGE_MAX_FRACTION", "0.05")),
+            "min_samples": int(os.getenv("HEDGE_MIN_SAMPLES", "20")),
+            "min_delay": float(os.getenv("HEDGE_MIN_DELAY", "1.0"))
+        },
+        "metrics": {
+            "port": int(os.getenv("METRICS_PORT", "0")),
+            "textfile": os.getenv("METRICS_TEXTFILE", ""),
+            "interval": float(os.getenv("METRICS_INTERVAL", "15"))
+        },
+        "logging": {
+            "level": os.getenv("LOG_LEVEL", "INFO"),
+            "fmt": os.getenv("LOG_FORMAT", "text"),
+            "file": os.getenv("LOG_FILE", ""),
+            "burst": int(os.getenv("LOG_RATE_LIMIT", "20")),
+            "interval": float(os.getenv("LOG_RATE_INTERVAL", "10"))
+        },
+        "progress": {
+            "interval": float(os.getenv("PROGRESS_INTERVAL", "2")),
+            "status_file": os.getenv("PROGRESS_FILE", ""),
+            "tty": os.getenv("PROGRESS_TTY", "auto")
+        },
+        "html_extractor": os.getenv("HTML_EXTRACTOR", "stream"),
+        "html_cache_size": int(os.getenv("HTML_CACHE_SIZE", "10000")),
+        "output_file": os.getenv("OUTPUT_FILE", "output.sql"),
+        "output": {
+            "buffer_size": int(float(os.getenv("OUTPUT_BUFFER_KB", "4096")) * 1024),
+            "flush_interval": float(os.getenv("OUTPUT_FLUSH_INTERVAL", "5")),
+            "fsync": os.getenv("OUTPUT_FSYNC", "checkpoint"),
+            "fsync_interval": float(os.getenv("OUTPUT_FSYNC_INTERVAL", "30")),
+            "segment_size": int(float(os.getenv("OUTPUT_SEGMENT_MB", "0")) * 2**20),
+            # Unset or empty uses the format's default level; 0 is a level of its own (gzip: store only)
+            "compression_level": (int(os.getenv("OUTPUT_COMPRESSION_LEVEL"))
+                                  if os.getenv("OUTPUT_COMPRESSION_LEVEL", "") else None)
+        },
+        "note_memory": {
+            "limit": int(float(os.getenv("NOTE_MEMORY_BUDGET_MB", "0")) * 2**20),
+            "directory": os.getenv("NOTE_SPILL_DIR", "")
+        },
+        "notes_page_size": int(os.getenv("NOTES_PAGE_SIZE", "0")),
+        "notes_page_prefetch": int(os.getenv("NOTES_PAGE_PREFETCH", "4")),
+        "notes_sparse_fetch": os.getenv("NOTES_SPARSE_FETCH", "false").lower() in ("1", "true", "yes"),
+        "notes_sparse_batch_size": int(os.getenv("NOTES_SPARSE_BATCH_SIZE", "50")),
+        "patient_order": os.getenv("PATIENT_ORDER", "longest-first"),
+        "batch_delay": float(os.getenv("BATCH_DELAY", "2")),
+        "dead_letter_max_attempts": int(os.getenv("DEAD_LETTER_MAX_ATTEMPTS", "3")),
+        "incremental_sync": os.getenv("INCREMENTAL_SYNC", "false").lower() in ("1", "true", "yes"),
+        "notes_updated_filter": os.getenv("NOTES_UPDATED_FILTER", "filter[updated_at][gte]")
     }
-    
+
     # If fetch_patient_ids is True, read provider IDs from providers.json and fetch patient IDs
     if fetch_patient_ids:
         if not db:
@@ -446,6 +446,9 @@ Database connection and operations handler for ID mapping.
 """
 import psycopg2
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class Database:
@@ -474,7 +477,7 @@ class Database:
             self.conn = psycopg2.connect(**self.db_config)
             return True
         except Exception as e:
-            print(f"Database connection error: {e}")
+            logger.error("Database connection error: %s", e)
             return False
     
     def close(self):
@@ -491,7 +494,10 @@ class Database:
             external_id (str): External patient ID from Adracare
             
         Returns:
-            int or None: Local patient ID if found, None otherwise
+            int or None: Local patient ID if found, None if there is no such patient
+            
+        Raises:
+            Exception: If the query fails; the transaction is rolled back first
         """
         try:
             cursor = self.conn.cursor()
@@ -504,8 +510,9 @@ class Database:
                 return result[0]
             return None
         except Exception as e:
-            print(f"Error finding local patient ID: {e}")
-            return None
+            logger.error("Error finding local patient ID: %s", e)
+            self.conn.rollback()
+            raise
     
     def get_local_author_id(self, adracare_account_id):
         """
@@ -528,7 +535,8 @@ class Database:
                 return result[0]
             return None
         except Exception as e:
-            print(f"Error finding local author ID: {e}")
+            logger.error("Error finding local author ID: %s", e)
+            self.conn.rollback()
             return None
 
     def _format_properly_escaped_sql(self, template, params):
@@ -562,7 +570,7 @@ class Database:
             formatted_sql = cursor.mogrify(template, tuple(safe_params)).decode('utf-8')
             return formatted_sql
         except Exception as e:
-            print(f"Error formatting SQL: {e}")
+            logger.error("Error formatting SQL: %s", e)
             # Fallback with manual escaping
             safe_params = []
             for p in params:
@@ -611,7 +619,7 @@ class Database:
             result = cursor.fetchall()
             return [row[0] for row in result] if result else []
         except Exception as e:
-            print(f"Error fetching patient IDs for provider {provider_id}: {e}")
+            logger.error("Error fetching patient IDs for provider %s: %s", provider_id, e)
             return []
 
     def get_external_id_by_patient_id(self, patient_id):
@@ -633,5 +641,61 @@ class Database:
             result = cursor.fetchone()
             return result[0] if result else None
         except Exception as e:
-            print(f"Error fetching external ID for patient {patient_id}: {e}")
-            return None
\ No newline at end of file
+            logger.error("Error fetching external ID for patient %s: %s", patient_id, e)
+            return None
+
+    def get_appointment_activity(self, external_ids):
+        """
+        Get the latest appointment activity for each patient.
+        
+        Args:
+            external_ids (list): External patient IDs from Adracare
+            
+        Returns:
+            dict: Mapping of external patient ID to the latest appointment
+            updated_at (ISO string) for patients that have appointments
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT p.external_id, MAX(a.updated_at) FROM appointments a "
+                "JOIN patients p ON p.id = a.patient_id "
+                "WHERE p.external_id = ANY(%s) GROUP BY p.external_id",
+                (list(external_ids),)
+            )
+            return {
+                external_id: updated_at.isoformat() if hasattr(updated_at, "isoformat") else str(updated_at)
+                for external_id, updated_at in cursor.fetchall()
+                if updated_at is not None
+            }
+        except Exception as e:
+            logger.error("Error fetching appointment activity: %s", e)
+            # Leave the connection usable for the lookups that follow
+            self.conn.rollback()
+            return {}
+
+    def get_appointment_counts(self, external_ids):
+        """
+        Count each patient's appointments.
+        
+        Args:
+            external_ids (list): External patient IDs from Adracare
+            
+        Returns:
+            dict: Mapping of external patient ID to appointment count for
+            patients that have appointments
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                "SELECT p.external_id, COUNT(*) FROM appointments a "
+                "JOIN patients p ON p.id = a.patient_id "
+                "WHERE p.external_id = ANY(%s) GROUP BY p.external_id",
+                (list(external_ids),)
+            )
+            return dict(cursor.fetchall())
+        except Exception as e:
+            logger.error("Error counting appointments: %s", e)
+            # Leave the connection usable for the lookups that follow
+            self.conn.rollback()
+            return {}
@@ -0,0 +1,513 @@
+"""
+On-disk ledger of processed encounter notes.
+
+The ledger is a SQLite file so membership checks never require the full
+history to be loaded into memory. A memory-mapped Bloom filter sits in front
+of it so that the common case (a note that has never been seen) is answered
+without touching SQLite at all.
+"""
+import os
+import sqlite3
+import logging
+from datetime import datetime
+from utils.bloom import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+
+class NoteLedger:
+    """
+    Processed-note ledger with a Bloom filter pre-check.
+    """
+
+    def __init__(self, path="processed_notes.db", capacity=2000000, error_rate=0.001):
+        """
+        Initialize the ledger.
+
+        Args:
+            path (str): Path of the SQLite ledger file
+            capacity (int): Expected number of notes, used to size the Bloom filter
+            error_rate (float): Target false positive rate of the Bloom filter
+        """
+        self.path = path
+        self.filter_path = f"{path}.bloom"
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.conn = None
+        self.filter = None
+
+    def open(self):
+        """
+        Open the ledger and its filter, creating both if needed.
+
+        Any ledger rows written after the filter was last flushed (for example
+        after a crash) are replayed into the filter before it is used.
+        """
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS processed_notes (
+                note_id TEXT PRIMARY KEY,
+                patient_id TEXT,
+                local_patient_id INTEGER,
+                external_patient_id TEXT,
+                created_at TEXT,
+                processed_at TEXT,
+                sql_generated INTEGER,
+                updated_at TEXT
+            )
+            """
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(processed_notes)")]
+        if "updated_at" not in columns:
+            self.conn.execute("ALTER TABLE processed_notes ADD COLUMN updated_at TEXT")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS patient_sync (
+                external_patient_id TEXT PRIMARY KEY,
+                notes_updated_at TEXT,
+                appointments_updated_at TEXT,
+                synced_at TEXT
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at TEXT,
+                finished_at TEXT,
+                status TEXT,
+                output_path TEXT,
+                output_offset INTEGER
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS run_patients (
+                run_id INTEGER,
+                position INTEGER,
+                external_patient_id TEXT,
+                state TEXT,
+                notes_found INTEGER,
+                notes_written INTEGER,
+                error TEXT,
+                updated_at TEXT,
+                PRIMARY KEY (run_id, external_patient_id)
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                external_patient_id TEXT PRIMARY KEY,
+                reason TEXT,
+                permanent INTEGER,
+                error TEXT,
+                attempts INTEGER,
+                first_failed_at TEXT,
+                last_failed_at TEXT
+            )
+            """
+        )
+        self.conn.commit()
+
+        try:
+            self.filter = BloomFilter(self.filter_path, self.capacity, self.error_rate)
+        except ValueError as e:
+            logger.warning("Rebuilding note filter: %s", e)
+            os.remove(self.filter_path)
+            self.filter = BloomFilter(self.filter_path, self.capacity, self.error_rate)
+
+        self._sync_filter()
+
+    def _sync_filter(self):
+        """Add ledger rows the filter has not seen yet."""
+        cursor = self.conn.execute(
+            "SELECT rowid, note_id FROM processed_notes WHERE rowid > ? ORDER BY rowid",
+            (self.filter.watermark,)
+        )
+        last_rowid = self.filter.watermark
+        for rowid, note_id in cursor:
+            self.filter.add(note_id)
+            last_rowid = rowid
+        self.filter.flush(last_rowid)
+
+        if self.filter.count > self.filter.capacity:
+            logger.warning(
+                "Note filter holds %d notes, above its capacity of %d; delete %s and raise "
+                "NOTE_FILTER_CAPACITY to restore its accuracy",
+                self.filter.count, self.filter.capacity, self.filter_path
+            )
+
+    def __contains__(self, note_id):
+        if note_id is None:
+            return False
+        note_id = str(note_id)
+        if note_id not in self.filter:
+            return False
+        cursor = self.conn.execute("SELECT 1 FROM processed_notes WHERE note_id = ?", (note_id,))
+        return cursor.fetchone() is not None
+
+    def record_note(self, note_id, patient_id, local_patient_id, external_patient_id, created_at, updated_at=None):
+        """
+        Record a note as processed.
+
+        The filter is updated before the row is committed, so an interrupted
+        run can only leave extra bits set, never missing ones.
+
+        Args:
+            note_id (str): Adracare note ID
+            patient_id (str): Patient ID reported on the note
+            local_patient_id (int): Local patient ID
+            external_patient_id (str): Adracare patient ID
+            created_at (str): Note creation timestamp
+            updated_at (str): Note update timestamp, used to detect later changes
+        """
+        note_id = str(note_id)
+        self.filter.add(note_id)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO processed_notes VALUES (?, ?, ?, ?, ?, ?, 1, ?)",
+            (note_id, patient_id, local_patient_id, external_patient_id, created_at, datetime.now().isoformat(),
+             updated_at)
+        )
+    
+    def lookup_updated_at(self, note_ids):
+        """
+        Find which of the given notes are in the ledger.
+        
+        Args:
+            note_ids (list): Adracare note IDs
+            
+        Returns:
+            dict: Mapping of note ID to the recorded updated_at (None if it was
+            not recorded) for every note ID present in the ledger
+        """
+        candidates = [str(note_id) for note_id in note_ids if note_id is not None and str(note_id) in self.filter]
+        found = {}
+        # Stay well below SQLite's bound-parameter limit
+        for i in range(0, len(candidates), 500):
+            chunk = candidates[i:i + 500]
+            placeholders = ", ".join("?" * len(chunk))
+            cursor = self.conn.execute(
+                f"SELECT note_id, updated_at FROM processed_notes WHERE note_id IN ({placeholders})", chunk
+            )
+            found.update(cursor.fetchall())
+        return found
+
+    def import_processed_notes(self, processed_notes):
+        """
+        Import the legacy processed_notes map from results.json.
+
+        Args:
+            processed_notes (dict): Mapping of note ID to processing details
+
+        Returns:
+            int: Number of notes imported
+        """
+        rows = [
+            (
+                str(note_id),
+                info.get("patient_id"),
+                info.get("local_patient_id"),
+                info.get("external_patient_id"),
+                info.get("created_at"),
+                info.get("processed_at"),
+                1 if info.get("sql_generated", True) else 0,
+                info.get("updated_at")
+            )
+            for note_id, info in processed_notes.items()
+        ]
+        self.conn.executemany("INSERT OR IGNORE INTO processed_notes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+        self._sync_filter()
+        return len(rows)
+
+    def get_patient_syncs(self):
+        """
+        Load the per-patient sync watermarks.
+
+        Returns:
+            dict: Mapping of external patient ID to a dict with "notes_updated_at"
+            (latest note updated_at ingested), "appointments_updated_at" (latest
+            appointment activity seen) and "synced_at"
+        """
+        cursor = self.conn.execute(
+            "SELECT external_patient_id, notes_updated_at, appointments_updated_at, synced_at FROM patient_sync"
+        )
+        return {
+            row[0]: {"notes_updated_at": row[1], "appointments_updated_at": row[2], "synced_at": row[3]}
+            for row in cursor
+        }
+
+    def update_patient_sync(self, external_patient_id, notes_updated_at=None, appointments_updated_at=None):
+        """
+        Record that a patient's notes have been ingested up to a point.
+
+        Watermarks left as None keep their previous value.
+
+        Args:
+            external_patient_id (str): External patient ID from Adracare
+            notes_updated_at (str): Latest note updated_at ingested for the patient
+            appointments_updated_at (str): Latest appointment activity seen for the patient
+        """
+        self.conn.execute(
+            """
+            INSERT INTO patient_sync VALUES (?, ?, ?, ?)
+            ON CONFLICT (external_patient_id) DO UPDATE SET
+                notes_updated_at = COALESCE(excluded.notes_updated_at, notes_updated_at),
+                appointments_updated_at = COALESCE(excluded.appointments_updated_at, appointments_updated_at),
+                synced_at = excluded.synced_at
+            """,
+            (external_patient_id, notes_updated_at, appointments_updated_at, datetime.now().isoformat())
+        )
+
+    def start_run(self, patient_ids, output_path):
+        """
+        Start a checkpointed run over the given patients.
+
+        Args:
+            patient_ids (list): External patient IDs, in processing order
+            output_path (str): SQL output file of the run
+
+        Returns:
+            int: ID of the new run
+        """
+        now = datetime.now().isoformat()
+        cursor = self.conn.execute(
+            "INSERT INTO runs (started_at, status, output_path, output_offset) VALUES (?, 'running', ?, 0)",
+            (now, output_path)
+        )
+        run_id = cursor.lastrowid
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO run_patients VALUES (?, ?, ?, 'pending', 0, 0, NULL, ?)",
+            [(run_id, position, patient_id, now) for position, patient_id in enumerate(patient_ids)]
+        )
+        self.conn.commit()
+        return run_id
+
+    def get_incomplete_run(self):
+        """
+        Find the most recent run that did not finish.
+
+        Returns:
+            dict or None: "run_id", "started_at", "output_path" and "output_offset"
+            (bytes of output known to be complete), or None
+        """
+        row = self.conn.execute(
+            "SELECT run_id, started_at, output_path, output_offset FROM runs "
+            "WHERE status = 'running' ORDER BY run_id DESC LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+        return {"run_id": row[0], "started_at": row[1], "output_path": row[2], "output_offset": row[3]}
+
+    def get_run_patients(self, run_id):
+        """
+        List the patients of a run with their checkpoint state.
+
+        Returns:
+            list: Dicts with "patient_id", "state", "notes_found", "notes_written"
+            and "error", in processing order
+        """
+        cursor = self.conn.execute(
+            "SELECT external_patient_id, state, notes_found, notes_written, error FROM run_patients "
+            "WHERE run_id = ? ORDER BY position",
+            (run_id,)
+        )
+        return [
+            {"patient_id": row[0], "state": row[1], "notes_found": row[2], "notes_written": row[3], "error": row[4]}
+            for row in cursor
+        ]
+
+    def checkpoint_patient(self, run_id, external_patient_id, state, notes_found=0, notes_written=0, error=None):
+        """
+        Record a patient's progress within a run.
+
+        The checkpoint becomes durable with the next commit, together with any
+        notes recorded since the last one.
+
+        Args:
+            run_id (int): Run ID
+            external_patient_id (str): External patient ID from Adracare
+            state (str): "fetched", "emitted", "failed" or "skipped"
+            notes_found (int): Notes returned by the API
+            notes_written (int): Notes written to the output
+            error (str): Error message for failed patients
+        """
+        self.conn.execute(
+            "UPDATE run_patients SET state = ?, notes_found = ?, notes_written = ?, error = ?, updated_at = ? "
+            "WHERE run_id = ? AND external_patient_id = ?",
+            (state, notes_found, notes_written, error, datetime.now().isoformat(), run_id, external_patient_id)
+        )
+
+    def set_run_output_offset(self, run_id, offset):
+        """Record how many bytes of the run's output are complete (durable with the next commit)."""
+        self.conn.execute("UPDATE runs SET output_offset = ? WHERE run_id = ?", (offset, run_id))
+
+    def finish_run(self, run_id, status="complete"):
+        """
+        Mark a run as finished.
+
+        Args:
+            run_id (int): Run ID
+            status (str): "complete", or "abandoned" for an interrupted run that will not be resumed
+        """
+        self.conn.execute(
+            "UPDATE runs SET status = ?, finished_at = ? WHERE run_id = ?",
+            (status, datetime.now().isoformat(), run_id)
+        )
+        self.commit()
+
+    def get_patient_note_counts(self):
+        """
+        Estimate how many notes each patient has, from earlier runs.
+
+        Returns:
+            dict: Mapping of external patient ID to the notes found for the
+            patient in the latest run that fetched them, or failing that the
+            number of the patient's notes in the ledger
+        """
+        counts = dict(self.conn.execute(
+            "SELECT external_patient_id, COUNT(*) FROM processed_notes "
+            "WHERE external_patient_id IS NOT NULL GROUP BY external_patient_id"
+        ).fetchall())
+        counts.update(self.conn.execute(
+            """
+            SELECT external_patient_id, notes_found FROM run_patients
+            WHERE state IN ('fetched', 'emitted') AND run_id = (
+                SELECT MAX(run_id) FROM run_patients AS latest
+                WHERE latest.external_patient_id = run_patients.external_patient_id
+                AND latest.state IN ('fetched', 'emitted')
+            )
+            """
+        ).fetchall())
+        return counts
+
+    def record_failure(self, external_patient_id, reason, error, permanent=False):
+        """
+        Add a failed patient to the dead-letter store, or count another attempt.
+
+        Args:
+            external_patient_id (str): External patient ID from Adracare
+            reason (str): Failure class, e.g. "not_found" or "timeout"
+            error (str): Error message of the latest attempt
+            permanent (bool): True if retrying is not expected to help
+        """
+        now = datetime.now().isoformat()
+        self.conn.execute(
+            """
+            INSERT INTO dead_letters VALUES (?, ?, ?, ?, 1, ?, ?)
+            ON CONFLICT (external_patient_id) DO UPDATE SET
+                reason = excluded.reason,
+                permanent = excluded.permanent,
+                error = excluded.error,
+                attempts = attempts + 1,
+                last_failed_at = excluded.last_failed_at
+            """,
+            (external_patient_id, reason, int(permanent), error, now, now)
+        )
+
+    def clear_failures(self, patient_ids=None):
+        """
+        Remove patients from the dead-letter store.
+
+        Args:
+            patient_ids (list): External patient IDs to clear, or None for all
+
+        Returns:
+            int: Number of patients cleared
+        """
+        if patient_ids is None:
+            cursor = self.conn.execute("DELETE FROM dead_letters")
+        else:
+            cursor = self.conn.executemany(
+                "DELETE FROM dead_letters WHERE external_patient_id = ?",
+                [(patient_id,) for patient_id in patient_ids]
+            )
+        return cursor.rowcount
+
+    def get_failures(self):
+        """
+        Load the dead-letter store.
+
+        Returns:
+            dict: Mapping of external patient ID to a dict with "reason",
+            "permanent", "error", "attempts", "first_failed_at" and "last_failed_at"
+        """
+        cursor = self.conn.execute(
+            "SELECT external_patient_id, reason, permanent, error, attempts, first_failed_at, last_failed_at "
+            "FROM dead_letters ORDER BY first_failed_at"
+        )
+        return {
+            row[0]: {
+                "reason": row[1],
+                "permanent": bool(row[2]),
+                "error": row[3],
+                "attempts": row[4],
+                "first_failed_at": row[5],
+                "last_failed_at": row[6]
+            }
+            for row in cursor
+        }
+
+    def backup(self, path):
+        """
+        Copy the ledger, including writes still in its WAL, to another file.
+
+        The copy has no filter file; one is built from it when it is opened.
+
+        Args:
+            path (str): Path of the copy
+        """
+        target = sqlite3.connect(path)
+        try:
+            self.conn.backup(target)
+        finally:
+            target.close()
+
+    def reset_processed_notes(self):
+        """
+        Forget every processed note, so the next run imports all notes again.
+
+        The patients' sync watermarks go too, as they only say which notes are
+        already processed. The dead-letter store and the run history are kept.
+        """
+        self.conn.execute("DELETE FROM processed_notes")
+        self.conn.execute("DELETE FROM patient_sync")
+        self.conn.commit()
+        self.filter.close()
+        os.remove(self.filter_path)
+        self.filter = BloomFilter(self.filter_path, self.capacity, self.error_rate)
+
+    def count(self):
+        """Return the number of processed notes in the ledger."""
+        return self.conn.execute("SELECT COUNT(*) FROM processed_notes").fetchone()[0]
+
+    def commit(self):
+        """Commit pending ledger writes and flush the filter."""
+        self.conn.commit()
+        watermark = self.conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM processed_notes").fetchone()[0]
+        self.filter.flush(watermark)
+
+    def rollback(self):
+        """
+        Discard pending ledger writes.
+
+        Bits already set in the filter stay set; like an interrupted run, that
+        only costs a lookup in the ledger for the notes concerned.
+        """
+        self.conn.rollback()
+
+    def close(self):
+        """Commit and close the ledger and its filter."""
+        if self.conn:
+            self.commit()
+            self.conn.close()
+            self.conn = None
+        if self.filter:
+            self.filter.close()
+            self.filter = None
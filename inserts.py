@@ -208,10 +208,32 @@ import time
 import json
 import uuid
 from datetime import datetime
+from itertools import islice
+from utils.timing import StageTimings
+from utils.metrics import configure_metrics
+from utils.progress import configure_progress
+from utils.profiling import configure_profiler, mark_stage, stop_profiler, profile_directory
+from utils.compression import open_text
+
+# Metrics published while a file is loaded (see utils/metrics.py)
+LOAD_METRICS = {
+    "rows_total": ("counter", "SQL statements handled, by outcome"),
+    "statements_remaining": ("gauge", "Statements of the file not handled yet"),
+    "rows_per_second": ("gauge", "Statements handled per second since the load started"),
+    "load_start_timestamp_seconds": ("gauge", "Unix time the load started"),
+    "last_progress_timestamp_seconds": ("gauge", "Unix time a statement was last handled"),
+    "load_end_timestamp_seconds": ("gauge", "Unix time the load finished")
+}
+
+# A note's comment followed by its INSERT statement
+STATEMENT_PATTERN = re.compile(r'(--\s*note_id:[^\n]+)[\s\n]+(INSERT INTO patient_notes[^;]+;)', re.DOTALL)
+
+# Characters read from the SQL file at a time
+READ_CHUNK_SIZE = 2**20
 
 
 class SQLExecutor:
-    def __init__(self, db_config=None, log_dir="logs", tracking_file="insert_tracking.json"):
+    def __init__(self, db_config=None, log_dir="logs", tracking_file="insert_tracking.json", profile=False):
         """
         Initialize the SQL executor with database configuration and tracking setup.
         
@@ -219,8 +241,10 @@ class SQLExecutor:
             db_config (dict): Database connection configuration.
             log_dir (str): Directory for log files.
             tracking_file (str): File to track executed SQL statements.
+            profile (bool): Write CPU and memory profiles of each execution to log_dir.
         """
         self.db_config = db_config or {}
+        self.profile = profile
         self.log_dir = log_dir
         self.tracking_file = tracking_file
         self.tracking_data = self._load_tracking_data()
@@ -267,8 +291,7 @@ class SQLExecutor:
             list: List of tuples (comment, statement)
         """
         # Match comments followed by INSERT statements
-        pattern = r'(--\s*note_id:[^\n]+)[\s\n]+(INSERT INTO patient_notes[^;]+;)'
-        matches = re.findall(pattern, sql_content, re.DOTALL)
+        matches = STATEMENT_PATTERN.findall(sql_content)
         
         statements = []
         for comment, stmt in matches:
@@ -276,6 +299,52 @@ class SQLExecutor:
         
         return statements
     
+    def iter_sql_statements(self, sql_file, chunk_size=READ_CHUNK_SIZE):
+        """
+        Yield statements with their comments from a text stream, reading it in chunks.
+        
+        Gives the same statements as split_sql_statements on the whole content,
+        while holding only one chunk and the statement it ends in.
+        
+        Args:
+            sql_file: Text stream, e.g. from open_text (plain, gzip or zstd)
+            chunk_size (int): Characters read at a time
+            
+        Yields:
+            tuple: (comment, statement)
+        """
+        pending = ""
+        while True:
+            chunk = sql_file.read(chunk_size)
+            pending += chunk
+            end = 0
+            for match in STATEMENT_PATTERN.finditer(pending):
+                yield match.group(1).strip(), match.group(2).strip()
+                end = match.end()
+            if not chunk:
+                break
+            # A statement cut off by the end of the chunk is matched again with the next one
+            pending = pending[end:]
+    
+    def count_sql_statements(self, file_path):
+        """
+        Count the statements and patients of a SQL file in one streaming pass.
+        
+        Args:
+            file_path (str): Path to the SQL file (.sql, .sql.gz or .sql.zst)
+            
+        Returns:
+            tuple: (statement_count, patient_count)
+        """
+        statements = 0
+        patients = set()
+        with open_text(file_path) as sql_file:
+            for comment, _ in self.iter_sql_statements(sql_file):
+                statements += 1
+                _, patient_id = self._extract_note_info(comment)
+                patients.add(patient_id)
+        return statements, len(patients)
+    
     def execute_statement(self, cursor, stmt):
         """Execute a single SQL statement."""
         cursor.execute(stmt)
@@ -287,6 +356,10 @@ class SQLExecutor:
         """
         Execute SQL statements from a file based on the selected mode.
         
+        The file is streamed twice, once to count its statements and once to
+        execute them, so it is never held in memory as a whole. Files ending
+        in .gz or .zst are decompressed as they are read.
+        
         Args:
             file_path (str): Path to the SQL file.
             mode (str): Execution mode ('new', 're-insert', 'delete', 'empty')
@@ -297,18 +370,33 @@ class SQLExecutor:
         """
         print(f"Starting execution of {file_path} in {mode} mode")
         start_time = time.time()
+        timings = StageTimings()
+        metrics, metrics_exporter = configure_metrics(
+            "adracare_load",
+            LOAD_METRICS,
+            port=int(os.environ.get("LOAD_METRICS_PORT", "0")),
+            textfile=os.environ.get("LOAD_METRICS_TEXTFILE", ""),
+            interval=float(os.environ.get("METRICS_INTERVAL", "15"))
+        )
+        metrics.timings = timings
+        metrics.set("load_start_timestamp_seconds", start_time)
+        if self.profile:
+            configure_profiler(profile_directory(self.summary_log_path), f"load ({mode})")
         
-        # Read and split the SQL file
+        # Count the statements of the SQL file
         try:
-            with open(file_path, "r", encoding="utf-8") as sql_file:
-                sql_content = sql_file.read()
-                sql_statements = self.split_sql_statements(sql_content)
+            with timings.time("sql_read"):
+                total_statements, total_patients = self.count_sql_statements(file_path)
         except Exception as e:
             print(f"Error reading SQL file: {e}")
+            if metrics_exporter:
+                metrics_exporter.stop()
+            stop_profiler()
             return 0, 0, 0
         
-        total_statements = len(sql_statements)
         print(f"Found {total_statements} SQL statements to execute")
+        metrics.set("statements_remaining", total_statements)
+        mark_stage("sql_read")
         
         # Connect to the database
         try:
@@ -317,8 +405,21 @@ class SQLExecutor:
             cursor = conn.cursor()
         except Exception as e:
             print(f"Database connection error: {e}")
+            if metrics_exporter:
+                metrics_exporter.stop()
+            stop_profiler()
             return 0, 0, 0
         
+        progress = configure_progress(
+            "load",
+            {"patients": total_patients, "notes": total_statements},
+            interval=float(os.environ.get("PROGRESS_INTERVAL", "2")),
+            status_file=os.environ.get("LOAD_PROGRESS_FILE", ""),
+            tty=os.environ.get("PROGRESS_TTY", "auto"),
+            eta_unit="notes"
+        )
+        last_patient_id = None
+        
         # Initialize counters
         successful_statements = 0
         failed_statements = 0
@@ -326,7 +427,9 @@ class SQLExecutor:
         
         # Open log files
         with open(self.error_log_path, "w", encoding="utf-8") as error_log, \
-             open(self.summary_log_path, "w", encoding="utf-8") as summary_log:
+             open(self.summary_log_path, "w", encoding="utf-8") as summary_log, \
+             open_text(file_path) as sql_file:
+            sql_statements = self.iter_sql_statements(sql_file)
             
             summary_log.write(f"Execution Summary for {file_path}\n")
             summary_log.write(f"Mode: {mode}\n")
@@ -340,7 +443,7 @@ class SQLExecutor:
                 for i in range(0, total_statements, batch_size):
                     batch_number = i // batch_size + 1
                     batch_end = min(i + batch_size, total_statements)
-                    batch = sql_statements[i:batch_end]
+                    batch = list(islice(sql_statements, batch_end - i))
                     
                     print(f"Processing batch {batch_number} of {batch_count} ({i+1}-{batch_end} of {total_statements} statements)")
                     batch_start_time = time.time()
@@ -353,12 +456,19 @@ class SQLExecutor:
                     for stmt_index, (comment, stmt) in enumerate(batch):
                         # Extract note_id and patient_id from comment
                         note_id, patient_id = self._extract_note_info(comment)
+                        if patient_id != last_patient_id:
+                            # Statements are grouped by patient
+                            progress.advance("patients")
+                            last_patient_id = patient_id
                         
                         if not note_id:
                             error_msg = f"Could not extract note_id from comment: {comment}"
                             error_log.write(f"{error_msg}\n")
                             print(error_msg)
                             batch_failed += 1
+                            metrics.inc("rows_total", outcome="failed")
+                            progress.advance("notes")
+                            progress.event("failures")
                             failed_statements += 1
                             continue
                         
@@ -369,12 +479,18 @@ class SQLExecutor:
                         if mode == 'new' and already_executed:
                             summary_log.write(f"Skipped note_id: {note_id} (already executed)\n")
                             batch_skipped += 1
+                            metrics.inc("rows_total", outcome="skipped")
+                            progress.advance("notes")
+                            progress.event("skipped")
                             skipped_statements += 1
                             continue
                         
                         elif mode == 're-insert' and already_executed:
                             summary_log.write(f"Skipped note_id: {note_id} (already executed)\n")
                             batch_skipped += 1
+                            metrics.inc("rows_total", outcome="skipped")
+                            progress.advance("notes")
+                            progress.event("skipped")
                             skipped_statements += 1
                             continue
                             
@@ -383,28 +499,38 @@ class SQLExecutor:
                             try:
                                 db_id = self.tracking_data["executed_notes"][note_id]["db_id"]
                                 delete_sql = f"DELETE FROM patient_notes WHERE id = {db_id};"
-                                cursor.execute(delete_sql)
-                                conn.commit()
+                                with timings.time("statement_execute"):
+                                    cursor.execute(delete_sql)
+                                with timings.time("commit"):
+                                    conn.commit()
                                 
                                 # Remove from tracking data
                                 del self.tracking_data["executed_notes"][note_id]
-                                self._save_tracking_data()
+                                with timings.time("tracking_save"):
+                                    self._save_tracking_data()
                                 
                                 batch_success += 1
+                                metrics.inc("rows_total", outcome="deleted")
+                                progress.advance("notes")
                                 successful_statements += 1
                                 summary_log.write(f"Deleted note_id: {note_id} (db_id: {db_id})\n")
                             except Exception as e:
                                 conn.rollback()
                                 error_log.write(f"Error deleting note_id {note_id}: {e}\n")
                                 batch_failed += 1
+                                metrics.inc("rows_total", outcome="failed")
+                                progress.advance("notes")
+                                progress.event("failures")
                                 failed_statements += 1
                             continue
                             
                         # Execute the statement (for 'new' mode or 're-insert' for unexecuted statements)
                         if mode in ['new', 're-insert']:
                             try:
-                                db_id = self.execute_statement(cursor, stmt)
-                                conn.commit()
+                                with timings.time("statement_execute"):
+                                    db_id = self.execute_statement(cursor, stmt)
+                                with timings.time("commit"):
+                                    conn.commit()
                                 
                                 # Record in tracking data
                                 self.tracking_data["executed_notes"][note_id] = {
@@ -413,9 +539,12 @@ class SQLExecutor:
                                     "executed_at": datetime.now().isoformat(),
                                     "mode": mode
                                 }
-                                self._save_tracking_data()
+                                with timings.time("tracking_save"):
+                                    self._save_tracking_data()
                                 
                                 batch_success += 1
+                                metrics.inc("rows_total", outcome="inserted")
+                                progress.advance("notes")
                                 successful_statements += 1
                                 summary_log.write(f"Executed note_id: {note_id} (db_id: {db_id})\n")
                             except Exception as e:
@@ -424,8 +553,16 @@ class SQLExecutor:
                                 error_log.write(f"{error_msg}\n")
                                 print(error_msg)
                                 batch_failed += 1
+                                metrics.inc("rows_total", outcome="failed")
+                                progress.advance("notes")
+                                progress.event("failures")
                                 failed_statements += 1
                     
+                    handled = successful_statements + failed_statements + skipped_statements
+                    metrics.set("statements_remaining", total_statements - handled)
+                    metrics.set("rows_per_second", round(handled / max(time.time() - start_time, 1e-9), 3))
+                    metrics.set("last_progress_timestamp_seconds", time.time())
+                    
                     batch_time = time.time() - batch_start_time
                     print(f"Batch {batch_number} completed in {batch_time:.2f}s - Success: {batch_success}, Failed: {batch_failed}, Skipped: {batch_skipped}")
                     
@@ -436,6 +573,8 @@ class SQLExecutor:
                     error_log.flush()
                     summary_log.flush()
                 
+                progress.stop()
+                mark_stage("executed")
                 total_time = time.time() - start_time
                 completion_message = (
                     f"Execution completed in {total_time:.2f}s - "
@@ -456,6 +595,13 @@ class SQLExecutor:
                     success_rate = successful_statements / (total_statements - skipped_statements) * 100 if (total_statements - skipped_statements) > 0 else 0
                     summary_log.write(f"Success rate: {success_rate:.2f}%\n")
                 
+                # Show where the time went
+                timing_table = timings.format_summary()
+                print("Time per stage:")
+                print(timing_table)
+                summary_log.write("\nTime per stage:\n" + timing_table + "\n")
+                summary_log.write("\nTimings (JSON): " + json.dumps(timings.summary()) + "\n")
+                
             except Exception as e:
                 # Log any unexpected errors
                 error_message = f"An unexpected error occurred: {e}"
@@ -466,6 +612,14 @@ class SQLExecutor:
                 cursor.close()
                 conn.close()
                 print(f"Logs saved to {self.error_log_path} and {self.summary_log_path}")
+                progress.stop("stopped")
+                profile_path = stop_profiler()
+                if profile_path:
+                    print(f"Profile written to {profile_path}")
+                    summary_log.write(f"\nProfile: {profile_path}\n")
+                metrics.set("load_end_timestamp_seconds", time.time())
+                if metrics_exporter:
+                    metrics_exporter.stop()
         
         return successful_statements, failed_statements, skipped_statements
     
@@ -598,13 +752,14 @@ def main():
     # Get database configuration
     db_config = get_db_config()
     
-    # Initialize SQL executor
-    executor = SQLExecutor(db_config=db_config)
-    
     # Get file path from command line argument or use default
     import sys
-    default_file = "output.sql"
-    file_path = sys.argv[1] if len(sys.argv) > 1 else default_file
+    default_file = os.environ.get("OUTPUT_FILE", "output.sql")
+    paths = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    file_path = paths[0] if paths else default_file
+    
+    # Initialize SQL executor; --profile writes a profile of each execution next to its logs
+    executor = SQLExecutor(db_config=db_config, profile="--profile" in sys.argv[1:])
     
     if not os.path.exists(file_path):
         print(f"Error: File {file_path} not found.")
@@ -6,16 +6,42 @@ This script fetches encounter notes concurrently from the Adracare API for multi
 and writes them to a PostgreSQL-compatible SQL file asynchronously.
 """
 
+import os
 import json
+import time
+import logging
+import argparse
 import asyncio
 import aiohttp
 import aiofiles
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timezone
+from urllib.parse import urlparse, urlunparse, urljoin, parse_qs, parse_qsl, urlencode
 from concurrent.futures import ThreadPoolExecutor
 from config.settings import load_config
-from api.adracare import extract_notes_data
-from utils.text_processing import extract_text_from_html
+from api.adracare import extract_note_record
+from api.json_stream import StreamingArrayParser
+from api.http_cache import configure_response_cache, get_response_cache
+from api.hedging import configure_request_hedger, get_request_hedger
+from utils.text_processing import (
+    extract_text_from_html,
+    extract_texts_from_html,
+    configure_html_extractor,
+    configure_extraction_cache
+)
 from db.database import Database
+from db.ledger import NoteLedger
+from utils.sharding import parse_shard, shard_patients, shard_path
+from utils.timing import configure_stage_timings, get_stage_timings, timed
+from utils.metrics import configure_metrics, get_metrics
+from utils.log import configure_logging, shutdown_logging
+from utils.progress import configure_progress, get_progress
+from utils.profiling import configure_profiler, mark_stage, stop_profiler, profile_directory
+from utils.spill import NoteBuffer, configure_memory_budget
+from utils.sql_writer import SQLWriter, output_segments, restore_segments, segment_path
+from utils.compression import split_extension
+
+logger = logging.getLogger(__name__)
 
 
 async def get_auth_token_async(api_base_url, username, password, session):
@@ -48,76 +74,657 @@ async def get_auth_token_async(api_base_url, username, password, session):
         return data["jwt"]
 
 
-async def get_encounter_notes_async(api_base_url, auth_token, patient_id, session, timeout=60, max_retries=3, retry_delay=5):
+# Size of the reads used to stream encounter_notes response bodies
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Metrics published while a run is in progress (see utils/metrics.py)
+IMPORT_METRICS = {
+    "patients_total": ("counter", "Patients finished, by outcome"),
+    "notes_fetched_total": ("counter", "Encounter notes listed by the API"),
+    "notes_written_total": ("counter", "Notes written to the SQL output"),
+    "bytes_fetched_total": ("counter", "Encounter notes bytes transferred"),
+    "api_responses_total": ("counter", "encounter_notes responses, by HTTP status, timeout or error"),
+    "api_retries_total": ("counter", "encounter_notes request retries, by failure class"),
+    "patient_failures_total": ("counter", "Failed patients, by failure class"),
+    "requests_in_flight": ("gauge", "encounter_notes page requests in progress"),
+    "patients_queued": ("gauge", "Patients of the run not fetched yet"),
+    "notes_pending_write": ("gauge", "Fetched notes waiting to be written"),
+    "patients_per_second": ("gauge", "Patients finished per second since the run started"),
+    "notes_per_second": ("gauge", "Notes written per second since the run started"),
+    "run_start_timestamp_seconds": ("gauge", "Unix time the run started"),
+    "last_progress_timestamp_seconds": ("gauge", "Unix time a patient was last finished"),
+    "run_end_timestamp_seconds": ("gauge", "Unix time the run finished")
+}
+
+# Failure classes that retrying does not fix. Patients failing with one of
+# these are dead-lettered and left out of routine runs until cleared.
+PERMANENT_FAILURES = {"not_found", "client_error", "malformed", "no_local_patient"}
+
+
+def _status_failure(status):
+    """Classify a non-200 encounter_notes response status."""
+    if status in (404, 410):
+        return "not_found"
+    if status in (401, 403):
+        # An expired token affects every patient alike, so it is not the patient's fault
+        return "unauthorized"
+    if status in (408, 429):
+        return "throttled"
+    if 400 <= status < 500:
+        return "client_error"
+    return "server_error"
+
+
+async def _parse_notes_stream(chunks, item_parser):
     """
-    Get encounter notes for a specific patient from the Adracare API asynchronously.
+    Build note records from a streamed encounter_notes body.
     
     Args:
-        api_base_url: Base URL for the Adracare API
+        chunks: Async iterator of body bytes
+        item_parser: Turns one "data" element into a note, or None to drop it
+        
+    Returns:
+        dict: "notes", "items" (elements of "data", including dropped ones) and "bytes"
+        plus the body's other top-level members
+    """
+    parser = StreamingArrayParser(chunks)
+    notes = []
+    items = 0
+    parse_seconds = 0.0
+    async for item in parser.items():
+        items += 1
+        started = time.perf_counter()
+        note = item_parser(item)
+        parse_seconds += time.perf_counter() - started
+        if note is not None:
+            notes.append(note)
+    
+    timings = get_stage_timings()
+    timings.record("json_decode", parser.decode_seconds)
+    timings.record("note_records", parse_seconds)
+    timings.count("notes_parsed", len(notes))
+    
+    if "data" in parser.envelope:
+        logger.warning("Expected 'data' to be a list, got: %s", type(parser.envelope["data"]))
+    
+    result = parser.envelope
+    result["notes"] = notes
+    result["items"] = items
+    result["bytes"] = parser.bytes_read
+    return result
+
+
+async def get_encounter_notes_page_async(url, auth_token, session, timeout=60, max_retries=3, retry_delay=5,
+                                         item_parser=extract_note_record, cache=None):
+    """
+    Get one page of encounter notes from the Adracare API asynchronously.
+    
+    The response body is parsed incrementally: each element of the "data"
+    array is turned into a NoteRecord as it arrives, so neither the full body
+    nor its complete parsed tree is held in memory.
+    
+    With a response cache, requests carry the validators of the cached copy
+    and a 304 Not Modified is answered from disk; cached copies without
+    validators are served directly while within the cache's TTL.
+    
+    Args:
+        url: Encounter notes URL (may already carry pagination parameters)
         auth_token: JWT authentication token
-        patient_id: Adracare patient ID
         session: aiohttp ClientSession
         timeout: Timeout in seconds for the request (default: 60)
         max_retries: Maximum number of retry attempts (default: 3)
         retry_delay: Delay in seconds between retries (default: 5)
+        item_parser: Turns one "data" element into a note, or None to drop it
+            (default: extract_note_record)
+        cache: ResponseCache to use (default: the shared cache, if configured)
         
     Returns:
-        dict: JSON response containing encounter notes
-        
-    Raises:
-        Exception: If the API request fails
+        dict: "notes" (list of NoteRecord) and "bytes" (bytes transferred, 0 when
+        served from the cache) plus the response's other top-level members, or
+        "error", "failure" (its class, see PERMANENT_FAILURES) and an empty
+        "notes" list if the request failed
     """
-    url = f"{api_base_url}/patients/{patient_id}/encounter_notes"
-    headers = {
-        "Authorization": f"Bearer {auth_token}"
-    }
+    cache = cache or get_response_cache()
     
     for attempt in range(max_retries):
+        malformed = None
         try:
+            headers = {
+                "Authorization": f"Bearer {auth_token}"
+            }
+            
+            entry = cache.lookup(url) if cache else None
+            if entry and cache.is_fresh(entry):
+                # Within the TTL: serve the cached copy without asking the API
+                try:
+                    result = await _parse_notes_stream(cache.read_body(entry), item_parser)
+                except Exception as e:
+                    logger.warning("Discarding unreadable cached response for %s: %s", url, e)
+                    cache.discard(url)
+                    entry = None
+                else:
+                    cache.touch(entry, revalidated=False)
+                    result["bytes"] = 0
+                    return result
+            if entry:
+                headers.update(cache.conditional_headers(entry))
+            
             async with session.get(url, headers=headers, timeout=timeout) as response:
+                get_metrics().inc("api_responses_total", status=str(response.status))
+                if response.status == 304 and entry:
+                    # Not modified: parse the copy on disk; an unreadable copy is dropped and refetched
+                    try:
+                        result = await _parse_notes_stream(cache.read_body(entry), item_parser)
+                    except Exception:
+                        cache.discard(url)
+                        raise
+                    cache.touch(entry, revalidated=True)
+                    result["bytes"] = 0
+                    return result
+                
                 if response.status != 200:
                     error_message = f"Failed to get encounter notes: {response.status} - {await response.text()}"
-                    print(f"Attempt {attempt+1}/{max_retries} failed: {error_message}")
+                    failure = _status_failure(response.status)
+                    logger.warning("Attempt %d/%d failed: %s", attempt + 1, max_retries, error_message)
                     
-                    # If this is not the last attempt, wait and try again
-                    if attempt < max_retries - 1:
-                        print(f"Waiting {retry_delay} seconds before retrying...")
+                    # If this is not the last attempt and the error may clear up, wait and try again
+                    if attempt < max_retries - 1 and failure not in PERMANENT_FAILURES:
+                        get_metrics().inc("api_retries_total", failure=failure)
+                        get_progress().event("retries")
+                        logger.info("Waiting %s seconds before retrying...", retry_delay)
                         await asyncio.sleep(retry_delay)
                         continue
                     
-                    return {"error": error_message, "data": []}
+                    return {"error": error_message, "failure": failure, "notes": []}
                 
-                # Successfully got the response
-                return await response.json()
+                # Successfully got the response; build note records as the data array streams in
+                chunks = response.content.iter_chunked(STREAM_CHUNK_SIZE)
+                writer = cache.writer(url, response.headers) if cache else None
+                try:
+                    if writer is None:
+                        result = await _parse_notes_stream(chunks, item_parser)
+                    else:
+                        # Compress the body into the cache as it is parsed
+                        body = writer.tee(chunks)
+                        try:
+                            result = await _parse_notes_stream(body, item_parser)
+                            async for _ in body:
+                                pass
+                        except BaseException:
+                            await body.aclose()
+                            await writer.abort()
+                            raise
+                        await writer.commit()
+                except json.JSONDecodeError as e:
+                    # aiohttp raises on a body cut short by a dropped connection, except when
+                    # the body runs until the connection closes: then a cut looks like bad JSON
+                    if _length_delimited(response):
+                        malformed = e
+                    raise
+                if cache:
+                    cache.misses += 1
+                return result
                 
         except asyncio.TimeoutError:
-            print(f"Attempt {attempt+1}/{max_retries} timed out after {timeout} seconds")
+            logger.warning("Attempt %d/%d timed out after %s seconds", attempt + 1, max_retries, timeout)
+            get_metrics().inc("api_responses_total", status="timeout")
             
             # If this is not the last attempt, wait and try again
             if attempt < max_retries - 1:
-                print(f"Waiting {retry_delay} seconds before retrying...")
+                get_metrics().inc("api_retries_total", failure="timeout")
+                get_progress().event("retries")
+                logger.info("Waiting %s seconds before retrying...", retry_delay)
                 await asyncio.sleep(retry_delay)
                 continue
             
-            return {"error": f"Request timed out after {max_retries} attempts", "data": []}
+            return {"error": f"Request timed out after {max_retries} attempts", "failure": "timeout", "notes": []}
             
         except Exception as e:
             error_msg = f"Exception occurred: {str(e)}"
-            print(f"Attempt {attempt+1}/{max_retries} failed: {error_msg}")
+            logger.warning("Attempt %d/%d failed: %s", attempt + 1, max_retries, error_msg)
+            get_metrics().inc("api_responses_total", status="error")
             
             # If this is not the last attempt, wait and try again
             if attempt < max_retries - 1:
-                print(f"Waiting {retry_delay} seconds before retrying...")
+                get_metrics().inc("api_retries_total", failure="error")
+                get_progress().event("retries")
+                logger.info("Waiting %s seconds before retrying...", retry_delay)
                 await asyncio.sleep(retry_delay)
                 continue
             
-            return {"error": error_msg, "data": []}
+            # Only a complete body that isn't JSON means the API sent something it cannot read
+            failure = "malformed" if e is malformed else "connection"
+            return {"error": error_msg, "failure": failure, "notes": []}
+
+
+def _length_delimited(response):
+    """Tell whether a response announced where its body ends (Content-Length or chunked encoding)."""
+    return response.content_length is not None or response.headers.get("Transfer-Encoding", "").lower() == "chunked"
+
+
+def _page_number(url):
+    """Return the page[number] query parameter of a URL, or None."""
+    values = parse_qs(urlparse(url).query).get("page[number]")
+    return int(values[0]) if values and values[0].isdigit() else None
+
+
+def _with_page_number(url, number):
+    """Return url with its page[number] query parameter set to number."""
+    parts = urlparse(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key != "page[number]"]
+    query.append(("page[number]", str(number)))
+    return urlunparse(parts._replace(query=urlencode(query)))
+
+
+def _with_params(url, params):
+    """Return url with any of params that it does not already carry added."""
+    if not params:
+        return url
+    parts = urlparse(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    present = {key for key, _ in query}
+    query.extend((key, str(value)) for key, value in params.items() if key not in present)
+    return urlunparse(parts._replace(query=urlencode(query)))
+
+
+def _total_count(envelope):
+    """Return the total number of notes a response's "meta" reports, or None."""
+    meta = envelope.get("meta")
+    if isinstance(meta, dict):
+        for key in ("total_count", "record_count", "total"):
+            if isinstance(meta.get(key), int):
+                return meta[key]
+    return None
+
+
+def _total_pages(envelope, page_size):
+    """
+    Work out how many pages a paginated response has, if the API says.
+    
+    Args:
+        envelope (dict): Top-level members of the first page (links, meta)
+        page_size (int): Requested page size, or when the API pages on its own the
+            number of items on the first page
+        
+    Returns:
+        int or None: Total number of pages, or None if it cannot be determined or
+        the pages cannot be addressed by number
+    """
+    links = envelope.get("links")
+    meta = envelope.get("meta")
+    
+    if isinstance(links, dict):
+        # A cursor API links pages without page[number] and ignores it, sending page 1 for every number
+        for key in ("next", "last"):
+            if isinstance(links.get(key), str) and links[key] and not _page_number(links[key]):
+                return None
+    
+    if isinstance(links, dict) and isinstance(links.get("last"), str):
+        last_page = _page_number(links["last"])
+        if last_page:
+            return last_page
+    
+    if isinstance(meta, dict):
+        for key in ("total_pages", "page_count", "last_page"):
+            if isinstance(meta.get(key), int):
+                return meta[key]
+        total_count = _total_count(envelope)
+        if page_size and total_count is not None:
+            return max(1, -(-total_count // page_size))
+    
+    return None
+
+
+async def iter_encounter_note_pages_async(api_base_url, auth_token, patient_id, session, page_size=0, prefetch=4,
+                                          timeout=60, max_retries=3, retry_delay=5, query=None,
+                                          item_parser=extract_note_record):
+    """
+    Yield a patient's encounter notes one page at a time.
+    
+    Pagination follows JSON:API conventions. When the first page reveals the
+    total number of pages (a "last" link or a count in "meta"), the remaining
+    pages are requested concurrently, at most `prefetch` at a time, and
+    yielded in order. Without a page_size, a count larger than the first page
+    means the API pages on its own, with pages the size of the first. Pages
+    are only requested by number if the API's own links use page[number];
+    cursor links are always followed one by one. Otherwise "next" links are followed one by one. An API
+    that does not paginate simply yields a single page.
+    
+    Args:
+        api_base_url: Base URL for the Adracare API
+        auth_token: JWT authentication token
+        patient_id: Adracare patient ID
+        session: aiohttp ClientSession
+        page_size: Notes requested per page; 0 leaves paging to the API (default: 0)
+        prefetch: Maximum pages requested concurrently (default: 4)
+        timeout: Timeout in seconds for each request (default: 60)
+        max_retries: Maximum number of retry attempts per page (default: 3)
+        retry_delay: Delay in seconds between retries (default: 5)
+        query: Extra query parameters, e.g. sparse fieldsets or filters (default: None)
+        item_parser: Turns one "data" element into a note (default: extract_note_record)
+        
+    Yields:
+        dict: Page result from get_encounter_notes_page_async; iteration stops
+        after the first page that contains "error"
+    """
+    url = f"{api_base_url}/patients/{patient_id}/encounter_notes"
+    params = dict(query or {})
+    if page_size:
+        params.update({"page[size]": page_size, "page[number]": 1})
+    if params:
+        url = f"{url}?{urlencode(params)}"
+    
+    def fetch(page_url):
+        async def request():
+            with timed("fetch_page"), get_metrics().in_progress("requests_in_flight"):
+                return await get_encounter_notes_page_async(
+                    page_url, auth_token, session,
+                    timeout=timeout, max_retries=max_retries, retry_delay=retry_delay, item_parser=item_parser
+                )
+        # Send a duplicate of requests that take unusually long, if hedging is on
+        hedger = get_request_hedger()
+        return hedger.run(request) if hedger else request()
+    
+    page = await fetch(url)
+    yield page
+    if "error" in page:
+        return
+    
+    # Without a requested size, an API that pages on its own sets the size with its first page
+    total_pages = _total_pages(page, page_size or page.get("items", 0))
+    if total_pages and total_pages > 1:
+        # Total known: fan out the remaining pages with a bounded sliding window
+        links = page.get("links")
+        last_link = links.get("last") if isinstance(links, dict) else None
+        template = urljoin(url, last_link) if isinstance(last_link, str) and _page_number(last_link) else url
+        template = _with_params(template, query)
+        
+        pending = deque()
+        next_number = 2
+        try:
+            while next_number <= total_pages or pending:
+                while next_number <= total_pages and len(pending) < max(1, prefetch):
+                    pending.append(asyncio.ensure_future(fetch(_with_page_number(template, next_number))))
+                    next_number += 1
+                
+                page = await pending.popleft()
+                yield page
+                if "error" in page:
+                    return
+        finally:
+            for task in pending:
+                task.cancel()
+            # Let cancelled requests run their cleanup, e.g. discarding partial cache bodies
+            await asyncio.gather(*pending, return_exceptions=True)
+        return
+    
+    # Total unknown: follow "next" links until there are none
+    seen = {url}
+    total_count = _total_count(page)
+    received = page.get("items", 0)
+    while True:
+        links = page.get("links")
+        next_link = links.get("next") if isinstance(links, dict) else None
+        if not isinstance(next_link, str) or not next_link:
+            if total_count is not None and received < total_count:
+                logger.warning("API reported %d notes for patient %s but only %d were received.",
+                               total_count, patient_id, received)
+            return
+        next_url = _with_params(urljoin(url, next_link), query)
+        if next_url in seen:
+            logger.warning("Pagination loop detected for patient %s at %s, stopping.", patient_id, next_url)
+            return
+        seen.add(next_url)
+        
+        page = await fetch(next_url)
+        received += page.get("items", 0)
+        yield page
+        if "error" in page:
+            return
+
+
+def _parse_note_listing(item):
+    """
+    Parse one element of a sparse note listing.
+    
+    Returns:
+        NoteRecord or None: The note, with notes set to None unless the server
+        sent the "notes" attribute despite the sparse fieldset
+    """
+    note = extract_note_record(item)
+    if note is None:
+        return None
+    attributes = item.get("attributes")
+    if not isinstance(attributes, dict) or "notes" not in attributes:
+        note.notes = None
+    return note
 
 
-async def process_patient_async(db, api_base_url, auth_token, patient_id, default_author_id, session):
+def _parse_timestamp(value):
+    """
+    Parse an ISO 8601 timestamp for comparison.
+    
+    Returns:
+        datetime or None: Timezone-aware datetime (naive values are taken as
+        UTC), or None if value is empty or not a timestamp
+    """
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+async def iter_updated_pages_async(pages, updated_since):
+    """
+    Drop notes last updated before a cutoff from a page iterator.
+    
+    This is the client-side half of incremental sync, for APIs that ignore the
+    updated_at filter. When the response confirms that the notes are sorted
+    newest first (meta.sort echoes the requested sort=-updated_at), reaching a
+    note older than the cutoff means every later page is older too, so
+    iteration stops and no more pages are requested. Otherwise, or if any note
+    is seen out of order, the cutoff is applied note by note on every page: a
+    page that merely looks sorted proves nothing about the next one.
+    
+    Args:
+        pages: Async iterator of page results
+        updated_since (str): Cutoff timestamp; notes updated at or after it are kept
+        
+    Yields:
+        dict: The same pages with older notes removed
+    """
+    cutoff = _parse_timestamp(updated_since)
+    previous = None
+    newest_first = True
+    sort_confirmed = False
+    try:
+        async for page in pages:
+            if "error" in page or cutoff is None:
+                yield page
+                if "error" in page:
+                    return
+                continue
+            
+            meta = page.get("meta")
+            if isinstance(meta, dict) and meta.get("sort") == "-updated_at":
+                sort_confirmed = True
+            kept = []
+            passed_cutoff = False
+            for note in page["notes"]:
+                updated = _parse_timestamp(note.updated_at)
+                if updated is None:
+                    kept.append(note)
+                    continue
+                if previous is not None and updated > previous:
+                    newest_first = False
+                previous = updated
+                if updated >= cutoff:
+                    kept.append(note)
+                else:
+                    passed_cutoff = True
+            page["notes"] = kept
+            yield page
+            if passed_cutoff and newest_first and sort_confirmed:
+                return
+    finally:
+        await pages.aclose()
+
+
+def _latest_updated_at(notes, latest=None):
+    """Return the newest updated_at among notes (and latest, if given)."""
+    latest_time = _parse_timestamp(latest)
+    for note in notes:
+        updated = _parse_timestamp(note.updated_at)
+        if updated is not None and (latest_time is None or updated > latest_time):
+            latest, latest_time = note.updated_at, updated
+    return latest
+
+
+def _appointments_unchanged(sync, appointments_updated_at):
+    """
+    Tell whether a patient has had no appointment activity since their last sync.
+    
+    Args:
+        sync (dict): The patient's watermarks from the ledger
+        appointments_updated_at (str): Current latest appointment activity
+        
+    Returns:
+        bool: True only if both timestamps are known and nothing is newer
+    """
+    previous = _parse_timestamp(sync.get("appointments_updated_at"))
+    current = _parse_timestamp(appointments_updated_at)
+    return previous is not None and current is not None and current <= previous
+
+
+async def iter_new_note_pages_async(api_base_url, auth_token, patient_id, session, ledger, page_size=0, prefetch=4,
+                                    batch_size=50, note_type="encounter_notes", query=None, updated_since=None,
+                                    **request_options):
+    """
+    Yield pages holding only the notes that are not in the ledger yet.
+    
+    Phase one lists the patient's notes with a JSON:API sparse fieldset so
+    only ids and updated_at are transferred, and diffs them against the
+    ledger. Phase two requests full bodies for the new notes only, in
+    batches of `batch_size` ids using filter[id].
+    
+    Servers that ignore the sparse fieldset send bodies in phase one, which
+    are used as they are. If the id filter is ignored, the first batch
+    response is the full listing, so it is read to the end, filtered on the
+    client, and no further batches are requested.
+    
+    Args:
+        api_base_url: Base URL for the Adracare API
+        auth_token: JWT authentication token
+        patient_id: Adracare patient ID
+        session: aiohttp ClientSession
+        ledger (NoteLedger): Processed-note ledger
+        page_size: Notes requested per page; 0 leaves paging to the API (default: 0)
+        prefetch: Maximum pages requested concurrently (default: 4)
+        batch_size: Note ids per body request (default: 50)
+        note_type: JSON:API resource type used in the fieldset (default: "encounter_notes")
+        query: Extra query parameters for the listing (default: None)
+        updated_since: Only list notes updated at or after this timestamp (default: None)
+        **request_options: timeout, max_retries and retry_delay for each request
+        
+    Yields:
+        dict: Pages like iter_encounter_note_pages_async. The first page also
+        carries "listed" (notes in the listing), "changed" (ids of processed
+        notes whose updated_at has moved on since they were recorded) and
+        "latest_updated_at" (newest updated_at in the listing). Body pages carry
+        "listed": 0, as their notes were counted with the listing.
+    """
+    listing = []
+    bodies = {}
+    listing_bytes = 0
+    pages = iter_encounter_note_pages_async(
+        api_base_url, auth_token, patient_id, session, page_size=page_size, prefetch=prefetch,
+        query={**(query or {}), f"fields[{note_type}]": "updated_at"}, item_parser=_parse_note_listing,
+        **request_options
+    )
+    if updated_since:
+        pages = iter_updated_pages_async(pages, updated_since)
+    try:
+        async for page in pages:
+            if "error" in page:
+                yield page
+                return
+            listing_bytes += page.get("bytes", 0)
+            for note in page["notes"]:
+                listing.append(note)
+                if note.notes is not None:
+                    bodies[note.id] = note
+    finally:
+        await pages.aclose()
+    
+    known = ledger.lookup_updated_at([note.id for note in listing])
+    new_ids = list(dict.fromkeys(note.id for note in listing if note.id not in known))
+    changed = [
+        note.id for note in listing
+        if note.id in known and known[note.id] and note.updated_at and note.updated_at != known[note.id]
+    ]
+    
+    # Phase one already carried the bodies if the server ignored the fieldset
+    yield {
+        "notes": [bodies[note_id] for note_id in new_ids if note_id in bodies],
+        "listed": len(listing),
+        "changed": changed,
+        "latest_updated_at": _latest_updated_at(listing),
+        "bytes": listing_bytes
+    }
+    
+    wanted = [note_id for note_id in new_ids if note_id not in bodies]
+    remaining = set(wanted)
+    for i in range(0, len(wanted), batch_size):
+        batch = wanted[i:i + batch_size]
+        requested = set(batch)
+        filter_ignored = False
+        pages = iter_encounter_note_pages_async(
+            api_base_url, auth_token, patient_id, session, page_size=page_size, prefetch=prefetch,
+            query={"filter[id]": ",".join(batch)}, **request_options
+        )
+        try:
+            async for page in pages:
+                if "error" in page:
+                    yield page
+                    return
+                if any(note.id not in requested for note in page["notes"]):
+                    filter_ignored = True
+                page["notes"] = [
+                    note for note in page["notes"]
+                    if note.id in remaining and (filter_ignored or note.id in requested)
+                ]
+                remaining.difference_update(note.id for note in page["notes"])
+                page["listed"] = 0
+                yield page
+        finally:
+            await pages.aclose()
+        if filter_ignored or not remaining:
+            break
+    
+    if remaining:
+        logger.warning("%d listed notes for patient %s were not returned with bodies.", len(remaining), patient_id)
+
+
+def _extract_texts_timed(html_documents):
+    """Run extract_texts_from_html, timing it as the html_extraction stage."""
+    with timed("html_extraction"):
+        return extract_texts_from_html(html_documents)
+
+
+async def process_patient_async(db, api_base_url, auth_token, patient_id, default_author_id, session, ledger,
+                                page_size=0, page_prefetch=4, sparse_fetch=False, sparse_batch_size=50,
+                                updated_since=None, updated_filter="filter[updated_at][gte]"):
     """
     Process encounter notes for a single patient asynchronously.
     
+    Notes are consumed page by page: notes already in the ledger are dropped,
+    and the text of the remaining notes is extracted straight away so their
+    raw HTML is not kept for the rest of the run. The new notes collect in a
+    NoteBuffer, which spills them to disk if the note memory budget runs out.
+    
     Args:
         db (Database): Database connection handler
         api_base_url (str): Adracare API base URL
@@ -125,145 +732,260 @@ async def process_patient_async(db, api_base_url, auth_token, patient_id, defaul
         patient_id (str): External patient ID from Adracare
         default_author_id (int): Default author user ID
         session: aiohttp ClientSession
+        ledger (NoteLedger): Processed-note ledger
+        page_size (int): Notes requested per page; 0 leaves paging to the API
+        page_prefetch (int): Maximum pages requested concurrently
+        sparse_fetch (bool): List ids and updated_at first and fetch bodies of new notes only
+        sparse_batch_size (int): Note ids per body request in sparse mode
+        updated_since (str): Watermark from the last sync; only notes updated at or after it are fetched
+        updated_filter (str): Query parameter carrying the watermark to the API; empty to filter client-side only
         
     Returns:
-        dict: Results of patient processing
+        dict: Results of patient processing. "notes_data" is a NoteBuffer the caller
+        closes once the notes are written. "notes_updated_at" is the newest
+        updated_at seen, the patient's next watermark once its notes are written.
     """
     # Initialize result structure
     patient_result = {
         "patient_id": patient_id,
         "messages": [],
         "notes_found": 0,
+        "bytes_fetched": 0,
         "processed_notes": [],
         "success": False
     }
     
-    msg = f"Fetching encounter notes for patient {patient_id}..."
-    print(msg)
-    patient_result["messages"].append(msg)
-    
-    try:
-        # Use the updated function with retry logic and longer timeout
-        encounter_notes_response = await get_encounter_notes_async(
-            api_base_url, auth_token, patient_id, session, 
+    logger.debug("Fetching encounter notes for patient %s...", patient_id)
+    patient_result["messages"].append(f"Fetching encounter notes for patient {patient_id}...")
+    started = time.perf_counter()
+    
+    # Ask for notes newest first and past the watermark when syncing incrementally
+    query = {}
+    if updated_since:
+        query["sort"] = "-updated_at"
+        if updated_filter:
+            query[updated_filter] = updated_since
+    
+    # Use the paginated fetcher with retry logic and longer timeout
+    if sparse_fetch:
+        pages = iter_new_note_pages_async(
+            api_base_url, auth_token, patient_id, session, ledger,
+            page_size=page_size, prefetch=page_prefetch, batch_size=sparse_batch_size,
+            query=query, updated_since=updated_since,
             timeout=120, max_retries=3, retry_delay=5
         )
+    else:
+        pages = iter_encounter_note_pages_async(
+            api_base_url, auth_token, patient_id, session,
+            page_size=page_size, prefetch=page_prefetch, query=query,
+            timeout=120, max_retries=3, retry_delay=5
+        )
+        if updated_since:
+            pages = iter_updated_pages_async(pages, updated_since)
+    
+    new_notes = NoteBuffer()
+    try:
+        local_patient_id = None
+        page_count = 0
+        already_processed = 0
+        latest_updated_at = None
+        loop = asyncio.get_event_loop()
         
-        if "error" in encounter_notes_response:
-            error_msg = f"Error fetching notes for patient {patient_id}: {encounter_notes_response['error']}"
-            print(error_msg)
-            patient_result["messages"].append(error_msg)
-            patient_result["error"] = encounter_notes_response["error"]
-            return patient_result
-        
-        notes_data = extract_notes_data(encounter_notes_response)
-        
-        msg = f"Found {len(notes_data)} encounter notes for {patient_id}."
-        print(msg)
-        patient_result["messages"].append(msg)
-        patient_result["notes_found"] = len(notes_data)
-        
-        if notes_data:
-            local_patient_id = db.get_local_patient_id(patient_id)
-            if not local_patient_id:
-                error_msg = f"Could not find local patient ID for Adracare patient ID: {patient_id}"
-                print(error_msg)
+        async for page in pages:
+            if "error" in page:
+                error_msg = f"Error fetching notes for patient {patient_id}: {page['error']}"
+                logger.warning("Error fetching notes for patient %s: %s", patient_id, page["error"])
                 patient_result["messages"].append(error_msg)
-                patient_result["error"] = error_msg
+                patient_result["error"] = page["error"]
+                patient_result["failure"] = page.get("failure", "connection")
                 return patient_result
             
+            page_count += 1
+            notes_data = page["notes"]
+            patient_result["notes_found"] += page.get("listed", len(notes_data))
+            patient_result["bytes_fetched"] += page.get("bytes", 0)
+            latest_updated_at = _latest_updated_at(notes_data, page.get("latest_updated_at") or latest_updated_at)
+            if page.get("changed"):
+                patient_result["changed_notes"] = page["changed"]
+                msg = (f"{len(page['changed'])} processed notes for {patient_id} have changed since they were "
+                       f"imported; they are not re-imported.")
+                logger.info("%d processed notes for %s have changed since they were imported; they are not "
+                            "re-imported.", len(page["changed"]), patient_id)
+                patient_result["messages"].append(msg)
+            if not notes_data:
+                continue
+            
+            if local_patient_id is None:
+                try:
+                    with timed("patient_lookup"):
+                        local_patient_id = db.get_local_patient_id(patient_id)
+                except Exception as e:
+                    # The database, not the patient, is at fault: retried on the next run
+                    error_msg = f"Database error looking up local patient ID for {patient_id}: {e}"
+                    logger.error("Database error looking up local patient ID for %s: %s", patient_id, e)
+                    patient_result["messages"].append(error_msg)
+                    patient_result["error"] = error_msg
+                    patient_result["failure"] = "database_error"
+                    return patient_result
+                if not local_patient_id:
+                    error_msg = f"Could not find local patient ID for Adracare patient ID: {patient_id}"
+                    logger.error("Could not find local patient ID for Adracare patient ID: %s", patient_id)
+                    patient_result["messages"].append(error_msg)
+                    patient_result["error"] = error_msg
+                    patient_result["failure"] = "no_local_patient"
+                    return patient_result
+            
+            # Add only notes that haven't been processed yet
+            page_notes = []
             for note in notes_data:
-                note["local_patient_id"] = local_patient_id
-                note["external_patient_id"] = patient_id
+                if note.id not in ledger:
+                    page_notes.append(note)
+                else:
+                    already_processed += 1
+                    logger.debug("Note %s already processed, skipping.", note.id)
             
-            patient_result["notes_data"] = notes_data
+            # Extract text off the event loop, then release the raw HTML
+            note_texts = await loop.run_in_executor(
+                None, _extract_texts_timed, [note.notes for note in page_notes]
+            )
+            for note, note_text in zip(page_notes, note_texts):
+                note.local_patient_id = local_patient_id
+                note.external_patient_id = patient_id
+                note.set_text(note_text)
+            new_notes.extend(page_notes)
+        
+        patient_result["notes_updated_at"] = latest_updated_at
+        across_pages = f" across {page_count} pages" if page_count > 1 else ""
+        msg = f"Found {patient_result['notes_found']} encounter notes for {patient_id}{across_pages}."
+        if already_processed:
+            # One line per patient instead of one per note
+            msg += f" {already_processed} were already processed."
+            get_stage_timings().count("notes_already_processed", already_processed)
+        logger.info(
+            "Found %d encounter notes for %s%s (%d already processed).",
+            patient_result["notes_found"], patient_id, across_pages, already_processed,
+            extra={"fields": {"patient_id": patient_id, "notes_found": patient_result["notes_found"],
+                              "already_processed": already_processed, "pages": page_count}}
+        )
+        patient_result["messages"].append(msg)
+        
+        if patient_result["notes_found"]:
+            patient_result["notes_data"] = new_notes
             patient_result["local_patient_id"] = local_patient_id
             patient_result["external_patient_id"] = patient_id
             patient_result["success"] = True
         else:
             no_notes_msg = "No notes to process."
-            print(no_notes_msg)
+            logger.debug("No notes to process for patient %s.", patient_id)
             patient_result["messages"].append(no_notes_msg)
             patient_result["success"] = True
     
     except Exception as e:
         error_msg = f"Error processing patient {patient_id}: {str(e)}"
-        print(error_msg)
+        logger.error("Error processing patient %s: %s", patient_id, e)
         patient_result["messages"].append(error_msg)
         patient_result["error"] = str(e)
+        # Responses that can't be parsed fail their page with "malformed"; anything
+        # raised here (a bad date, a full spill disk) may well clear up on a later run
+        patient_result["failure"] = "exception"
+    
+    finally:
+        # Cancel any prefetched pages if processing stopped early
+        await pages.aclose()
+        if "notes_data" not in patient_result:
+            new_notes.close()
+        patient_result["fetch_seconds"] = round(time.perf_counter() - started, 3)
     
     return patient_result
 
 
-async def write_sql_async(db, sql_file, notes_data, default_author_id, results_dict):
+async def write_sql_async(db, writer, notes_data, default_author_id):
     """
     Generate and write SQL statements asynchronously.
     
+    The statements are handed to the writer, which buffers them; the caller
+    checkpoints the writer to get them on disk and only then records the
+    returned notes in the ledger. Notes in a NoteBuffer are rendered and
+    written one spilled segment at a time. Errors from the writer are raised,
+    as the output is then behind whatever was handed to it.
+    
     Args:
         db (Database): Database connection handler
-        sql_file (str): Path to the SQL output file
-        notes_data (list): List of note data dictionaries
+        writer (SQLWriter): Writer of the run's output
+        notes_data (list): List of NoteRecord objects, or a NoteBuffer
         default_author_id (int): Default author user ID
-        results_dict (dict): Results dictionary to update
         
     Returns:
-        list: Processed records information
+        list: Arguments of NoteLedger.record_note for each note written
     """
     processed_records = []
     
-    try:
-        # Generate SQL in a thread pool to avoid blocking the event loop
-        with ThreadPoolExecutor() as executor:
-            loop = asyncio.get_event_loop()
-            sql_statements = await loop.run_in_executor(
-                executor, 
-                lambda: [
-                    generate_note_sql(
-                        db,
-                        note, 
-                        note["local_patient_id"], 
-                        default_author_id
-                    ) for note in notes_data
-                ]
-            )
-        
-        # Write all SQL statements to the file asynchronously
-        async with aiofiles.open(sql_file, "a") as f:
-            for i, (note, sql_statement) in enumerate(zip(notes_data, sql_statements)):
-                if sql_statement:
-                    # Add comment with note_id and patient_id
-                    comment = f"-- note_id: {note.get('id', 'unknown')}, patient_id: {note['external_patient_id']}\n"
-                    await f.write(comment)
-                    await f.write(sql_statement + "\n\n")
-                    
-                    created_at = note.get("created_at")
-                    note_id = note.get("id")
-                    processed_records.append((created_at, note_id))
-                    
-                    # Update results dictionary
-                    if note_id:
-                        results_dict["processed_notes"][note_id] = {
-                            "patient_id": note.get("patient_id"),
-                            "local_patient_id": note["local_patient_id"],
-                            "external_patient_id": note["external_patient_id"],
-                            "created_at": created_at,
-                            "processed_at": datetime.now().isoformat(),
-                            "sql_generated": True
-                        }
-    
-    except Exception as e:
-        print(f"Error writing SQL: {e}")
+    # Generate SQL in a thread pool to avoid blocking the event loop
+    def generate_all(load):
+        notes = load()
+        # Extract any text not already extracted in one batch so repeated templates are parsed once
+        pending = [note for note in notes if note.text is None]
+        if pending:
+            for note, note_text in zip(pending, _extract_texts_timed([note.notes for note in pending])):
+                note.set_text(note_text)
+        statements = []
+        for note in notes:
+            with timed("sql_render"):
+                statements.append(generate_note_sql(
+                    db,
+                    note, 
+                    note.local_patient_id, 
+                    default_author_id
+                ))
+        return notes, statements
+    
+    if isinstance(notes_data, NoteBuffer):
+        chunks = notes_data.chunk_loaders()
+    else:
+        chunks = [lambda: notes_data]
+    
+    with ThreadPoolExecutor() as executor:
+        loop = asyncio.get_event_loop()
+        for load in chunks:
+            notes, sql_statements = await loop.run_in_executor(executor, generate_all, load)
+            await _append_sql_async(writer, notes, sql_statements, processed_records)
     
     return processed_records
 
 
+async def _append_sql_async(writer, notes, sql_statements, processed_records):
+    """
+    Append rendered statements to the output.
+    
+    Args:
+        writer (SQLWriter): Writer of the run's output
+        notes (list): NoteRecord objects
+        sql_statements (list): Statement of each note, None where rendering failed
+        processed_records (list): Extended with the NoteLedger.record_note arguments of each note written
+    """
+    for note, sql_statement in zip(notes, sql_statements):
+        if sql_statement:
+            # Add comment with note_id and patient_id
+            await writer.write(
+                f"-- note_id: {note.id}, patient_id: {note.external_patient_id}\n{sql_statement}\n\n"
+            )
+            processed_records.append((
+                note.id,
+                note.patient_id,
+                note.local_patient_id,
+                note.external_patient_id,
+                note.created_at,
+                note.updated_at
+            ))
+
+
 def generate_note_sql(db, note, local_patient_id, default_author_id):
     """
     Generate SQL for a single note without executing it.
     
     Args:
         db (Database): Database connection for ID lookups
-        note (dict): Note data
+        note (NoteRecord): Note data
         local_patient_id (int): Local patient ID
         default_author_id (int): Default author user ID
         
@@ -271,25 +993,30 @@ def generate_note_sql(db, note, local_patient_id, default_author_id):
         str: SQL statement for the note, or None if there's an error
     """
     try:
-        # Extract text from HTML
-        note_text = extract_text_from_html(note.get("notes", ""))
-        created_at = note.get("created_at")
-        updated_at = note.get("updated_at")
+        # Extract text from HTML unless it was extracted when the note was fetched
+        note_text = note.text if note.text is not None else extract_text_from_html(note.notes)
+        created_at = note.created_at
+        updated_at = note.updated_at
         
         # Skip notes with missing created_at or updated_at
         if created_at is None or updated_at is None:
-            print(f"Skipping note {note.get('id', 'unknown')} due to missing created_at or updated_at")
+            logger.warning("Skipping note %s due to missing created_at or updated_at", note.id)
             return None
         
-        adracare_account_id = note.get("created_by_account_id")
+        adracare_account_id = note.created_by_account_id
         
         if adracare_account_id is None:
-            print(f"Missing created_by_account_id for note {note.get('id', 'unknown')}, using default_author_id: {default_author_id}")
+            get_stage_timings().count("notes_without_author")
+            logger.debug("Missing created_by_account_id for note %s, using default_author_id: %s",
+                         note.id, default_author_id)
             author_id = default_author_id
         else:
-            author_id = db.get_local_author_id(adracare_account_id)
+            with timed("author_lookup"):
+                author_id = db.get_local_author_id(adracare_account_id)
             if not author_id:
-                print(f"No user found for adracare_account_id: {adracare_account_id}, using default: {default_author_id}")
+                get_stage_timings().count("notes_unknown_author")
+                logger.warning("No user found for adracare_account_id: %s, using default: %s",
+                               adracare_account_id, default_author_id)
                 author_id = default_author_id
         
         sql_template = """
@@ -307,17 +1034,220 @@ def generate_note_sql(db, note, local_patient_id, default_author_id):
         return sql_statement
             
     except Exception as e:
-        print(f"Error generating SQL for note {note.get('id', 'unknown')}: {e}")
+        logger.error("Error generating SQL for note %s: %s", note.id, e)
         return None
 
 
-async def main_async():
-    """Main asynchronous execution function for the import script."""
+def _breaker_open(failure, max_attempts):
+    """
+    Tell whether a dead-lettered patient is kept out of routine runs.
+    
+    Permanent failures open the breaker straight away; others once the
+    patient has failed max_attempts runs in a row (0 never opens it).
+    """
+    return failure["permanent"] or (max_attempts > 0 and failure["attempts"] >= max_attempts)
+
+
+def schedule_patients(patient_ids, ledger, db, order="longest-first"):
+    """
+    Order patients so that the most expensive ones start first.
+    
+    A patient with thousands of notes that starts late leaves the whole run
+    waiting on it; started early, the cheap patients fill in around it. The
+    cost of a patient is predicted as the notes found for them in the latest
+    earlier run, or for patients not seen before their number of appointments
+    (roughly one note each).
+    
+    Args:
+        patient_ids (list): External patient IDs
+        ledger (NoteLedger): Processed-note ledger with earlier runs
+        db (Database): Database connection handler
+        order (str): "longest-first", or "id" to keep the given order
+        
+    Returns:
+        tuple: (ordered patient IDs, dict of predicted note counts by patient)
+    """
+    predictions = ledger.get_patient_note_counts()
+    unseen = [patient_id for patient_id in patient_ids if patient_id not in predictions]
+    if unseen:
+        predictions.update(db.get_appointment_counts(unseen))
+    predicted = {patient_id: predictions.get(patient_id, 0) for patient_id in patient_ids}
+    
+    if order == "longest-first":
+        # sorted() is stable, so patients with equal predictions keep their order
+        patient_ids = sorted(patient_ids, key=lambda patient_id: -predicted[patient_id])
+    return patient_ids, predicted
+
+
+async def save_results_async(results, results_file):
+    """
+    Write the results file atomically, so an interrupted run never leaves it truncated.
+    
+    Args:
+        results (dict): Results structure
+        results_file (str): Path of the results JSON file
+    """
+    temp_file = f"{results_file}.tmp"
+    async with aiofiles.open(temp_file, "w") as outfile:
+        await outfile.write(json.dumps(results, indent=2))
+    os.replace(temp_file, results_file)
+
+
+def restore_checkpointed_output(run):
+    """
+    Cut an interrupted run's output back to its last checkpoint.
+    
+    Anything after the checkpointed offset belongs to a patient whose notes
+    were never committed to the ledger; that patient is processed again.
+    
+    Args:
+        run (dict): Interrupted run from NoteLedger.get_incomplete_run
+    """
+    path = run["output_path"]
+    try:
+        discarded = restore_segments(path, run["output_offset"])
+    except Exception as e:
+        raise Exception(f"{e}; it was changed or removed after run {run['run_id']} was interrupted")
+    if discarded:
+        logger.info("Discarded %d bytes written to %s after the last checkpoint.", discarded, path)
+
+
+async def checkpoint_fetch_async(ledger, run_id, fetch):
+    """
+    Await a patient's fetch and record it in the run's checkpoints.
+    
+    Args:
+        ledger (NoteLedger): Processed-note ledger holding the checkpoints
+        run_id (int): Run ID
+        fetch: Awaitable returning the patient's result from process_patient_async
+        
+    Returns:
+        dict: The patient result
+    """
+    patient = await fetch
+    progress = get_progress()
+    progress.advance("patients")
+    progress.advance("notes", patient.get("notes_found", 0))
+    if patient.get("success", False):
+        ledger.checkpoint_patient(run_id, patient["patient_id"], "fetched", patient.get("notes_found", 0))
+    else:
+        progress.event("failures")
+        ledger.checkpoint_patient(run_id, patient["patient_id"], "failed", patient.get("notes_found", 0),
+                                  error=patient.get("error"))
+    ledger.commit()
+    return patient
+
+
+async def emit_patient_async(db, patient, default_author_id, ledger, run, writer, appointments_updated_at=None):
+    """
+    Write one patient's new notes to the run's output and checkpoint them.
+    
+    The statements are written out and synced first. Then the notes, the new
+    output offset, the patient's checkpoint and sync watermark are committed
+    to the ledger together. Output past the last committed offset is cut off
+    on resume, so the output and the ledger never disagree. If the output
+    can't be written, the ledger's pending changes are rolled back and the
+    error is raised.
+    
+    Args:
+        db (Database): Database connection handler
+        patient (dict): Successful patient result from process_patient_async
+        default_author_id (int): Default author user ID
+        ledger (NoteLedger): Processed-note ledger
+        run (dict): Current run ("run_id", "output_path", "output_offset")
+        writer (SQLWriter): Writer of the run's output
+        appointments_updated_at (str): Latest appointment activity seen for the patient
+        
+    Returns:
+        list: Arguments of NoteLedger.record_note for each note written
+    """
+    patient_id = patient["patient_id"]
+    notes = patient.get("notes_data", [])
+    processed_records = []
+    
+    if notes:
+        try:
+            processed_records = await write_sql_async(db, writer, notes, default_author_id)
+            output_offset = await writer.checkpoint()
+        except Exception:
+            # Nothing of this patient may be committed, least of all by closing the ledger
+            ledger.rollback()
+            raise
+        # Only notes that are on disk go into the ledger
+        for record in processed_records:
+            if record[0]:
+                ledger.record_note(*record)
+        run["output_offset"] = output_offset
+        ledger.set_run_output_offset(run["run_id"], run["output_offset"])
+    
+    # Advance the patient's watermark only if all of their new notes were written
+    if len(processed_records) == len(notes):
+        ledger.update_patient_sync(
+            patient_id,
+            notes_updated_at=patient.get("notes_updated_at"),
+            appointments_updated_at=appointments_updated_at
+        )
+    ledger.checkpoint_patient(run["run_id"], patient_id, "emitted", patient.get("notes_found", 0),
+                              len(processed_records))
+    with timed("ledger_commit"):
+        ledger.commit()
+    return processed_records
+
+
+async def main_async(resume=False, shard=None, refresh_patients=True, retry_failed=False, profile=False,
+                     profile_loop=False):
+    """
+    Main asynchronous execution function for the import script.
+    
+    Each patient is checkpointed in the ledger as it is fetched and as its
+    notes are written, and output.sql is extended patient by patient. A run
+    that dies part way can be continued with resume=True.
+    
+    In shard mode only the patients of one shard are processed, and the
+    output, ledger, response cache and results files get per-shard names so
+    shards can run side by side in separate processes or on separate hosts.
+    
+    Patients that fail are kept in the ledger's dead-letter store. Routine
+    runs leave out those whose failures are permanent (or keep recurring);
+    retry_failed=True runs only the dead-lettered patients.
+    
+    Args:
+        resume (bool): Continue the last interrupted run instead of starting a new one
+        shard (tuple): (index, count) of the shard to run, or None for all patients
+        refresh_patients (bool): Resolve patient IDs from the providers in the database;
+            if False the IDs already in config.json are used
+        retry_failed (bool): Process only the patients in the dead-letter store
+        profile (bool): Write CPU and memory profiles next to the results file
+        profile_loop (bool): Also sample what the event loop and its tasks are doing
+    """
     # Load basic configuration (will be updated later with patient IDs)
     config = load_config()
+    configure_logging(**config["logging"])
+    if profile or profile_loop:
+        configure_profiler(profile_directory(shard_path("results.json", shard)), "import", loop_sampling=profile_loop)
+    timings = configure_stage_timings()
+    metrics_config = config["metrics"]
+    metrics, metrics_exporter = configure_metrics(
+        "adracare_import",
+        IMPORT_METRICS,
+        port=metrics_config["port"] + (shard[0] if shard and metrics_config["port"] else 0),
+        textfile=metrics_config["textfile"] and shard_path(metrics_config["textfile"], shard),
+        interval=metrics_config["interval"]
+    )
+    metrics.timings = timings
+    metrics.set("run_start_timestamp_seconds", time.time())
+    configure_html_extractor(config["html_extractor"])
+    extraction_cache = configure_extraction_cache(config["html_cache_size"])
+    memory_budget = configure_memory_budget(**config["note_memory"])
+    response_cache = configure_response_cache(**{
+        **config["http_cache"],
+        "directory": config["http_cache"]["directory"] and shard_path(config["http_cache"]["directory"], shard)
+    })
+    request_hedger = configure_request_hedger(**config["request_hedging"])
+    output_file = shard_path(config["output_file"], shard)
     
     # Initialize results structure - or load existing one if it exists
-    results_file = "results.json"
+    results_file = shard_path("results.json", shard)
     try:
         async with aiofiles.open(results_file, "r") as infile:
             content = await infile.read()
@@ -327,43 +1257,142 @@ async def main_async():
         results = {
             "first_run": datetime.now().isoformat(),
             "last_run": datetime.now().isoformat(),
-            "patients": {},
-            "processed_notes": {}
+            "patients": {}
         }
     
+    # Open the processed-note ledger, importing any map left in results.json by older runs
+    ledger = NoteLedger(**{**config["note_ledger"], "path": shard_path(config["note_ledger"]["path"], shard)})
+    ledger.open()
+    legacy_notes = results.pop("processed_notes", None)
+    if legacy_notes:
+        imported = ledger.import_processed_notes(legacy_notes)
+        logger.info("Imported %d processed notes from %s into %s", imported, results_file, ledger.path)
+    
+    # Find a run that was interrupted before it finished
+    run = ledger.get_incomplete_run()
+    if resume and run is None:
+        logger.info("No interrupted migration to resume; starting a new run.")
+    elif not resume and run is not None:
+        # Its notes are already in the ledger, so keep the output that holds them
+        if run["output_offset"] and os.path.exists(run["output_path"]):
+            restore_checkpointed_output(run)
+            root, ext = split_extension(run["output_path"])
+            kept_output = f"{root}_run{run['run_id']}{ext}"
+            for index, segment in enumerate(output_segments(run["output_path"]), 1):
+                os.replace(segment, segment_path(kept_output, index))
+            logger.info("Run %d was interrupted and not resumed; its output was kept as %s. "
+                        "Load it as well as the output of this run.", run["run_id"], kept_output)
+        ledger.finish_run(run["run_id"], "abandoned")
+        run = None
+    
     # Initialize database connection
     db = Database(config["db_config"])
+    progress = None
+    writer = None
     
     try:
         if not db.connect():
             raise Exception("Failed to connect to the database")
         
-        # Load configuration with dynamic patient ID fetching
-        print("Fetching patient IDs from providers...")
-        config = load_config(fetch_patient_ids=True, db=db)
+        failures = ledger.get_failures()
+        blocked = []
+        if run:
+            # Continue with the patients the interrupted run had not finished
+            restore_checkpointed_output(run)
+            patient_ids = [
+                patient["patient_id"] for patient in ledger.get_run_patients(run["run_id"])
+                if patient["state"] not in ("emitted", "skipped")
+            ]
+            # Keep the order the run was scheduled in
+            _, predicted_notes = schedule_patients(patient_ids, ledger, db, order="id")
+            logger.info("Resuming run %d started at %s: %d patients left.",
+                        run["run_id"], run["started_at"], len(patient_ids))
+        elif retry_failed:
+            patient_ids = shard_patients(list(failures), shard)
+            logger.info("Retrying %d dead-lettered patients.", len(patient_ids))
+        else:
+            if refresh_patients:
+                # Load configuration with dynamic patient ID fetching
+                logger.info("Fetching patient IDs from providers...")
+                config = load_config(fetch_patient_ids=True, db=db)
+            patient_ids = shard_patients(config["patient_ids"], shard)
+            if shard:
+                logger.info("Shard %d/%d: %d of %d patients.", shard[0], shard[1], len(patient_ids),
+                            len(config["patient_ids"]))
+            
+            # Leave out patients whose failures are not expected to clear up on another try
+            blocked = [
+                patient_id for patient_id in patient_ids
+                if patient_id in failures and _breaker_open(failures[patient_id], config["dead_letter_max_attempts"])
+            ]
+            if blocked:
+                blocked_ids = set(blocked)
+                patient_ids = [patient_id for patient_id in patient_ids if patient_id not in blocked_ids]
+                if shard:
+                    logger.info("Skipping %d dead-lettered patients. Run 'python run.py shard %d retry-failed' to "
+                                "retry them or 'python run.py clear-failed --shards %d' to return them to routine "
+                                "runs.", len(blocked), shard[1], shard[1])
+                else:
+                    logger.info("Skipping %d dead-lettered patients. Run 'python run.py retry-failed' to retry them "
+                                "or 'python run.py clear-failed' to return them to routine runs.", len(blocked))
+        
+        if not run:
+            patient_ids, predicted_notes = schedule_patients(patient_ids, ledger, db, config["patient_order"])
+            run = {
+                "run_id": ledger.start_run(patient_ids, output_file),
+                "output_path": output_file,
+                "output_offset": 0
+            }
+        writer = SQLWriter(run["output_path"], run["output_offset"], **config["output"])
+        
+        mark_stage("scheduled")
         
         # Configure aiohttp session with proper timeout settings
         timeout = aiohttp.ClientTimeout(total=120)  # 2 minutes total timeout
 
         # Create aiohttp session for all HTTP requests
         async with aiohttp.ClientSession(timeout=timeout) as session:
-            print("Getting authentication token...")
-            auth_token = await get_auth_token_async(
-                config["api_base_url"],
-                config["username"],
-                config["password"],
-                session
-            )
-            print("Authentication successful!")
+            logger.info("Getting authentication token...")
+            with timed("auth"):
+                auth_token = await get_auth_token_async(
+                    config["api_base_url"],
+                    config["username"],
+                    config["password"],
+                    session
+                )
+            logger.info("Authentication successful!")
+            
+            # Load per-patient watermarks and appointment activity for incremental sync
+            patient_syncs = {}
+            appointment_activity = {}
+            if config["incremental_sync"]:
+                patient_syncs = ledger.get_patient_syncs()
+                appointment_activity = db.get_appointment_activity(patient_ids)
             
             # Process all patients concurrently
-            print(f"Processing {len(config['patient_ids'])} patients concurrently...")
+            logger.info("Processing %d patients concurrently...", len(patient_ids))
             tasks = []
-            for patient_id in config["patient_ids"]:
+            expected_notes = 0
+            skipped_patients = []
+            for patient_id in patient_ids:
                 # Initialize patient entry in results if needed
                 if patient_id not in results["patients"]:
                     results["patients"][patient_id] = []
                 
+                # Skip patients with no appointment activity since their last sync
+                sync = patient_syncs.get(patient_id)
+                if sync and not retry_failed and _appointments_unchanged(sync, appointment_activity.get(patient_id)):
+                    skipped_patients.append(patient_id)
+                    metrics.inc("patients_total", outcome="skipped")
+                    ledger.checkpoint_patient(run["run_id"], patient_id, "skipped")
+                    results["patients"][patient_id].append({
+                        "run_time": datetime.now().isoformat(),
+                        "notes_found": 0,
+                        "success": True,
+                        "skipped": "no new appointments"
+                    })
+                    continue
+                
                 # Create task for each patient
                 task = process_patient_async(
                     db, 
@@ -371,85 +1400,220 @@ async def main_async():
                     auth_token, 
                     patient_id, 
                     config["default_author_id"],
-                    session
+                    session,
+                    ledger,
+                    page_size=config["notes_page_size"],
+                    page_prefetch=config["notes_page_prefetch"],
+                    sparse_fetch=config["notes_sparse_fetch"],
+                    sparse_batch_size=config["notes_sparse_batch_size"],
+                    updated_since=sync["notes_updated_at"] if sync else None,
+                    updated_filter=config["notes_updated_filter"]
                 )
-                tasks.append(task)
+                tasks.append(checkpoint_fetch_async(ledger, run["run_id"], task))
+                expected_notes += predicted_notes.get(patient_id, 0)
+            ledger.commit()
+            
+            # Report progress against the queued patients and the notes predicted for them
+            progress_config = config["progress"]
+            progress = configure_progress(
+                "fetch",
+                {"patients": len(tasks)},
+                interval=progress_config["interval"],
+                status_file=progress_config["status_file"] and shard_path(progress_config["status_file"], shard),
+                tty=progress_config["tty"],
+                eta_unit="notes"
+            )
+            if expected_notes:
+                progress.set_total("notes", expected_notes, estimated=True)
             
             # Wait for all tasks to complete with a maximum of 10 concurrent tasks
             # This helps prevent overloading the server with too many simultaneous requests
+            processing_started = time.perf_counter()
+            metrics.set("patients_queued", len(tasks))
+            if blocked:
+                metrics.inc("patients_total", len(blocked), outcome="dead_lettered")
             patient_results = []
+            processed_count = 0
+            dead_lettered = 0
+            recovered = 0
             for i, batch in enumerate([tasks[j:j+10] for j in range(0, len(tasks), 10)]):
                 batch_results = await asyncio.gather(*batch)
                 patient_results.extend(batch_results)
+                metrics.inc("patients_queued", -len(batch))
+                metrics.set("notes_pending_write", sum(len(p.get("notes_data", [])) for p in batch_results))
+                
+                # Write each patient's notes in order and checkpoint them before the next batch
+                for patient in batch_results:
+                    patient_id = patient["patient_id"]
+                    if patient.get("success", False):
+                        if patient_id in failures:
+                            # Committed together with the patient's checkpoint
+                            ledger.clear_failures([patient_id])
+                            recovered += 1
+                        new_notes = patient.get("notes_data", [])
+                        if new_notes:
+                            logger.info("Added %d new notes from patient %s.", len(new_notes), patient_id)
+                        processed_records = await emit_patient_async(
+                            db,
+                            patient,
+                            config["default_author_id"],
+                            ledger,
+                            run,
+                            writer,
+                            appointment_activity.get(patient_id)
+                        )
+                        processed_count += len(processed_records)
+                        metrics.inc("notes_written_total", len(processed_records))
+                        metrics.inc("notes_pending_write", -len(new_notes))
+                        # The notes are on disk now; don't keep them for the rest of the run
+                        if "notes_data" in patient:
+                            patient.pop("notes_data").close()
+                    else:
+                        failure = patient.get("failure", "exception")
+                        metrics.inc("patient_failures_total", failure=failure)
+                        ledger.record_failure(patient_id, failure, patient.get("error"), failure in PERMANENT_FAILURES)
+                        dead_lettered += 1
+                    
+                    # Don't overwrite the entire history, just append new results
+                    patient_entry = {
+                        "run_time": datetime.now().isoformat(),
+                        "notes_found": patient.get("notes_found", 0),
+                        "predicted_notes": predicted_notes.get(patient_id, 0),
+                        "fetch_seconds": patient.get("fetch_seconds"),
+                        "success": patient.get("success", False)
+                    }
+                    if patient.get("changed_notes"):
+                        patient_entry["changed_notes"] = patient["changed_notes"]
+                    if "error" in patient:
+                        patient_entry["error"] = patient["error"]
+                        patient_entry["failure"] = patient.get("failure", "exception")
+                    
+                    results["patients"][patient_id].append(patient_entry)
+                    
+                    metrics.inc("patients_total", outcome="success" if patient.get("success", False) else "failed")
+                    metrics.inc("notes_fetched_total", patient.get("notes_found", 0))
+                    metrics.inc("bytes_fetched_total", patient.get("bytes_fetched", 0))
+                    metrics.set("last_progress_timestamp_seconds", time.time())
+                
+                elapsed = time.perf_counter() - processing_started
+                metrics.set("patients_per_second", round(len(patient_results) / elapsed, 3) if elapsed else 0)
+                metrics.set("notes_per_second", round(processed_count / elapsed, 3) if elapsed else 0)
+                ledger.commit()
+                await save_results_async(results, results_file)
+                
                 # Add a small delay between batches to reduce server load
-                if len(tasks) > 10:
-                    await asyncio.sleep(2)
+                if len(tasks) > 10 and config["batch_delay"]:
+                    await asyncio.sleep(config["batch_delay"])
                 
                 # Add this line to show progress
-                print(f"Processed batch {i+1}/{(len(tasks)-1)//10 + 1}")
+                logger.info("Processed batch %d/%d", i + 1, (len(tasks) - 1) // 10 + 1)
+            
+            results["progress"] = progress.stop()
+            mark_stage("fetched")
             
             # Filter out failed patients
             successful_patients = [p for p in patient_results if p.get("success", False)]
             failed_patients = [p for p in patient_results if not p.get("success", False)]
             
-            print(f"Successfully fetched data for {len(successful_patients)} patients.")
-            print(f"Failed to fetch data for {len(failed_patients)} patients.")
-            
-            # Collect all notes to process
-            all_notes = []
-            for patient in successful_patients:
-                patient_notes = patient.get("notes_data", [])
-                if patient_notes:
-                    # Add only notes that haven't been processed yet
-                    new_notes = []
-                    for note in patient_notes:
-                        note_id = note.get("id")
-                        if note_id not in results["processed_notes"]:
-                            new_notes.append(note)
-                        else:
-                            print(f"Note {note_id} already processed, skipping.")
-                    
-                    all_notes.extend(new_notes)
-                    print(f"Added {len(new_notes)} new notes from patient {patient['patient_id']}.")
-            
-            # Clear the output file for the first write
-            if all_notes and config["patient_ids"]:
-                # Open in write mode to clear the file
-                async with aiofiles.open("output.sql", "w") as f:
-                    await f.write("-- Adracare Encounter Notes SQL Import\n")
-                    await f.write(f"-- Generated at: {datetime.now().isoformat()}\n\n")
-            
-            # Write all notes to SQL file asynchronously
-            if all_notes:
-                print(f"Writing {len(all_notes)} notes to SQL file...")
-                processed_records = await write_sql_async(
-                    db,
-                    "output.sql",
-                    all_notes,
-                    config["default_author_id"],
-                    results
+            logger.info("Successfully fetched data for %d patients.", len(successful_patients))
+            logger.info("Failed to fetch data for %d patients.", len(failed_patients))
+            if skipped_patients:
+                logger.info("Skipped %d patients with no new appointments since their last sync.",
+                            len(skipped_patients))
+            
+            failures = ledger.get_failures()
+            results["dead_letters"] = {
+                "patients": len(failures),
+                "permanent": sum(1 for failure in failures.values() if failure["permanent"]),
+                "failed": dead_lettered,
+                "recovered": recovered,
+                "skipped": len(blocked)
+            }
+            if failures or recovered:
+                logger.info(
+                    "Dead letters: %d patients (%d permanent); %d failed this run, %d recovered, %d skipped.",
+                    len(failures), results["dead_letters"]["permanent"], dead_lettered, recovered, len(blocked)
                 )
+            
+            # Compare the predicted cost of the patients with what they actually cost
+            fetched = [p for p in patient_results if p.get("success", False)]
+            predicted_total = sum(predicted_notes.get(p["patient_id"], 0) for p in fetched)
+            actual_total = sum(p.get("notes_found", 0) for p in fetched)
+            prediction_error = sum(abs(predicted_notes.get(p["patient_id"], 0) - p.get("notes_found", 0)) for p in fetched)
+            results["scheduling"] = {
+                "order": config["patient_order"],
+                "predicted_notes": predicted_total,
+                "actual_notes": actual_total,
+                "mean_absolute_error": round(prediction_error / len(fetched), 2) if fetched else 0.0,
+                "fetch_seconds": round(sum(p.get("fetch_seconds", 0) for p in patient_results), 1),
+                "wall_seconds": round(time.perf_counter() - processing_started, 1)
+            }
+            logger.info(
+                "Scheduling (%s): predicted %d notes, found %d (mean absolute error %s per patient); "
+                "%ss of fetching took %ss.",
+                config["patient_order"], predicted_total, actual_total, results["scheduling"]["mean_absolute_error"],
+                results["scheduling"]["fetch_seconds"], results["scheduling"]["wall_seconds"]
+            )
+            
+            bytes_fetched = sum(p.get("bytes_fetched", 0) for p in patient_results)
+            results["bytes_fetched"] = bytes_fetched
+            logger.info("Transferred %.1f MiB of encounter notes.", bytes_fetched / 2**20)
+            
+            if processed_count:
+                logger.info("Successfully generated SQL for %d notes.", processed_count)
                 
-                print(f"Successfully generated SQL for {len(processed_records)} notes.")
+                extraction_stats = extraction_cache.stats()
+                results["html_extraction"] = extraction_stats
+                logger.info(
+                    "HTML extraction: %d documents parsed for %d notes (hit rate %.1f%%)",
+                    extraction_stats["extracted"], extraction_stats["documents"], extraction_stats["hit_rate"] * 100
+                )
             else:
-                print("No new notes to process.")
-                
-            # Update patient results in overall results
-            for patient in patient_results:
-                patient_id = patient["patient_id"]
-                # Don't overwrite the entire history, just append new results
-                patient_entry = {
-                    "run_time": datetime.now().isoformat(),
-                    "notes_found": patient.get("notes_found", 0),
-                    "success": patient.get("success", False)
-                }
-                if "error" in patient:
-                    patient_entry["error"] = patient["error"]
-                
-                results["patients"][patient_id].append(patient_entry)
+                logger.info("No new notes to process.")
+            
+            if response_cache:
+                cache_stats = response_cache.stats()
+                results["http_cache"] = cache_stats
+                logger.info(
+                    "Response cache: %d hits (%d revalidated), %d misses, %d evictions (hit rate %.1f%%)",
+                    cache_stats["hits"], cache_stats["revalidated"], cache_stats["misses"], cache_stats["evictions"],
+                    cache_stats["hit_rate"] * 100
+                )
+            
+            if memory_budget.limit:
+                memory_stats = memory_budget.stats()
+                results["note_memory"] = memory_stats
+                logger.info(
+                    "Note memory: peak %.1f MiB of a %.1f MiB budget; %d notes spilled to %d segments (%.1f MiB)",
+                    memory_stats["peak_bytes"] / 2**20, memory_stats["limit_bytes"] / 2**20,
+                    memory_stats["spilled_notes"], memory_stats["segments"], memory_stats["spilled_bytes"] / 2**20
+                )
+            
+            output_stats = writer.stats()
+            results["output"] = output_stats
+            if output_stats["bytes"]:
+                logger.info(
+                    "Output: %.1f MiB in %d segments, %d writes and %d syncs",
+                    output_stats["bytes"] / 2**20, output_stats["segments"], output_stats["flushes"],
+                    output_stats["fsyncs"]
+                )
+            
+            results["timings"] = timings.summary()
+            logger.info("Time per stage:\n%s", timings.format_summary())
+            
+            if request_hedger:
+                hedging_stats = request_hedger.stats()
+                results["request_hedging"] = hedging_stats
+                logger.info(
+                    "Request hedging: %d of %d requests hedged, %d won by the duplicate (delay %ss)",
+                    hedging_stats["hedged"], hedging_stats["requests"], hedging_stats["hedge_wins"],
+                    hedging_stats["delay_seconds"]
+                )
+            
+            ledger.finish_run(run["run_id"])
     
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error("Error: %s", e)
         if "errors" not in results:
             results["errors"] = []
         results["errors"].append({
@@ -458,22 +1622,75 @@ async def main_async():
         })
     
     finally:
+        if writer:
+            try:
+                await writer.close()
+            except Exception as e:
+                # Output past the last checkpoint is cut off on resume anyway
+                logger.error("Error closing %s: %s", writer.path, e)
         db.close()
+        ledger.close()
+        memory_budget.close()
+        if response_cache:
+            response_cache.close()
+        if progress:
+            # Publishes the final state if the run stopped early
+            progress.stop("stopped")
+        metrics.set("run_end_timestamp_seconds", time.time())
+        if metrics_exporter:
+            metrics_exporter.stop()
+    
+    profile_path = stop_profiler()
+    if profile_path:
+        results["profile"] = profile_path
+        logger.info("Profile written to %s", profile_path)
     
     # Write results to file
-    async with aiofiles.open(results_file, "w") as outfile:
-        await outfile.write(json.dumps(results, indent=2))
+    await save_results_async(results, results_file)
     
-    print(f"\nAll processing complete. See '{results_file}' for detailed logs.")
+    logger.info("All processing complete. See '%s' for detailed logs.", results_file)
+    shutdown_logging()
+
+
+def _shard_argument(spec):
+    """Parse --shard, reporting an invalid value as a usage error."""
+    try:
+        return parse_shard(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 
-def main():
-    """Entry point for script, runs the async main function."""
-    asyncio.run(main_async())
+def main(resume=False, shard=None, refresh_patients=True, retry_failed=False, profile=False, profile_loop=False):
+    """
+    Entry point for script, runs the async main function.
+    
+    Args:
+        resume (bool): Continue the last interrupted run instead of starting a new one
+        shard (tuple): (index, count) of the shard to run, or None for all patients
+        refresh_patients (bool): Resolve patient IDs from the database rather than config.json
+        retry_failed (bool): Process only the patients in the dead-letter store
+        profile (bool): Write CPU and memory profiles next to the results file
+        profile_loop (bool): Also sample what the event loop and its tasks are doing
+    """
+    asyncio.run(main_async(resume=resume, shard=shard, refresh_patients=refresh_patients, retry_failed=retry_failed,
+                           profile=profile, profile_loop=profile_loop))
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Fetch Adracare encounter notes and generate SQL inserts")
+    parser.add_argument("--resume", action="store_true", help="continue the last interrupted run")
+    parser.add_argument("--shard", type=_shard_argument, metavar="K/N", help="process only shard K of N")
+    parser.add_argument("--no-refresh", action="store_true",
+                        help="use the patient IDs already in config.json instead of querying providers")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="process only the patients in the dead-letter store")
+    parser.add_argument("--profile", action="store_true",
+                        help="write CPU and memory profiles next to the results file")
+    parser.add_argument("--profile-loop", action="store_true",
+                        help="also sample what the event loop and its tasks are doing (implies --profile)")
+    args = parser.parse_args()
+    main(resume=args.resume, shard=args.shard, refresh_patients=not args.no_refresh, retry_failed=args.retry_failed,
+         profile=args.profile, profile_loop=args.profile_loop)
 
 
 
@@ -62,9 +62,14 @@ import os
 import json
 from datetime import datetime
 import sys
+import subprocess
 
 # Import the main migration script
 from main import main as run_migration
+from config.settings import load_config
+from db.database import Database
+from db.ledger import NoteLedger
+from utils.sharding import merge_shard_results, shard_path
 
 
 def show_menu():
@@ -74,16 +79,16 @@ def show_menu():
         print("1. Start new migration of patient notes")
         print("2. Re-run migration of patient notes")
         print("3. Show providers and patient counts")
-        print("4. Exit")
+        print("4. Resume interrupted migration")
+        print("5. Retry failed patients")
+        print("6. Show failed patients")
+        print("7. Exit")
         
-        choice = input("\nEnter your choice (1-4): ")
+        choice = input("\nEnter your choice (1-7): ")
         
         if choice == "1":
             # Start new migration (remove existing results)
-            if os.path.exists("results.json"):
-                backup = f"results_backup_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
-                os.rename("results.json", backup)
-                print(f"Previous results backed up to {backup}")
+            backup_previous_results()
             run_migration()
             
         elif choice == "2":
@@ -97,12 +102,149 @@ def show_menu():
             show_provider_info()
             
         elif choice == "4":
+            # Continue the last run from its checkpoints
+            run_migration(resume=True)
+            
+        elif choice == "5":
+            # Reprocess only the patients in the dead-letter store
+            run_migration(retry_failed=True)
+            
+        elif choice == "6":
+            # List the dead-letter store
+            show_failed_patients()
+            
+        elif choice == "7":
             # Exit
             print("Exiting. Goodbye!")
             sys.exit(0)
             
         else:
-            print("Invalid choice. Please enter a number between 1 and 4.")
+            print("Invalid choice. Please enter a number between 1 and 7.")
+
+
+def backup_previous_results():
+    """
+    Move results.json aside and reset the processed notes so a new migration imports every note again.
+    
+    The ledger is copied before its processed notes and sync watermarks are
+    cleared; the dead-letter store and the run history stay in it.
+    """
+    suffix = datetime.now().strftime('%Y%m%d%H%M%S')
+    
+    if os.path.exists("results.json"):
+        backup = f"results_backup_{suffix}.json"
+        os.rename("results.json", backup)
+        print(f"Previous results backed up to {backup}")
+    
+    ledger_config = load_config()["note_ledger"]
+    if os.path.exists(ledger_config["path"]):
+        root, ext = os.path.splitext(ledger_config["path"])
+        backup = f"{root}_backup_{suffix}{ext}"
+        ledger = NoteLedger(**ledger_config)
+        ledger.open()
+        try:
+            ledger.backup(backup)
+            ledger.reset_processed_notes()
+        finally:
+            ledger.close()
+        print(f"Previous note ledger backed up to {backup}; processed notes and sync watermarks were reset, "
+              f"failed patients and run history kept")
+
+
+def open_ledgers(shard_count=None):
+    """Yield (shard label, opened ledger) for the unsharded ledger or each existing shard partition"""
+    ledger_config = load_config()["note_ledger"]
+    shards = [(index, shard_count) for index in range(shard_count)] if shard_count else [None]
+    for shard in shards:
+        path = shard_path(ledger_config["path"], shard)
+        if not os.path.exists(path):
+            continue
+        ledger = NoteLedger(**{**ledger_config, "path": path})
+        ledger.open()
+        try:
+            yield (f"{shard[0]}/{shard[1]}" if shard else ""), ledger
+        finally:
+            ledger.close()
+
+
+def show_failed_patients(shard_count=None):
+    """Display the patients in the dead-letter store, of every shard if shard_count is given"""
+    failures = []
+    for label, ledger in open_ledgers(shard_count):
+        failures.extend((label, patient_id, failure) for patient_id, failure in ledger.get_failures().items())
+    
+    if not failures:
+        print("\nNo failed patients.")
+        return
+    
+    print("\nFailed Patients:")
+    print("-" * 98)
+    print(f"{'Patient ID':<40}{'Shard':<8}{'Reason':<20}{'Attempts':<10}{'Last Failed':<20}")
+    print("-" * 98)
+    for label, patient_id, failure in failures:
+        reason = failure["reason"] + (" *" if failure["permanent"] else "")
+        print(f"{patient_id:<40}{label:<8}{reason:<20}{failure['attempts']:<10}{failure['last_failed_at'][:19]:<20}")
+    print("-" * 98)
+    if shard_count:
+        print(f"* permanent: left out of routine runs until retried with 'shard {shard_count} retry-failed' "
+              f"or cleared with 'clear-failed --shards {shard_count}'")
+    else:
+        print("* permanent: left out of routine runs until retried with 'retry-failed' or cleared with 'clear-failed'")
+
+
+def clear_failed_patients(patient_ids=None, shard_count=None):
+    """Remove patients (all if none are given) from the dead-letter store so routine runs include them again"""
+    cleared = 0
+    for _, ledger in open_ledgers(shard_count):
+        cleared += ledger.clear_failures(patient_ids or None)
+        ledger.commit()
+    print(f"Cleared {cleared} failed patients.")
+
+
+def shards_option(args):
+    """Split '--shards N' off command arguments; returns (N or None, remaining arguments)"""
+    if "--shards" in args:
+        index = args.index("--shards")
+        if index + 1 < len(args) and args[index + 1].isdigit():
+            return int(args[index + 1]), args[:index] + args[index + 2:]
+    return None, args
+
+
+def run_local_shards(shard_count, resume=False, retry_failed=False):
+    """Resolve the patient list once, run shard workers as local processes and merge their reports"""
+    if not resume and not retry_failed:
+        # Resolve patients once so every worker partitions the same list from config.json
+        config = load_config()
+        db = Database(config["db_config"])
+        if not db.connect():
+            print("Failed to connect to the database")
+            return
+        try:
+            print("Fetching patient IDs from providers...")
+            load_config(fetch_patient_ids=True, db=db)
+        finally:
+            db.close()
+    
+    workers = []
+    for index in range(shard_count):
+        log_path = shard_path("shard.log", (index, shard_count))
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+                   "--shard", f"{index}/{shard_count}", "--no-refresh"]
+        if resume:
+            command.append("--resume")
+        if retry_failed:
+            command.append("--retry-failed")
+        log = open(log_path, "w")
+        workers.append((index, subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT), log, log_path))
+        print(f"Started shard {index}/{shard_count} (log: {log_path})")
+    
+    for index, process, log, log_path in workers:
+        code = process.wait()
+        log.close()
+        status = "finished" if code == 0 else f"exited with code {code}"
+        print(f"Shard {index}/{shard_count} {status}")
+    
+    merge_shard_results(shard_count, output_file=load_config()["output_file"])
 
 
 def show_provider_info():
@@ -148,22 +290,43 @@ def show_provider_info():
 if __name__ == "__main__":
     # If command line arguments, use them
     if len(sys.argv) > 1:
+        # --profile writes CPU and memory profiles next to results.json; --profile-loop also samples the event loop
+        profile = {"profile": "--profile" in sys.argv[2:], "profile_loop": "--profile-loop" in sys.argv[2:]}
         if sys.argv[1] == "start-new":
             # Option 1 logic
-            if os.path.exists("results.json"):
-                backup = f"results_backup_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
-                os.rename("results.json", backup)
-                print(f"Previous results backed up to {backup}")
-            run_migration()
+            backup_previous_results()
+            run_migration(**profile)
         elif sys.argv[1] == "re-run":
             # Option 2 logic
-            run_migration()
+            run_migration(**profile)
         elif sys.argv[1] == "info":
             # Option 3 logic
             show_provider_info()
+        elif sys.argv[1] == "resume":
+            # Option 4 logic
+            run_migration(resume=True, **profile)
+        elif sys.argv[1] == "shard" and len(sys.argv) > 2 and sys.argv[2].isdigit():
+            # Run N local shard workers, then merge their reports
+            run_local_shards(int(sys.argv[2]), resume="resume" in sys.argv[3:],
+                             retry_failed="retry-failed" in sys.argv[3:])
+        elif sys.argv[1] == "merge" and len(sys.argv) > 2 and sys.argv[2].isdigit():
+            # Merge reports written by N shards (e.g. copied back from other hosts)
+            merge_shard_results(int(sys.argv[2]), output_file=load_config()["output_file"])
+        elif sys.argv[1] == "retry-failed":
+            # Option 5 logic
+            run_migration(retry_failed=True, **profile)
+        elif sys.argv[1] == "failed":
+            # Option 6 logic; --shards N lists the stores of N shards
+            show_failed_patients(shards_option(sys.argv[2:])[0])
+        elif sys.argv[1] == "clear-failed":
+            # Return the given patients (or all) to routine runs
+            shard_count, patient_ids = shards_option(sys.argv[2:])
+            clear_failed_patients(patient_ids, shard_count)
         else:
             print(f"Unknown command: {sys.argv[1]}")
-            print("Available commands: start-new, re-run, info")
+            print("Available commands: start-new, re-run, info, resume, retry-failed, failed [--shards N], "
+                  "clear-failed [--shards N] [patient_id ...], shard N [resume|retry-failed], merge N")
+            print("start-new, re-run, resume and retry-failed accept --profile and --profile-loop")
     else:
         # Interactive menu mode
         show_menu()
\ No newline at end of file
@@ -0,0 +1,30 @@
+"""
+Opening the processed-note ledger with a damaged Bloom filter file.
+"""
+import os
+import pytest
+from db.ledger import NoteLedger
+
+
+@pytest.mark.parametrize("keep", [0, 10, 47, 48, 100, -1])
+def test_truncated_filter_is_rebuilt(tmp_path, keep):
+    path = str(tmp_path / "processed_notes.db")
+    ledger = NoteLedger(path, capacity=1000)
+    ledger.open()
+    for index in range(50):
+        ledger.record_note(f"note-{index}", "patient", 1, "patient", "2024-01-01T00:00:00Z")
+    ledger.commit()
+    ledger.close()
+
+    size = os.path.getsize(ledger.filter_path)
+    with open(ledger.filter_path, "r+b") as f:
+        f.truncate(keep % size)
+
+    ledger = NoteLedger(path, capacity=1000)
+    ledger.open()
+    try:
+        assert all(f"note-{index}" in ledger for index in range(50))
+        assert "note-50" not in ledger
+        assert os.path.getsize(ledger.filter_path) == size
+    finally:
+        ledger.close()
@@ -0,0 +1,85 @@
+"""
+gzip and zstd output: formats from file names, chunks written as members or frames, and levels.
+"""
+import gzip
+import importlib.util
+import pytest
+from utils.compression import compress_chunk, compression_for, open_text, split_extension
+
+TEXT = "".join(f"INSERT INTO patient_notes VALUES ({index}, 'Follow up in 2 weeks');\n" for index in range(200))
+
+FORMATS = [
+    ("output.sql.gz", "gzip"),
+    pytest.param("output.sql.zst", "zstd", marks=pytest.mark.skipif(
+        importlib.util.find_spec("zstandard") is None, reason="zstd needs the zstandard package"
+    )),
+]
+
+
+@pytest.mark.parametrize("path, compression", [
+    ("output.sql", None),
+    ("output.sql.gz", "gzip"),
+    ("OUTPUT.SQL.GZ", "gzip"),
+    ("output.sql.zst", "zstd"),
+    ("output.sql.zstd", "zstd"),
+])
+def test_compression_for(path, compression):
+    assert compression_for(path) == compression
+
+
+@pytest.mark.parametrize("path, parts", [
+    ("output.sql", ("output", ".sql")),
+    ("output.sql.gz", ("output", ".sql.gz")),
+    ("out/put.sql.zst", ("out/put", ".sql.zst")),
+])
+def test_split_extension(path, parts):
+    assert split_extension(path) == parts
+
+
+@pytest.mark.parametrize("name, compression", FORMATS)
+def test_chunks_read_back_as_one_stream(tmp_path, name, compression):
+    path = str(tmp_path / name)
+    lines = TEXT.splitlines(keepends=True)
+    with open(path, "wb") as f:
+        for start in range(0, len(lines), 30):
+            f.write(compress_chunk("".join(lines[start:start + 30]).encode("utf-8"), compression))
+    with open_text(path) as f:
+        assert f.read() == TEXT
+
+
+@pytest.mark.parametrize("name, compression", FORMATS)
+def test_write_append_read(tmp_path, name, compression):
+    path = str(tmp_path / name)
+    with open_text(path, "w") as f:
+        f.write(TEXT)
+    with open_text(path, "a") as f:
+        f.write("-- appended\n")
+    with open_text(path) as f:
+        assert f.read() == TEXT + "-- appended\n"
+
+
+def test_level_zero_is_not_the_default():
+    data = TEXT.encode("utf-8")
+    stored = compress_chunk(data, "gzip", 0)
+    assert len(stored) > len(data)
+    assert len(compress_chunk(data, "gzip")) < len(data)
+    assert gzip.decompress(stored) == data
+
+
+def test_level_zero_when_streaming(tmp_path):
+    path = str(tmp_path / "output.sql.gz")
+    with open_text(path, "w", level=0) as f:
+        f.write(TEXT)
+    with open(path, "rb") as f:
+        assert len(f.read()) > len(TEXT)
+    with open_text(path) as f:
+        assert f.read() == TEXT
+
+
+def test_plain_text_is_unchanged(tmp_path):
+    assert compress_chunk(b"INSERT 1;\n", None) == b"INSERT 1;\n"
+    path = str(tmp_path / "output.sql")
+    with open_text(path, "w") as f:
+        f.write(TEXT)
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == TEXT
@@ -0,0 +1,90 @@
+"""
+The synthetic dataset: deterministic rows, skewed provider panels, and COPY rendering.
+"""
+import json
+from collections import Counter
+from datetime import datetime
+from benchmarks import dataset as dataset_module
+from benchmarks.dataset import SyntheticDataset, _copy, _copy_value
+from benchmarks.mock_api import SyntheticNotes
+
+
+class CopyCursor:
+    """Records the COPY statements and rows a cursor would send."""
+
+    def __init__(self):
+        self.copies = []
+
+    def copy_expert(self, sql, buffer):
+        self.copies.append((sql, buffer.read().splitlines()))
+
+
+def test_same_seed_same_dataset():
+    first, second = SyntheticDataset(scale=0.2, seed=5), SyntheticDataset(scale=0.2, seed=5)
+    assert first.patients == second.patients
+    assert list(first.users()) == list(second.users())
+    assert list(first.appointment_rows()) == list(second.appointment_rows())
+    assert SyntheticDataset(scale=0.2, seed=6).patients != first.patients
+
+
+def test_counts_follow_the_scale():
+    dataset = SyntheticDataset(scale=2, staff_per_provider=0.5)
+    assert dataset.patient_count == 2000 and len(set(dataset.patients)) == 2000
+    assert dataset.provider_count == 10
+    users = list(dataset.users())
+    assert len(users) == 15
+    providers, staff = users[:10], users[10:]
+    assert all(user[3] == "practitioner" and user[6] for user in providers)
+    assert all(user[3] == "staff" and user[6] is None for user in staff)
+    # Every account notes are attributed to exists as a user
+    assert [user[7] for user in users] == dataset.notes.accounts
+
+
+def test_provider_panels_are_skewed():
+    def panel_sizes(skew):
+        dataset = SyntheticDataset(scale=4, provider_skew=skew, shared_rate=0)
+        panels = {}
+        for patient, provider, _ in dataset.appointment_rows():
+            panels.setdefault(provider, set()).add(patient)
+        return sorted((len(patients) for patients in panels.values()), reverse=True)
+
+    skewed, even = panel_sizes(1.0), panel_sizes(0)
+    assert skewed[0] > 5 * skewed[-1]
+    assert even[0] < 1.5 * even[-1]
+
+
+def test_appointments_per_patient():
+    dataset = SyntheticDataset(scale=2, appointments=3, shared_rate=0.5)
+    rows = list(dataset.appointment_rows())
+    visits = Counter(patient for patient, _, _ in rows)
+    assert set(visits) == set(range(dataset.patient_count))
+    assert 2.5 < len(rows) / dataset.patient_count < 4.5
+    assert all(datetime(2020, 1, 1) <= updated_at < datetime(2026, 1, 1) for _, _, updated_at in rows)
+
+
+def test_manifest_reproduces_the_note_corpus():
+    dataset = SyntheticDataset(scale=0.5, seed=3, mean_notes=8, missing_rate=0.1)
+    manifest = json.loads(json.dumps(dataset.manifest()))
+    assert manifest["counts"]["patients"] == 500 and manifest["provider_ids"] is None
+    notes = SyntheticNotes(**manifest["notes"])
+    assert notes.accounts == dataset.notes.accounts
+    counts = [notes.note_count(patient) for patient in dataset.patients]
+    assert sum(counts) == manifest["counts"]["notes"]["total"]
+    assert max(counts) == manifest["counts"]["notes"]["max"]
+
+
+def test_copy_values():
+    assert _copy_value(None) == "\\N"
+    assert _copy_value(True) == "t" and _copy_value(False) == "f"
+    assert _copy_value(datetime(2024, 5, 1, 9, 30)) == "2024-05-01 09:30:00"
+    assert _copy_value("a\tb\nc\\d") == "a\\tb\\nc\\\\d"
+
+
+def test_copy_streams_in_chunks(monkeypatch):
+    monkeypatch.setattr(dataset_module, "COPY_CHUNK_ROWS", 4)
+    cursor = CopyCursor()
+    copied = _copy(cursor, "patients (id, external_id)", ((index, f"patient-{index}") for index in range(10)))
+    assert copied == 10
+    assert [len(rows) for _, rows in cursor.copies] == [4, 4, 2]
+    assert cursor.copies[0][0] == "COPY patients (id, external_id) FROM STDIN"
+    assert cursor.copies[2][1] == ["8\tpatient-8", "9\tpatient-9"]
@@ -0,0 +1,94 @@
+"""
+Classifying failed requests, and the dead-letter store that keeps failing patients out of routine runs.
+"""
+import asyncio
+import aiohttp
+import pytest
+from db.ledger import NoteLedger
+from main import PERMANENT_FAILURES, _breaker_open, get_encounter_notes_page_async
+
+COMPLETE = b'{"data": [{"id": "1", "type": "encounter_notes"} {"id": "2"}]}'
+CUT_SHORT = b'{"data": [{"id": "1", "type": "encounter_no'
+
+
+async def serve_raw(response):
+    """Answer every connection with the given bytes, then close it."""
+    async def handle(reader, writer):
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        writer.write(response)
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/notes"
+
+
+async def fetch(response):
+    server, url = await serve_raw(response)
+    try:
+        async with aiohttp.ClientSession() as session:
+            return await get_encounter_notes_page_async(url, "token", session, max_retries=2, retry_delay=0)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+def http_response(body, content_length=None):
+    headers = b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n"
+    if content_length is not None:
+        headers += b"Content-Length: %d\r\n" % content_length
+    return headers + b"\r\n" + body
+
+
+@pytest.mark.parametrize("response, failure", [
+    # A complete body that is not JSON won't get better by asking again
+    (http_response(COMPLETE, len(COMPLETE)), "malformed"),
+    # Fewer bytes than announced: the connection dropped
+    (http_response(CUT_SHORT, len(CUT_SHORT) + 100), "connection"),
+    # No length at all: a body cut short can't be told from a bad one
+    (http_response(CUT_SHORT), "connection"),
+], ids=["invalid", "dropped", "unbounded"])
+def test_failure_classes(response, failure):
+    result = asyncio.run(fetch(response))
+    assert result["failure"] == failure
+    assert result["notes"] == []
+
+
+def test_dead_letter_store(tmp_path):
+    path = str(tmp_path / "processed_notes.db")
+    ledger = NoteLedger(path, capacity=1000)
+    ledger.open()
+    ledger.record_failure("patient-1", "timeout", "timed out", permanent=False)
+    ledger.record_failure("patient-1", "connection", "reset", permanent=False)
+    ledger.record_failure("patient-2", "not_found", "404", permanent=True)
+    ledger.commit()
+    ledger.close()
+
+    ledger = NoteLedger(path, capacity=1000)
+    ledger.open()
+    try:
+        failures = ledger.get_failures()
+        assert failures["patient-1"]["attempts"] == 2
+        assert failures["patient-1"]["reason"] == "connection"
+        assert failures["patient-1"]["error"] == "reset"
+        assert failures["patient-2"]["permanent"]
+        assert ledger.clear_failures(["patient-2"]) == 1
+        assert list(ledger.get_failures()) == ["patient-1"]
+    finally:
+        ledger.close()
+
+
+@pytest.mark.parametrize("permanent, attempts, max_attempts, is_open", [
+    (True, 1, 3, True),
+    (False, 2, 3, False),
+    (False, 3, 3, True),
+    (False, 50, 0, False),
+])
+def test_breaker(permanent, attempts, max_attempts, is_open):
+    assert _breaker_open({"permanent": permanent, "attempts": attempts}, max_attempts) == is_open
+
+
+def test_only_unfixable_failures_are_permanent():
+    assert {"malformed", "not_found"} <= PERMANENT_FAILURES
+    assert not {"connection", "timeout", "exception", "database_error"} & PERMANENT_FAILURES
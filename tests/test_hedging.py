@@ -0,0 +1,76 @@
+"""
+Hedging slow requests with a duplicate.
+"""
+import asyncio
+from api.hedging import RequestHedger
+
+
+def make_hedger(max_fraction=1.0):
+    hedger = RequestHedger(min_samples=5, min_delay=0.01, max_fraction=max_fraction)
+    hedger.latencies.extend([0.01] * 5)
+    return hedger
+
+
+def test_slow_request_is_hedged_and_the_loser_settled():
+    hedger = make_hedger()
+    calls = []
+
+    async def make_request():
+        index = len(calls)
+        task = asyncio.current_task()
+        calls.append(task)
+        await asyncio.sleep(10 if index == 0 else 0.01)
+        return {"index": index}
+
+    async def run():
+        result = await hedger.run(make_request)
+        # The losing primary has finished cancelling by the time the result is returned
+        assert calls[0].cancelled()
+        return result
+
+    assert asyncio.run(run()) == {"index": 1}
+    assert hedger.stats()["hedged"] == 1
+    assert hedger.stats()["hedge_wins"] == 1
+
+
+def test_fast_request_is_not_hedged():
+    hedger = make_hedger()
+
+    async def make_request():
+        return {"ok": True}
+
+    assert asyncio.run(hedger.run(make_request)) == {"ok": True}
+    assert hedger.stats()["hedged"] == 0
+    assert len(hedger.latencies) == 6
+
+
+def test_failed_backup_falls_back_to_primary_error():
+    hedger = make_hedger()
+    calls = []
+
+    async def make_request():
+        index = len(calls)
+        calls.append(index)
+        await asyncio.sleep(0.05 if index == 0 else 0)
+        return {"error": f"failed {index}"}
+
+    assert asyncio.run(hedger.run(make_request)) == {"error": "failed 0"}
+    assert hedger.stats()["hedged"] == 1
+    assert hedger.stats()["hedge_wins"] == 0
+
+
+def test_duplicates_are_capped():
+    hedger = make_hedger(max_fraction=0.5)
+
+    async def make_request():
+        await asyncio.sleep(0.03)
+        # Failures leave the latency window, and so the hedging delay, unchanged
+        return {"error": "slow"}
+
+    async def run():
+        for _ in range(4):
+            await hedger.run(make_request)
+
+    asyncio.run(run())
+    assert hedger.stats()["requests"] == 4
+    assert hedger.stats()["hedged"] == 2
@@ -0,0 +1,117 @@
+"""
+The on-disk response cache: off unless configured, revalidation, TTL mode and eviction.
+"""
+import os
+import asyncio
+import aiohttp
+from api.http_cache import ResponseCache, configure_response_cache, get_response_cache
+from benchmarks.mock_api import MockAdracareAPI, SyntheticNotes, start_mock_api
+from config.settings import load_config
+from main import get_encounter_notes_page_async
+
+PATIENT = "patient-1"
+
+
+async def fetch_twice(cache, api, between=None):
+    runner, base_url = await start_mock_api(api, port=0)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{base_url}/account_token") as response:
+                token = (await response.json())["jwt"]
+            url = f"{base_url}/patients/{PATIENT}/encounter_notes"
+            results = []
+            for attempt in range(2):
+                if attempt and between:
+                    between(cache, url)
+                result = await get_encounter_notes_page_async(url, token, session, retry_delay=0, cache=cache)
+                assert "error" not in result
+                results.append(result)
+            return results
+    finally:
+        await runner.cleanup()
+
+
+def open_cache(tmp_path, **options):
+    cache = ResponseCache(str(tmp_path / "http_cache"), **options)
+    cache.open()
+    return cache
+
+
+def note_ids(result):
+    return [note.id for note in result["notes"]]
+
+
+def test_cache_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("HTTP_CACHE_DIR", raising=False)
+    settings = load_config()["http_cache"]
+    assert settings["directory"] == ""
+    assert configure_response_cache(settings["directory"], settings["max_bytes"], settings["ttl"]) is None
+    assert get_response_cache() is None
+
+
+def test_unchanged_response_is_revalidated(tmp_path):
+    cache = open_cache(tmp_path)
+    api = MockAdracareAPI(SyntheticNotes(mean_notes=20))
+    try:
+        first, second = asyncio.run(fetch_twice(cache, api))
+        assert note_ids(second) == note_ids(first)
+        assert first["bytes"] > 0 and second["bytes"] == 0
+        assert api.stats["statuses"] == {"200": 1, "304": 1}
+        assert cache.stats()["revalidated"] == 1
+    finally:
+        cache.close()
+
+
+def test_response_without_validators_is_served_within_its_ttl(tmp_path):
+    api = MockAdracareAPI(SyntheticNotes(mean_notes=20), etags=False)
+    cache = open_cache(tmp_path, ttl=60)
+    try:
+        first, second = asyncio.run(fetch_twice(cache, api))
+        assert note_ids(second) == note_ids(first)
+        assert api.stats["requests"] == 1
+        assert cache.stats()["fresh_hits"] == 1
+    finally:
+        cache.close()
+
+    # Without a TTL there is nothing to check such a response against, so it isn't kept
+    api = MockAdracareAPI(SyntheticNotes(mean_notes=20), etags=False)
+    cache = ResponseCache(str(tmp_path / "no_ttl"))
+    cache.open()
+    try:
+        asyncio.run(fetch_twice(cache, api))
+        assert api.stats["requests"] == 2
+        assert cache.stats()["entries"] == 0
+    finally:
+        cache.close()
+
+
+def test_truncated_body_is_refetched(tmp_path):
+    cache = open_cache(tmp_path)
+    api = MockAdracareAPI(SyntheticNotes(mean_notes=20))
+
+    def truncate(cache, url):
+        path = cache.body_path(url)
+        os.truncate(path, os.path.getsize(path) // 2)
+
+    try:
+        first, second = asyncio.run(fetch_twice(cache, api, between=truncate))
+        assert note_ids(second) == note_ids(first)
+        assert second["bytes"] > 0
+        assert cache.stats()["entries"] == 1
+    finally:
+        cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = open_cache(tmp_path, max_bytes=250)
+    try:
+        for index in range(3):
+            with open(cache.body_path(f"url-{index}"), "wb") as f:
+                f.write(b"x" * 100)
+            cache.store(f"url-{index}", '"etag"', None, 100)
+        assert cache.lookup("url-0") is None
+        assert cache.lookup("url-1") is not None and cache.lookup("url-2") is not None
+        assert cache.stats()["evictions"] == 1
+        assert not os.path.exists(cache.body_path("url-0"))
+    finally:
+        cache.close()
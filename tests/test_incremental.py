@@ -0,0 +1,97 @@
+"""
+Incremental sync: fetching only the notes updated since a patient's watermark.
+"""
+import asyncio
+import aiohttp
+import pytest
+from api.adracare import NoteRecord
+from benchmarks.mock_api import MockAdracareAPI, SyntheticNotes, start_mock_api
+from main import iter_encounter_note_pages_async, iter_updated_pages_async, _latest_updated_at
+
+PATIENT = "patient-3"
+
+
+def note(note_id, updated_at):
+    return NoteRecord(note_id, "<p>Note</p>", "2024-01-01T00:00:00Z", updated_at, PATIENT, None)
+
+
+async def pages_of(*pages, pulled):
+    for page in pages:
+        pulled.append(page)
+        yield page
+
+
+async def collect(pages, updated_since):
+    return [n.id for page in [p async for p in iter_updated_pages_async(pages, updated_since)] for n in page["notes"]]
+
+
+def test_unconfirmed_sort_is_filtered_on_every_page():
+    # The first page happens to be newest first, but the server never said it sorted
+    pulled = []
+    pages = pages_of(
+        {"notes": [note("a", "2024-03-01T00:00:00Z"), note("b", "2024-01-01T00:00:00Z")]},
+        {"notes": [note("c", "2024-04-01T00:00:00Z"), note("d", "2024-01-02T00:00:00Z")]},
+        pulled=pulled
+    )
+    assert asyncio.run(collect(pages, "2024-02-01T00:00:00Z")) == ["a", "c"]
+    assert len(pulled) == 2
+
+
+def test_confirmed_sort_stops_at_the_cutoff():
+    pulled = []
+    meta = {"sort": "-updated_at"}
+    pages = pages_of(
+        {"notes": [note("a", "2024-03-01T00:00:00Z"), note("b", "2024-01-01T00:00:00Z")], "meta": meta},
+        {"notes": [note("c", "2023-12-01T00:00:00Z")], "meta": meta},
+        pulled=pulled
+    )
+    assert asyncio.run(collect(pages, "2024-02-01T00:00:00Z")) == ["a"]
+    assert len(pulled) == 1
+
+
+def test_out_of_order_notes_disable_the_early_stop():
+    pulled = []
+    meta = {"sort": "-updated_at"}
+    pages = pages_of(
+        {"notes": [note("a", "2024-01-01T00:00:00Z"), note("b", "2024-03-01T00:00:00Z")], "meta": meta},
+        {"notes": [note("c", "2024-04-01T00:00:00Z")], "meta": meta},
+        pulled=pulled
+    )
+    assert asyncio.run(collect(pages, "2024-02-01T00:00:00Z")) == ["b", "c"]
+    assert len(pulled) == 2
+
+
+async def fetch_updated(sort, server_filter):
+    notes = SyntheticNotes(mean_notes=40)
+    listed = notes.notes(PATIENT)
+    updated = sorted(item["attributes"]["updated_at"] for item in listed)
+    cutoff = updated[len(updated) // 2]
+    api = MockAdracareAPI(notes, page_size=4, links="next", sort=sort)
+    runner, base_url = await start_mock_api(api, port=0)
+    query = {"sort": "-updated_at"}
+    if server_filter:
+        query["filter[updated_at][gte]"] = cutoff
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{base_url}/account_token") as response:
+                token = (await response.json())["jwt"]
+            pages = iter_encounter_note_pages_async(base_url, token, PATIENT, session, query=query, retry_delay=0)
+            fetched = []
+            async for page in iter_updated_pages_async(pages, cutoff):
+                assert "error" not in page
+                fetched.extend(page["notes"])
+    finally:
+        await runner.cleanup()
+    expected = {item["id"] for item in listed if item["attributes"]["updated_at"] >= cutoff}
+    return fetched, expected, api.stats["requests"], -(-len(listed) // 4)
+
+
+@pytest.mark.parametrize("sort", [True, False])
+@pytest.mark.parametrize("server_filter", [True, False])
+def test_only_notes_past_the_watermark_are_fetched(sort, server_filter):
+    fetched, expected, requests, all_pages = asyncio.run(fetch_updated(sort, server_filter))
+    assert sorted(n.id for n in fetched) == sorted(expected)
+    if sort and not server_filter:
+        # Sorted newest first, paging stops once the watermark is passed
+        assert requests < all_pages
+    assert _latest_updated_at(fetched) == max(n.updated_at for n in fetched)
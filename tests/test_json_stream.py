@@ -0,0 +1,43 @@
+"""
+StreamingArrayParser on bodies split into chunks at every byte offset.
+"""
+import json
+import asyncio
+import pytest
+from api.json_stream import StreamingArrayParser
+
+BODIES = [
+    b'{"data":[12.75]}',
+    b'{"data":[1e3]}',
+    b'{"meta":1.5,"data":[]}',
+    b'{"data":[-0.25E-2, 3, true, null, "caf\xc3\xa9"], "meta": {"total_count": 1234567, "ratio": 6.02e+23}}',
+    b'{"links":{"next":"/p?page%5Bnumber%5D=2"},"data":[{"id":"a","attributes":{"notes":"<p>x</p>","n":-17}},'
+    b'{"id":"b","attributes":{"notes":null,"n":0.5}}],"meta":{"total_count":2}}',
+]
+
+
+async def chunked(body, offsets):
+    start = 0
+    for offset in list(offsets) + [len(body)]:
+        yield body[start:offset]
+        start = offset
+
+
+async def parse(chunks):
+    parser = StreamingArrayParser(chunks)
+    items = [item async for item in parser.items()]
+    return items, parser.envelope
+
+
+@pytest.mark.parametrize("body", BODIES)
+def test_split_at_every_offset(body):
+    document = json.loads(body)
+    expected = (document.pop("data"), document)
+    for offset in range(1, len(body)):
+        assert asyncio.run(parse(chunked(body, [offset]))) == expected, offset
+
+
+@pytest.mark.parametrize("body", BODIES)
+def test_one_byte_chunks(body):
+    document = json.loads(body)
+    assert asyncio.run(parse(chunked(body, range(1, len(body))))) == (document.pop("data"), document)
@@ -0,0 +1,52 @@
+"""
+Backing up the processed-note ledger and resetting it for a new migration.
+"""
+import os
+from db.ledger import NoteLedger
+
+
+def open_ledger(path):
+    ledger = NoteLedger(path, capacity=1000)
+    ledger.open()
+    return ledger
+
+
+def test_reset_keeps_failures_and_runs(tmp_path):
+    path = str(tmp_path / "processed_notes.db")
+    ledger = open_ledger(path)
+    for index in range(20):
+        ledger.record_note(f"note-{index}", "patient", 1, "patient", "2024-01-01T00:00:00Z")
+    ledger.update_patient_sync("patient", notes_updated_at="2024-01-01T00:00:00Z")
+    ledger.record_failure("patient-2", "timeout", "timed out")
+    run_id = ledger.start_run(["patient"], "output.sql")
+    ledger.checkpoint_patient(run_id, "patient", "emitted", 20, 20)
+    ledger.finish_run(run_id)
+    ledger.commit()
+
+    backup = str(tmp_path / "processed_notes_backup.db")
+    ledger.backup(backup)
+    ledger.reset_processed_notes()
+    assert "note-0" not in ledger
+    ledger.record_note("note-100", "patient", 1, "patient", "2024-01-01T00:00:00Z")
+    ledger.close()
+
+    ledger = open_ledger(path)
+    try:
+        assert ledger.count() == 1
+        assert "note-100" in ledger
+        assert not any(f"note-{index}" in ledger for index in range(20))
+        assert ledger.get_patient_syncs() == {}
+        assert list(ledger.get_failures()) == ["patient-2"]
+        assert ledger.get_patient_note_counts() == {"patient": 20}
+    finally:
+        ledger.close()
+
+    assert not os.path.exists(f"{backup}.bloom")
+    ledger = open_ledger(backup)
+    try:
+        # The filter of the copy is built from its rows
+        assert ledger.count() == 20
+        assert all(f"note-{index}" in ledger for index in range(20))
+        assert ledger.get_patient_syncs()["patient"]["notes_updated_at"] == "2024-01-01T00:00:00Z"
+    finally:
+        ledger.close()
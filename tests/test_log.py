@@ -0,0 +1,75 @@
+"""
+Queued logging: rate limiting per message template, JSON lines and the file target.
+"""
+import json
+import time
+import logging
+import pytest
+from utils.log import JsonFormatter, RateLimitFilter, TextFormatter, configure_logging, shutdown_logging
+
+
+def make_record(msg, args=(), level=logging.WARNING, **extra):
+    record = logging.LogRecord("main", level, "main.py", 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_rate_limit_per_template():
+    limit = RateLimitFilter(burst=3, interval=0.2)
+    passed = [limit.filter(make_record("Retrying patient %s", (index,))) for index in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    # Other templates have their own budget
+    assert limit.filter(make_record("Skipping note %s", (1,)))
+    assert limit.pending() == {"Retrying patient %s": 7}
+
+    time.sleep(0.25)
+    record = make_record("Retrying patient %s", (10,))
+    assert limit.filter(record)
+    assert record.suppressed == 7
+    assert TextFormatter("%(message)s").format(record) == "Retrying patient 10 (7 similar messages suppressed)"
+
+
+def test_burst_zero_disables_limiting():
+    limit = RateLimitFilter(burst=0)
+    assert all(limit.filter(make_record("Same message")) for _ in range(100))
+
+
+def test_json_lines():
+    record = make_record("Found %d notes for %s", (3, "patient-1"), level=logging.INFO,
+                         fields={"patient_id": "patient-1", "notes_found": 3}, suppressed=2)
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "Found 3 notes for patient-1"
+    assert entry["level"] == "INFO" and entry["logger"] == "main"
+    assert entry["patient_id"] == "patient-1" and entry["notes_found"] == 3
+    assert entry["suppressed"] == 2
+    assert entry["time"].endswith("+00:00")
+
+
+@pytest.fixture
+def restore_root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    shutdown_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        if handler not in handlers:
+            handler.close()
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_file_target_and_shutdown_report(tmp_path, restore_root_logger):
+    path = str(tmp_path / "import.log")
+    configure_logging(level="INFO", fmt="json", file=path, burst=2, interval=60)
+    logger = logging.getLogger("main")
+    logger.debug("Not written")
+    for index in range(5):
+        logger.warning("Attempt %d failed", index)
+    shutdown_logging()
+
+    with open(path) as f:
+        messages = [json.loads(line)["message"] for line in f]
+    assert messages == ["Attempt 0 failed", "Attempt 1 failed",
+                        "3 more messages like 'Attempt %d failed' were suppressed"]
@@ -0,0 +1,79 @@
+"""
+Metrics in the Prometheus text exposition format, served over HTTP or written to a textfile.
+"""
+import socket
+import urllib.request
+from utils.metrics import CONTENT_TYPE, MetricsExporter, MetricsRegistry
+from utils.timing import StageTimings
+
+
+def make_registry():
+    registry = MetricsRegistry("adracare_import")
+    registry.describe("patients_total", "counter", "Patients processed, by outcome")
+    registry.inc("patients_total", outcome="success")
+    registry.inc("patients_total", 2, outcome="success")
+    registry.inc("patients_total", outcome="failed")
+    registry.set("notes_per_second", 12.5)
+    return registry
+
+
+def test_render():
+    lines = make_registry().render().splitlines()
+    assert lines == [
+        "# HELP adracare_import_notes_per_second notes_per_second",
+        "# TYPE adracare_import_notes_per_second gauge",
+        "adracare_import_notes_per_second 12.5",
+        "# HELP adracare_import_patients_total Patients processed, by outcome",
+        "# TYPE adracare_import_patients_total counter",
+        'adracare_import_patients_total{outcome="failed"} 1',
+        'adracare_import_patients_total{outcome="success"} 3',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.inc("errors_total", error='bad "quote"\\\nnext')
+    assert 'adracare_errors_total{error="bad \\"quote\\"\\\\\\nnext"} 1' in registry.render()
+
+
+def test_in_progress_gauge():
+    registry = MetricsRegistry()
+    with registry.in_progress("requests_in_flight"):
+        assert "adracare_requests_in_flight 1" in registry.render()
+    assert "adracare_requests_in_flight 0" in registry.render()
+
+
+def test_stage_timings_are_summaries():
+    registry = MetricsRegistry()
+    registry.timings = StageTimings()
+    for seconds in (0.1, 0.2, 0.3):
+        registry.timings.record("fetch_page", seconds)
+    text = registry.render()
+    assert "# TYPE adracare_stage_duration_seconds summary" in text
+    assert 'adracare_stage_duration_seconds{stage="fetch_page",quantile="0.5"} 0.2' in text
+    assert 'adracare_stage_duration_seconds_count{stage="fetch_page"} 3' in text
+    assert 'adracare_stage_duration_seconds_sum{stage="fetch_page"} 0.6' in text
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_endpoint_and_textfile(tmp_path):
+    registry = make_registry()
+    textfile = str(tmp_path / "import.prom")
+    exporter = MetricsExporter(registry, port=free_port(), textfile=textfile, interval=60)
+    exporter.start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{exporter.port}/metrics") as response:
+            assert response.headers["Content-Type"] == CONTENT_TYPE
+            assert response.read().decode("utf-8") == registry.render()
+        registry.inc("patients_total", outcome="failed")
+    finally:
+        exporter.stop()
+    # The textfile is written one last time on stop
+    with open(textfile) as f:
+        assert 'adracare_import_patients_total{outcome="failed"} 2' in f.read()
+    assert list(tmp_path.iterdir()) == [tmp_path / "import.prom"]
@@ -0,0 +1,96 @@
+"""
+The mock Adracare API: deterministic notes, and the faults it injects as the fetcher sees them.
+"""
+import random
+import asyncio
+import aiohttp
+import pytest
+from benchmarks.mock_api import MockAdracareAPI, SyntheticNotes, parse_latency, parse_size_mix, start_mock_api
+from main import get_encounter_notes_page_async
+
+PATIENT = "patient-1"
+
+
+def test_notes_are_deterministic():
+    first, second = SyntheticNotes(seed=3), SyntheticNotes(seed=3)
+    assert first.notes(PATIENT) == second.notes(PATIENT)
+    other = SyntheticNotes(seed=4)
+    assert [note["id"] for note in first.notes(PATIENT)] != [note["id"] for note in other.notes(PATIENT)]
+
+
+def test_note_counts_follow_the_mean_and_cap():
+    patients = [f"patient-{index}" for index in range(5000)]
+    counts = [SyntheticNotes(mean_notes=20).note_count(patient_id) for patient_id in patients]
+    # Shifted down so small patients occur, and skewed: the median is far below the mean
+    assert 14 < sum(counts) / len(counts) < 20
+    assert sorted(counts)[len(counts) // 2] < 10
+    assert max(SyntheticNotes(mean_notes=20, max_notes=200).note_count(patient_id) for patient_id in patients) == 200
+    assert 0 in [SyntheticNotes(mean_notes=2).note_count(patient_id) for patient_id in patients]
+    with pytest.raises(ValueError):
+        SyntheticNotes(skew=1).note_count(PATIENT)
+
+
+def test_missing_rate():
+    notes = SyntheticNotes(missing_rate=0.2)
+    missing = sum(notes.missing(f"patient-{index}") for index in range(5000))
+    assert 800 < missing < 1200
+    assert not any(SyntheticNotes().missing(f"patient-{index}") for index in range(100))
+
+
+def test_distributions():
+    rng = random.Random(1)
+    assert parse_latency("fixed:0.25")(rng) == 0.25
+    assert all(0.1 <= parse_latency("uniform:0.1:0.2")(rng) <= 0.2 for _ in range(100))
+    assert parse_latency("lognormal:-3:0.6")(rng) > 0
+    with pytest.raises(ValueError):
+        parse_latency("normal:1")
+    assert parse_size_mix("0.75:1,0.25:4") == ([1, 4], [0.75, 0.25])
+
+
+async def fetch(api, patient_id=PATIENT, max_retries=3, expire_token=False):
+    runner, base_url = await start_mock_api(api, port=0)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{base_url}/account_token") as response:
+                assert response.status == 201
+                token = (await response.json())["jwt"]
+            if expire_token:
+                await asyncio.sleep(api.token_ttl)
+            url = f"{base_url}/patients/{patient_id}/encounter_notes"
+            return await get_encounter_notes_page_async(url, token, session, max_retries=max_retries,
+                                                        retry_delay=0)
+    finally:
+        await runner.cleanup()
+
+
+def test_throttled_request_is_retried():
+    api = MockAdracareAPI(throttle_rate=0.5, seed=7)
+    draws = random.Random(7)
+    # Find how many 429s the seed answers with before the first success
+    throttled = next(index for index in range(10) if draws.random() >= 0.5)
+    assert throttled > 0
+    result = asyncio.run(fetch(api, max_retries=throttled + 1))
+    assert "error" not in result
+    assert len(result["notes"]) == len(api.notes.notes(PATIENT))
+    assert api.stats["statuses"] == {"429": throttled, "200": 1}
+
+
+def test_server_errors_exhaust_the_retries():
+    api = MockAdracareAPI(error_rate=1.0)
+    result = asyncio.run(fetch(api))
+    assert result["failure"] == "server_error" and result["notes"] == []
+    assert api.stats["statuses"] == {"500": 3}
+
+
+def test_missing_patient_is_not_retried():
+    api = MockAdracareAPI(SyntheticNotes(missing_rate=1.0))
+    result = asyncio.run(fetch(api))
+    assert result["failure"] == "not_found"
+    assert api.stats["statuses"] == {"404": 1}
+
+
+def test_expired_token_is_unauthorized():
+    api = MockAdracareAPI(token_ttl=0.05)
+    result = asyncio.run(fetch(api, max_retries=1, expire_token=True))
+    assert result["failure"] == "unauthorized"
+    assert api.stats["statuses"] == {"401": 1}
@@ -0,0 +1,102 @@
+"""
+Paging through a patient's notes against the mock API, in every pagination style.
+"""
+import os
+import asyncio
+import aiohttp
+import pytest
+from api.http_cache import configure_response_cache
+from benchmarks.mock_api import MockAdracareAPI, SyntheticNotes, start_mock_api
+from db.ledger import NoteLedger
+from main import iter_encounter_note_pages_async, iter_new_note_pages_async
+
+PATIENTS = [f"patient-{index}" for index in range(12)]
+
+
+async def fetch_note_ids(links, page_size, server_page_size=7):
+    notes = SyntheticNotes(mean_notes=20)
+    runner, base_url = await start_mock_api(MockAdracareAPI(notes, page_size=server_page_size, links=links), port=0)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{base_url}/account_token") as response:
+                token = (await response.json())["jwt"]
+            fetched = {}
+            for patient_id in PATIENTS:
+                ids = []
+                async for page in iter_encounter_note_pages_async(base_url, token, patient_id, session,
+                                                                  page_size=page_size, retry_delay=0):
+                    assert "error" not in page
+                    ids.extend(note.id for note in page["notes"])
+                fetched[patient_id] = ids
+    finally:
+        await runner.cleanup()
+    expected = {patient_id: [note["id"] for note in notes.notes(patient_id)] for patient_id in PATIENTS}
+    return fetched, expected
+
+
+@pytest.mark.parametrize("links", ["next", "last", "meta", "cursor"])
+@pytest.mark.parametrize("page_size", [0, 5])
+def test_all_notes_are_fetched(links, page_size):
+    fetched, expected = asyncio.run(fetch_note_ids(links, page_size))
+    assert sum(map(len, expected.values())) > len(PATIENTS) * 7
+    assert fetched == expected
+
+
+async def sparse_listed(tmp_path, page_size):
+    notes = SyntheticNotes(mean_notes=20)
+    runner, base_url = await start_mock_api(MockAdracareAPI(notes, page_size=7, links="meta"), port=0)
+    ledger = NoteLedger(str(tmp_path / "processed_notes.db"))
+    ledger.open()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{base_url}/account_token") as response:
+                token = (await response.json())["jwt"]
+            counted = {}
+            for patient_id in PATIENTS:
+                listed = 0
+                async for page in iter_new_note_pages_async(base_url, token, patient_id, session, ledger,
+                                                            page_size=page_size, batch_size=3, retry_delay=0):
+                    assert "error" not in page
+                    listed += page.get("listed", len(page["notes"]))
+                counted[patient_id] = listed
+    finally:
+        ledger.close()
+        await runner.cleanup()
+    return counted, {patient_id: notes.note_count(patient_id) for patient_id in PATIENTS}
+
+
+@pytest.mark.parametrize("page_size", [0, 5])
+def test_sparse_fetch_counts_each_note_once(tmp_path, page_size):
+    counted, expected = asyncio.run(sparse_listed(tmp_path, page_size))
+    assert counted == expected
+
+
+async def abandon_after_first_page(cache_directory):
+    notes = SyntheticNotes(mean_notes=40)
+    patient_id = max(PATIENTS, key=notes.note_count)
+    api = MockAdracareAPI(notes, page_size=2, links="last")
+    # The first two pages answer at once, the prefetched ones after them are still in flight
+    requests = iter(range(10**6))
+    api.latency = lambda rng: 0.0 if next(requests) < 2 else 0.5
+    runner, base_url = await start_mock_api(api, port=0)
+    configure_response_cache(cache_directory, 2**20)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{base_url}/account_token") as response:
+                token = (await response.json())["jwt"]
+            pages = iter_encounter_note_pages_async(base_url, token, patient_id, session, retry_delay=0)
+            await pages.__anext__()
+            await pages.__anext__()
+            # Later pages are in flight; stopping must settle them before returning
+            await pages.aclose()
+            return [task for task in asyncio.all_tasks()
+                    if "iter_encounter_note_pages_async" in task.get_coro().__qualname__]
+    finally:
+        configure_response_cache("", 0)
+        await runner.cleanup()
+
+
+def test_stopping_early_settles_prefetched_pages(tmp_path):
+    leftover = asyncio.run(abandon_after_first_page(str(tmp_path / "http_cache")))
+    assert leftover == []
+    assert not [name for name in os.listdir(tmp_path / "http_cache") if name.endswith(".tmp")]
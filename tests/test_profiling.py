@@ -0,0 +1,82 @@
+"""
+Profiling mode: CPU, memory and event-loop artefacts, and the diff of two profiles.
+"""
+import os
+import json
+import asyncio
+from utils import profiling
+from utils.profiling import Profiler, configure_profiler, diff_profiles, mark_stage, profile_directory, stop_profiler
+
+
+def busy(count):
+    return sum(index * index for index in range(count))
+
+
+def test_artefacts_and_stages(tmp_path):
+    directory = str(tmp_path / "profile")
+    profiler = Profiler(directory, label="unit").start()
+    data = [bytes(1000) for _ in range(1000)]
+    profiler.mark("allocated")
+    busy(10000)
+    assert profiler.stop() == directory
+
+    assert sorted(os.listdir(directory)) == ["cpu.prof", "cpu.txt", "memory.json", "profile.json"]
+    with open(os.path.join(directory, "profile.json")) as f:
+        summary = json.load(f)
+    assert summary["label"] == "unit"
+    assert [stage["stage"] for stage in summary["stages"]] == ["start", "allocated", "end"]
+    assert summary["stages"][1]["current_bytes"] - summary["stages"][0]["current_bytes"] >= len(data) * 1000
+    assert summary["files"] == ["cpu.prof", "cpu.txt", "memory.json"]
+    with open(os.path.join(directory, "memory.json")) as f:
+        stages = json.load(f)
+    assert "growth" not in stages[0] and "growth" in stages[1]
+    with open(os.path.join(directory, "cpu.txt")) as f:
+        assert "busy" in f.read()
+
+
+def test_loop_sampling(tmp_path):
+    directory = str(tmp_path / "profile")
+
+    async def run():
+        configure_profiler(directory, label="loop", loop_sampling=True, sample_interval=0.001)
+        mark_stage("fetch")
+        await asyncio.gather(*(asyncio.sleep(0.05) for _ in range(3)))
+        return stop_profiler()
+
+    assert asyncio.run(run()) == directory
+    assert profiling._profiler is None and stop_profiler() is None
+    with open(os.path.join(directory, "profile.json")) as f:
+        summary = json.load(f)
+    assert summary["loop_samples"] > 0
+    assert summary["files"][3:] == ["loop_running.folded", "loop_awaiting.folded", "loop.txt"]
+    with open(os.path.join(directory, "loop_awaiting.folded")) as f:
+        assert any(line.rsplit(" ", 1)[1].strip().isdigit() for line in f)
+    with open(os.path.join(directory, "loop.txt")) as f:
+        assert "Tasks suspended" in f.read()
+
+
+def test_mark_without_a_profiler_does_nothing():
+    assert profiling._profiler is None
+    mark_stage("ignored")
+
+
+def test_profile_directory_next_to_the_report(tmp_path):
+    report = str(tmp_path / "results.json")
+    assert profile_directory(report, "20250101120000") == str(tmp_path / "profile_results_20250101120000")
+
+
+def test_diff_profiles(tmp_path):
+    directories = []
+    for name, count in (("before", 1000), ("after", 200000)):
+        profiler = Profiler(str(tmp_path / name)).start()
+        profiler.mark("work")
+        busy(count)
+        directories.append(profiler.stop())
+
+    lines = diff_profiles(*directories, limit=5).splitlines()
+    assert lines[0].split()[:2] == ["Cum", "before"]
+    assert len(lines[1:lines.index("")]) <= 5
+    generator = next(line.split() for line in lines if line.endswith("<genexpr> (test_profiling.py:12)"))
+    assert generator[4:6] == ["1001", "200001"]
+    stages = [line.split()[0] for line in lines[lines.index("") + 2:]]
+    assert stages == ["start", "work", "end"]
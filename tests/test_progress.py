@@ -0,0 +1,63 @@
+"""
+Progress counts, throughput and ETA, and the JSON status file.
+"""
+import json
+import pytest
+from utils import progress as progress_module
+from utils.progress import ProgressReporter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(progress_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_rate_and_eta(clock):
+    reporter = ProgressReporter("fetch", {"patients": 100}, interval=1, window=10)
+    for _ in range(10):
+        clock[0] += 1
+        reporter.advance("patients", 2)
+        snapshot = reporter.snapshot()
+    assert snapshot["units"]["patients"]["rate_per_second"] == 2.0
+    assert snapshot["units"]["patients"]["percent"] == 20.0
+    assert snapshot["eta_seconds"] == 40.0
+    assert reporter.format_line(snapshot) == "[fetch] patients 20/100 (20.0%) | 2.0 patients/s | ETA 0:00:40"
+
+
+def test_rate_follows_the_recent_window(clock):
+    reporter = ProgressReporter("fetch", {"notes": 1000}, interval=1, window=4)
+    for second in range(20):
+        clock[0] += 1
+        reporter.advance("notes", 10 if second < 10 else 1)
+        snapshot = reporter.snapshot()
+    assert snapshot["units"]["notes"]["rate_per_second"] == 1.0
+
+
+def test_exceeded_estimate_falls_back_to_the_next_unit(clock):
+    reporter = ProgressReporter("fetch", {"patients": 10}, interval=1, eta_unit="notes")
+    reporter.set_total("notes", 50, estimated=True)
+    clock[0] += 10
+    reporter.advance("patients", 5)
+    reporter.advance("notes", 80)
+    snapshot = reporter.snapshot()
+    # The prediction of 50 notes was wrong, so the patients left decide the ETA
+    assert snapshot["eta_seconds"] == 10.0
+    assert snapshot["units"]["notes"]["estimated"]
+    assert "notes 80/~50 |" in reporter.format_line(snapshot)
+
+
+def test_events_and_final_state(tmp_path, clock):
+    status_file = str(tmp_path / "status.json")
+    reporter = ProgressReporter("load", {"statements": 4}, interval=60, status_file=status_file).start()
+    reporter.advance("statements", 4)
+    reporter.event("failures")
+    clock[0] += 5
+    final = reporter.stop()
+    assert reporter.stop() is final
+    assert final["state"] == "finished" and final["eta_seconds"] is None
+    with open(status_file) as f:
+        assert json.load(f)["events"] == {"failures": 1}
+    assert reporter.format_line(final).endswith("done in 0:00:05 | failures 1")
+    assert list(tmp_path.iterdir()) == [tmp_path / "status.json"]
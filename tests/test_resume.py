@@ -0,0 +1,102 @@
+"""
+Cutting an interrupted run's output back to its last checkpoint and continuing after it.
+"""
+import os
+import asyncio
+import pytest
+from utils.compression import open_text
+from utils.sql_writer import SQLWriter, output_segments, restore_segments
+
+
+async def write_patients(writer, patients):
+    """Write each patient's statements and checkpoint them, as emit_patient_async does."""
+    offsets = []
+    for patient in patients:
+        for statement in patient:
+            await writer.write(statement)
+        offsets.append(await writer.checkpoint())
+    return offsets
+
+
+def patients(start, count):
+    return [[f"INSERT {index}.{note};\n" for note in range(3)] for index in range(start, start + count)]
+
+
+def read_output(path):
+    text = ""
+    for segment in output_segments(path):
+        with open_text(segment) as f:
+            text += f.read()
+    return text
+
+
+def statements(text):
+    return [line for line in text.splitlines() if line.startswith("INSERT")]
+
+
+@pytest.mark.parametrize("name", ["output.sql", "output.sql.gz"])
+@pytest.mark.parametrize("segment_size", [0, 100])
+@pytest.mark.parametrize("checkpoint", [1, 3, 5])
+def test_resume_after_checkpoint(tmp_path, name, segment_size, checkpoint):
+    path = str(tmp_path / name)
+
+    async def interrupted():
+        writer = SQLWriter(path, segment_size=segment_size)
+        offsets = await write_patients(writer, patients(0, 6))
+        # Output written past the checkpoint, which the ledger never saw committed
+        await writer.write("INSERT lost;\n")
+        await writer.close()
+        return offsets[checkpoint - 1]
+
+    offset = asyncio.run(interrupted())
+    assert restore_segments(path, offset) > 0
+
+    async def resumed():
+        writer = SQLWriter(path, offset, segment_size=segment_size)
+        await write_patients(writer, patients(checkpoint, 6 - checkpoint))
+        await writer.close()
+
+    asyncio.run(resumed())
+    assert statements(read_output(path)) == [statement.strip() for patient in patients(0, 6) for statement in patient]
+
+
+def test_restore_at_a_rotation_continues_in_the_previous_segment(tmp_path):
+    path = str(tmp_path / "output.sql")
+
+    async def interrupted():
+        writer = SQLWriter(path, segment_size=1)
+        offsets = await write_patients(writer, patients(0, 3))
+        await writer.close()
+        return offsets
+
+    offsets = asyncio.run(interrupted())
+    assert len(output_segments(path)) == 3
+    restore_segments(path, offsets[0])
+    assert output_segments(path) == [path]
+    assert os.path.getsize(path) == offsets[0]
+
+
+def test_nothing_checkpointed_leaves_the_output_alone(tmp_path):
+    path = str(tmp_path / "output.sql")
+    with open(path, "w") as f:
+        f.write("INSERT previous;\n")
+
+    assert restore_segments(path, 0) == 0
+    assert read_output(path) == "INSERT previous;\n"
+
+    async def resumed():
+        writer = SQLWriter(path, 0)
+        await write_patients(writer, patients(0, 1))
+        await writer.close()
+
+    # The resumed run replaces it once it has something to write, like a new run
+    asyncio.run(resumed())
+    assert statements(read_output(path)) == ["INSERT 0.0;", "INSERT 0.1;", "INSERT 0.2;"]
+
+
+def test_output_shorter_than_the_checkpoint_is_an_error(tmp_path):
+    path = str(tmp_path / "output.sql")
+    with open(path, "w") as f:
+        f.write("INSERT 0;\n")
+    with pytest.raises(Exception):
+        restore_segments(path, 100)
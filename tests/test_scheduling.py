@@ -0,0 +1,66 @@
+"""
+Ordering patients so the ones expected to take longest start first.
+"""
+from db.ledger import NoteLedger
+from main import schedule_patients
+
+
+class AppointmentCounts:
+    """Answers appointment counts from a dict, and remembers which patients were asked about."""
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.asked = []
+
+    def get_appointment_counts(self, external_ids):
+        self.asked.extend(external_ids)
+        return {patient_id: self.counts[patient_id] for patient_id in external_ids if patient_id in self.counts}
+
+
+def open_ledger(tmp_path):
+    ledger = NoteLedger(str(tmp_path / "processed_notes.db"), capacity=1000)
+    ledger.open()
+    return ledger
+
+
+def test_longest_first_from_earlier_runs_and_appointments(tmp_path):
+    ledger = open_ledger(tmp_path)
+    try:
+        run_id = ledger.start_run(["seen-small", "seen-large"], "output.sql")
+        ledger.checkpoint_patient(run_id, "seen-small", "emitted", 2, 2)
+        ledger.checkpoint_patient(run_id, "seen-large", "emitted", 50, 50)
+        ledger.finish_run(run_id)
+        db = AppointmentCounts({"new-medium": 10, "seen-small": 99})
+
+        order, predicted = schedule_patients(["seen-small", "new-none", "new-medium", "seen-large"], ledger, db)
+        assert order == ["seen-large", "new-medium", "seen-small", "new-none"]
+        assert predicted == {"seen-small": 2, "new-none": 0, "new-medium": 10, "seen-large": 50}
+        # Appointments are only counted for patients no run has fetched yet
+        assert sorted(db.asked) == ["new-medium", "new-none"]
+    finally:
+        ledger.close()
+
+
+def test_latest_run_wins(tmp_path):
+    ledger = open_ledger(tmp_path)
+    try:
+        for notes_found in (40, 3):
+            run_id = ledger.start_run(["patient"], "output.sql")
+            ledger.checkpoint_patient(run_id, "patient", "fetched", notes_found)
+            ledger.finish_run(run_id)
+        _, predicted = schedule_patients(["patient"], ledger, AppointmentCounts({}))
+        assert predicted == {"patient": 3}
+    finally:
+        ledger.close()
+
+
+def test_id_order_and_ties_keep_the_given_order(tmp_path):
+    ledger = open_ledger(tmp_path)
+    try:
+        db = AppointmentCounts({"b": 5, "c": 5, "d": 9})
+        order, _ = schedule_patients(["a", "b", "c", "d"], ledger, db, order="id")
+        assert order == ["a", "b", "c", "d"]
+        order, _ = schedule_patients(["a", "b", "c", "d"], ledger, db)
+        assert order == ["d", "b", "c", "a"]
+    finally:
+        ledger.close()
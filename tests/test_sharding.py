@@ -0,0 +1,81 @@
+"""
+Partitioning patients across shards and merging the shards' results and output.
+"""
+import json
+import pytest
+from utils.compression import open_text
+from utils.sharding import merge_shard_results, parse_shard, shard_of, shard_path, shard_patients
+from utils.sql_writer import segment_path
+
+PATIENTS = [f"patient-{index}" for index in range(200)]
+
+
+@pytest.mark.parametrize("spec, shard", [("0/1", (0, 1)), ("3/4", (3, 4))])
+def test_parse_shard(spec, shard):
+    assert parse_shard(spec) == shard
+
+
+@pytest.mark.parametrize("spec", ["4/4", "-1/4", "1/0", "1", "a/b"])
+def test_invalid_shard(spec):
+    with pytest.raises(ValueError):
+        parse_shard(spec)
+
+
+def test_shards_partition_the_patients():
+    shards = [shard_patients(PATIENTS, (index, 4)) for index in range(4)]
+    assert sorted(sum(shards, [])) == sorted(PATIENTS)
+    # Every shard gets a fair share, in the original order
+    assert all(30 < len(shard) < 70 for shard in shards)
+    assert all(shard == [patient for patient in PATIENTS if patient in shard] for shard in shards)
+    assert shard_patients(PATIENTS, None) == PATIENTS
+
+
+def test_shard_of_is_stable():
+    # A hash that changed between processes or releases would move patients to another ledger partition
+    assert [shard_of(patient, 4) for patient in PATIENTS[:8]] == [0, 0, 3, 1, 1, 3, 2, 0]
+    assert shard_of("patient-0", 1) == 0
+    assert shard_of(12345, 7) == shard_of("12345", 7)
+
+
+@pytest.mark.parametrize("path, shard, expected", [
+    ("output.sql", None, "output.sql"),
+    ("output.sql", (0, 4), "output.shard0of4.sql"),
+    ("output.sql.gz", (3, 4), "output.shard3of4.sql.gz"),
+    ("http_cache", (1, 2), "http_cache.shard1of2"),
+])
+def test_shard_path(path, shard, expected):
+    assert shard_path(path, shard) == expected
+
+
+@pytest.mark.parametrize("name", ["output.sql", "output.sql.gz"])
+def test_merge(tmp_path, name):
+    results_file = str(tmp_path / "results.json")
+    output_file = str(tmp_path / name)
+    for index in range(3):
+        shard = (index, 3)
+        if index == 1:
+            continue
+        with open(shard_path(results_file, shard), "w") as f:
+            json.dump({
+                "patients": {f"patient-{index}": [{"success": True}]},
+                "errors": [{"error": f"error {index}"}],
+                "bytes_fetched": 100,
+                "first_run": f"2024-01-0{index + 1}",
+                "last_run": f"2024-02-0{index + 1}"
+            }, f)
+        # Shard 2 wrote two segments
+        for part in range(1, 3 if index == 2 else 2):
+            with open_text(segment_path(shard_path(output_file, shard), part), "w") as f:
+                f.write(f"INSERT {index}.{part};\n")
+
+    merged = merge_shard_results(3, results_file, output_file)
+    assert sorted(merged["patients"]) == ["patient-0", "patient-2"]
+    assert [error["shard"] for error in merged["errors"]] == ["0/3", "2/3"]
+    assert merged["bytes_fetched"] == 200
+    assert merged["first_run"] == "2024-01-01" and merged["last_run"] == "2024-02-03"
+    assert merged["shards"]["1/3"] == {"missing": True}
+    with open(results_file) as f:
+        assert json.load(f)["patients"] == merged["patients"]
+    with open_text(output_file) as f:
+        statements = [line for line in f.read().splitlines() if line.startswith("INSERT")]
+    assert statements == ["INSERT 0.1;", "INSERT 2.1;", "INSERT 2.2;"]
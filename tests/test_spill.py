@@ -0,0 +1,85 @@
+"""
+Note buffers under a memory budget: spilling to disk, order and contents on the way back, cleanup.
+"""
+import os
+from api.adracare import NoteRecord
+from utils import spill
+from utils.spill import MemoryBudget, NoteBuffer, configure_memory_budget, get_memory_budget, note_size
+
+
+def make_notes(patient, count, start=0):
+    return [NoteRecord(f"{patient}-note-{index}", None, "2024-01-01T00:00:00Z", "2024-01-02T00:00:00Z", patient,
+                       "account-1", local_patient_id=7, external_patient_id=patient, text="x" * (100 + index))
+            for index in range(start, start + count)]
+
+
+def fields(notes):
+    return [tuple(getattr(note, field) for field in spill.FIELDS) for note in notes]
+
+
+def test_without_a_limit_nothing_spills(tmp_path):
+    budget = MemoryBudget(directory=str(tmp_path / "spill"))
+    buffer = NoteBuffer(budget)
+    notes = make_notes("a", 50)
+    buffer.extend(notes)
+    assert list(buffer) == notes and len(buffer) == 50
+    assert budget.stats()["spilled_notes"] == 0 and budget.used == sum(map(note_size, notes))
+    assert not os.path.exists(tmp_path / "spill")
+    buffer.close()
+    assert budget.used == 0
+
+
+def test_spilled_notes_come_back_in_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(spill, "FRAME_NOTES", 8)
+    budget = MemoryBudget(limit=20 * note_size(make_notes("a", 1)[0]), directory=str(tmp_path))
+    buffers = {patient: NoteBuffer(budget) for patient in ("a", "b")}
+    expected = {patient: [] for patient in buffers}
+    for start in range(0, 60, 15):
+        for patient, buffer in buffers.items():
+            notes = make_notes(patient, 15, start)
+            buffer.extend(notes)
+            expected[patient].extend(notes)
+        assert budget.used <= budget.limit
+
+    stats = budget.stats()
+    assert stats["spilled_notes"] > 0 and stats["segments"] >= 2
+    assert stats["peak_bytes"] > budget.limit
+    for patient, buffer in buffers.items():
+        assert len(buffer) == 60
+        assert fields(buffer) == fields(expected[patient])
+        # Spilled frames hold at most FRAME_NOTES notes each
+        assert all(len(load()) <= 8 for load in buffer.chunk_loaders())
+
+    segments = [path for buffer in buffers.values() for path in buffer.segments]
+    for buffer in buffers.values():
+        buffer.close()
+    assert not any(os.path.exists(path) for path in segments)
+    assert budget.used == 0
+    budget.close()
+    assert os.listdir(tmp_path) == []
+
+
+def test_largest_buffer_spills_first(tmp_path):
+    size = note_size(make_notes("a", 1)[0])
+    budget = MemoryBudget(limit=30 * size, directory=str(tmp_path))
+    small, large = NoteBuffer(budget), NoteBuffer(budget)
+    small.extend(make_notes("small", 5))
+    large.extend(make_notes("large", 20))
+    large.extend(make_notes("large", 10, 20))
+    assert large.memory == [] and len(large.segments) == 1
+    assert len(small.memory) == 5 and small.segments == []
+
+
+def test_configure_replaces_the_shared_budget(tmp_path):
+    previous = get_memory_budget()
+    try:
+        budget = configure_memory_budget(1, str(tmp_path))
+        buffer = NoteBuffer()
+        assert buffer.budget is budget
+        buffer.extend(make_notes("a", 3))
+        assert len(os.listdir(tmp_path)) == 1
+        configure_memory_budget()
+        # The replaced budget's spill directory is deleted with it
+        assert os.listdir(tmp_path) == []
+    finally:
+        spill._budget = previous
@@ -0,0 +1,209 @@
+"""
+Writing the generated SQL in coalesced chunks and segments, and recording what was written in the ledger.
+"""
+import os
+import asyncio
+import pytest
+from api.adracare import NoteRecord
+from db.ledger import NoteLedger
+from main import emit_patient_async
+from utils.sql_writer import SQLWriter, output_segments, segment_path
+
+
+class LocalDatabase:
+    """Resolves every author and quotes parameters by hand, without a database server."""
+
+    def get_local_author_id(self, account_id):
+        return 7
+
+    def _format_properly_escaped_sql(self, template, params):
+        for param in params:
+            template = template.replace("%s", str(param) if isinstance(param, int) else f"'{param}'", 1)
+        return template
+
+
+def make_notes(count):
+    return [
+        NoteRecord(f"note-{index}", f"<p>Note {index}</p>", "2024-01-01T00:00:00Z", "2024-01-02T00:00:00Z",
+                   "patient", "account", local_patient_id=1, external_patient_id="patient")
+        for index in range(count)
+    ]
+
+
+def test_failed_write_keeps_buffered_text(tmp_path):
+    path = str(tmp_path / "missing" / "output.sql")
+
+    async def write():
+        writer = SQLWriter(path)
+        await writer.write("first\n")
+        await writer.write("second\n")
+        # The directory doesn't exist, so opening the output fails
+        with pytest.raises(OSError):
+            await writer.flush()
+        os.makedirs(os.path.dirname(path))
+        await writer.write("third\n")
+        await writer.close()
+
+    asyncio.run(write())
+    with open(path) as f:
+        text = f.read()
+    assert text.count("-- Adracare Encounter Notes SQL Import") == 1
+    assert text.endswith("first\nsecond\nthird\n")
+
+
+def test_failed_write_records_no_notes(tmp_path):
+    path = str(tmp_path / "missing" / "output.sql")
+    ledger = NoteLedger(str(tmp_path / "processed_notes.db"), capacity=1000)
+    ledger.open()
+    run = {"run_id": ledger.start_run(["patient"], path), "output_offset": 0}
+    patient = {"patient_id": "patient", "notes_data": make_notes(5), "notes_found": 5}
+
+    async def emit():
+        writer = SQLWriter(path)
+        with pytest.raises(OSError):
+            await emit_patient_async(LocalDatabase(), patient, 7, ledger, run, writer)
+        # The notes still get written when the output can be opened, past the checkpoint
+        os.makedirs(os.path.dirname(path))
+        await writer.close()
+
+    asyncio.run(emit())
+    ledger.close()
+
+    ledger = NoteLedger(str(tmp_path / "processed_notes.db"), capacity=1000)
+    ledger.open()
+    try:
+        assert not any(f"note-{index}" in ledger for index in range(5))
+        assert ledger.get_incomplete_run()["output_offset"] == 0
+        assert os.path.getsize(path) > 0
+    finally:
+        ledger.close()
+
+
+def test_written_notes_are_recorded(tmp_path):
+    path = str(tmp_path / "output.sql")
+    ledger = NoteLedger(str(tmp_path / "processed_notes.db"), capacity=1000)
+    ledger.open()
+    run = {"run_id": ledger.start_run(["patient"], path), "output_offset": 0}
+    patient = {"patient_id": "patient", "notes_data": make_notes(5), "notes_found": 5}
+
+    async def emit():
+        writer = SQLWriter(path)
+        try:
+            return await emit_patient_async(LocalDatabase(), patient, 7, ledger, run, writer)
+        finally:
+            await writer.close()
+
+    assert len(asyncio.run(emit())) == 5
+    ledger.close()
+
+    ledger = NoteLedger(str(tmp_path / "processed_notes.db"), capacity=1000)
+    ledger.open()
+    try:
+        assert all(f"note-{index}" in ledger for index in range(5))
+        assert ledger.get_incomplete_run()["output_offset"] == os.path.getsize(path)
+    finally:
+        ledger.close()
+
+
+def read_segments(path):
+    texts = []
+    for segment in output_segments(path):
+        with open(segment) as f:
+            texts.append(f.read())
+    return texts
+
+
+def test_writes_are_coalesced(tmp_path):
+    path = str(tmp_path / "output.sql")
+
+    async def write():
+        writer = SQLWriter(path, buffer_size=100, flush_interval=3600, fsync="never")
+        for index in range(50):
+            await writer.write(f"statement {index:02d};\n")
+        # Every 8 statements of 14 characters fill the 100-character buffer
+        assert writer.flushes == 6
+        await writer.close()
+        await writer.close()
+        return writer.stats()
+
+    stats = asyncio.run(write())
+    assert stats["flushes"] == 7 and stats["fsyncs"] == 0
+    assert stats["uncompressed_bytes"] == stats["bytes"] == os.path.getsize(path)
+    assert stats["segments"] == 1 and stats["compression"] is None
+    text = read_segments(path)[0]
+    assert text.startswith("-- Adracare Encounter Notes SQL Import\n")
+    assert text.endswith("".join(f"statement {index:02d};\n" for index in range(50)))
+
+
+def test_old_buffer_is_flushed(tmp_path):
+    async def write():
+        writer = SQLWriter(str(tmp_path / "output.sql"), flush_interval=0.05)
+        await writer.write("first;\n")
+        assert writer.flushes == 0
+        await asyncio.sleep(0.06)
+        await writer.write("second;\n")
+        assert writer.flushes == 1
+        await writer.close()
+
+    asyncio.run(write())
+
+
+@pytest.mark.parametrize("policy, interval, fsyncs",
+                         [("checkpoint", 3600, 3), ("interval", 0, 3), ("interval", 3600, 0), ("never", 0, 0)])
+def test_fsync_policies(tmp_path, policy, interval, fsyncs):
+    async def write():
+        writer = SQLWriter(str(tmp_path / "output.sql"), fsync=policy, fsync_interval=interval)
+        for index in range(3):
+            await writer.write(f"statement {index};\n")
+            await writer.checkpoint()
+        await writer.close()
+        return writer.stats()["fsyncs"]
+
+    assert asyncio.run(write()) == fsyncs
+
+
+def test_unknown_fsync_policy():
+    with pytest.raises(ValueError):
+        SQLWriter("output.sql", fsync="always")
+
+
+def test_segments_rotate_only_at_checkpoints(tmp_path):
+    path = str(tmp_path / "output.sql")
+
+    async def write():
+        writer = SQLWriter(path, buffer_size=10, segment_size=150, fsync="never")
+        offsets = []
+        for patient in range(4):
+            for index in range(5):
+                await writer.write(f"patient {patient} note {index};\n")
+            offsets.append(await writer.checkpoint())
+        await writer.close()
+        return offsets, writer.stats()
+
+    offsets, stats = asyncio.run(write())
+    assert segment_path(path, 2) == str(tmp_path / "output.part002.sql")
+    texts = read_segments(path)
+    assert len(texts) == stats["segments"] == 4
+    # Each patient's notes stay in one segment, which carries its own header
+    for patient, text in enumerate(texts):
+        header = "-- Adracare Encounter Notes SQL Import" + (f" (segment {patient + 1})" if patient else "")
+        assert text.startswith(header + "\n")
+        assert text.count(f"patient {patient} note") == 5 and "note" not in text.replace(f"patient {patient} note", "")
+    assert offsets[-1] == stats["bytes"] == sum(map(len, texts))
+
+
+def test_new_output_replaces_previous_segments(tmp_path):
+    path = str(tmp_path / "output.sql")
+
+    async def write(segment_size, patients):
+        writer = SQLWriter(path, segment_size=segment_size, fsync="never")
+        for patient in range(patients):
+            await writer.write(f"patient {patient};\n")
+            await writer.checkpoint()
+        await writer.close()
+
+    asyncio.run(write(1, 3))
+    assert len(output_segments(path)) == 3
+    asyncio.run(write(0, 2))
+    assert output_segments(path) == [path]
+    assert read_segments(path)[0].endswith("patient 0;\npatient 1;\n")
@@ -0,0 +1,50 @@
+"""
+The benchmark suite: running the micro benchmarks and flagging regressions against a baseline.
+"""
+import json
+import argparse
+from benchmarks import suite
+
+
+def report(**metrics):
+    return {"metrics": {name: suite._metric(value, unit, higher) for name, (value, unit, higher) in metrics.items()}}
+
+
+def test_compare_flags_regressions_in_either_direction():
+    baseline = report(notes_per_second=(100, "notes/s", True), html_us_per_note=(50, "us/note", False),
+                      rows_per_second=(10, "rows/s", True), sql_us_per_note=(20, "us/note", False),
+                      pipeline_patients_per_second=(3, "patients/s", True))
+    current = report(notes_per_second=(80, "notes/s", True), html_us_per_note=(60, "us/note", False),
+                     rows_per_second=(12, "rows/s", True), sql_us_per_note=(21, "us/note", False))
+    table, regressions = suite.compare(baseline, current, 0.1)
+    assert regressions == ["notes_per_second", "html_us_per_note"]
+    lines = table.splitlines()
+    assert lines[1].endswith("REGRESSION") and "-20.0%" in lines[1]
+    assert lines[2].endswith("REGRESSION") and "+20.0%" in lines[2]
+    assert lines[3].endswith("improved")
+    assert lines[4].endswith("us/note")
+    assert lines[5].endswith("(not measured)")
+
+
+def test_zero_baseline_is_not_a_regression():
+    _, regressions = suite.compare(report(failures=(0, "count", False)), report(failures=(5, "count", False)), 0.1)
+    assert regressions == []
+
+
+def test_load_report_by_path_or_name(tmp_path, monkeypatch):
+    path = tmp_path / "main.json"
+    path.write_text(json.dumps(report(rows_per_second=(10, "rows/s", True))))
+    monkeypatch.setattr(suite, "BASELINE_DIR", str(tmp_path))
+    assert suite._load_report("main") == suite._load_report(str(path))
+
+
+def test_run_micro_benchmarks_and_skip_the_database_ones():
+    args = argparse.Namespace(only="html_extraction,split_sql_statements,format_sql", notes=50, scale=0.01,
+                              mean_notes=5, repeat=1, seed=1, latency="fixed:0", no_db=True)
+    result = suite.run(args)
+    assert sorted(result["metrics"]) == ["html_extraction_us_per_note", "split_sql_statements_us_per_note"]
+    assert all(metric["value"] > 0 and not metric["higher_is_better"] for metric in result["metrics"].values())
+    assert result["skipped"] == {"format_sql": "--no-db"}
+    assert result["parameters"]["notes"] == 50
+    # A report compares cleanly with itself
+    assert suite.compare(result, result, 0.0)[1] == []
@@ -0,0 +1,67 @@
+"""
+Stage timings and their log-linear latency histograms.
+"""
+import random
+import pytest
+from utils.timing import LatencyHistogram, StageTimings, configure_stage_timings, get_stage_timings, timed
+
+
+def test_small_values_are_exact():
+    histogram = LatencyHistogram()
+    for value in range(128):
+        histogram.record(value)
+    assert [histogram.percentile(percent) for percent in (1, 50, 100)] == [1, 63, 127]
+    assert histogram.min == 0 and histogram.max == 127 and histogram.count == 128
+
+
+@pytest.mark.parametrize("percent", [50, 90, 99, 99.9])
+def test_percentiles_within_the_relative_error(percent):
+    rng = random.Random(7)
+    values = sorted(int(rng.lognormvariate(15, 1.5)) for _ in range(20000))
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    exact = values[int(-(-len(values) * percent // 100)) - 1]
+    assert abs(histogram.percentile(percent) - exact) <= exact * 2 ** (1 - histogram.sub_bucket_bits)
+
+
+def test_percentiles_stay_within_the_recorded_range():
+    histogram = LatencyHistogram()
+    histogram.record(1000003)
+    assert histogram.percentile(0) == histogram.percentile(100) == 1000003
+    assert LatencyHistogram().percentile(50) == 0
+    histogram.record(-5)
+    assert histogram.min == 0
+
+
+def test_buckets_stay_few():
+    histogram = LatencyHistogram()
+    for value in range(0, 10**9, 9973):
+        histogram.record(value)
+    assert len(histogram.buckets) < 128 * 30
+
+
+def test_stage_summary():
+    timings = StageTimings()
+    for milliseconds in (1, 2, 3, 4, 100):
+        timings.record("fetch_page", milliseconds / 1000)
+    timings.count("notes_parsed", 40)
+    timings.count("notes_parsed", 2)
+    summary = timings.summary()
+    stage = summary["stages"]["fetch_page"]
+    assert stage["count"] == 5
+    assert stage["total_s"] == pytest.approx(0.11, abs=0.001)
+    assert stage["p50_ms"] == pytest.approx(3, rel=0.02)
+    assert stage["max_ms"] == pytest.approx(100, rel=0.02)
+    assert summary["counters"] == {"notes_parsed": 42}
+    table = timings.format_summary().splitlines()
+    assert table[1].startswith("fetch_page") and table[2].startswith("notes_parsed")
+
+
+def test_shared_timings_are_replaced_per_run():
+    first = configure_stage_timings()
+    with timed("sql_render"):
+        pass
+    assert get_stage_timings() is first and first.summary()["stages"]["sql_render"]["count"] == 1
+    second = configure_stage_timings()
+    assert get_stage_timings() is second and second.summary()["stages"] == {}
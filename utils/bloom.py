@@ -0,0 +1,114 @@
+"""
+Memory-mapped Bloom filter used as a compact pre-filter for note membership.
+"""
+import os
+import math
+import mmap
+import struct
+import hashlib
+
+
+class BloomFilter:
+    """
+    Bloom filter persisted to a single file and accessed through mmap.
+
+    Opening an existing filter only maps the file, so start-up cost does not
+    grow with the number of keys. A negative answer is definitive; a positive
+    answer must be confirmed against the authoritative store.
+    """
+
+    MAGIC = b"ADRBLM01"
+    # magic, number of bits, number of hash functions, capacity, keys added, source watermark
+    HEADER = struct.Struct("<8sQQQQQ")
+
+    def __init__(self, path, capacity=2000000, error_rate=0.001):
+        """
+        Open the filter at path, creating it if it does not exist.
+
+        Args:
+            path (str): Location of the filter file
+            capacity (int): Expected number of keys (only used when creating)
+            error_rate (float): Target false positive rate at capacity (only used when creating)
+        """
+        self.path = path
+        self.created = not os.path.exists(path)
+
+        if self.created:
+            num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+            num_bits = (num_bits + 7) // 8 * 8
+            num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+            with open(path, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, num_bits, num_hashes, capacity, 0, 0))
+                f.truncate(self.HEADER.size + num_bits // 8)
+
+        self._mmap = None
+        self._file = open(path, "r+b")
+        try:
+            # A damaged file raises ValueError, so callers can rebuild it
+            size = os.fstat(self._file.fileno()).st_size
+            if size < self.HEADER.size:
+                raise ValueError(f"{path} is too short for a Bloom filter header")
+            self._mmap = mmap.mmap(self._file.fileno(), 0)
+
+            header = self.HEADER.unpack_from(self._mmap, 0)
+            if header[0] != self.MAGIC:
+                raise ValueError(f"{path} is not a Bloom filter file")
+            _, self.num_bits, self.num_hashes, self.capacity, self.count, self.watermark = header
+            if not self.num_bits or not self.num_hashes or size < self.HEADER.size + (self.num_bits + 7) // 8:
+                raise ValueError(f"{path} is truncated: {size} bytes for a filter of {self.num_bits} bits")
+        except BaseException:
+            self.close()
+            raise
+
+    def _positions(self, key):
+        """Yield the bit positions for key using double hashing."""
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key):
+        """
+        Add a key to the filter.
+
+        Args:
+            key (str): Key to add
+        """
+        offset = self.HEADER.size
+        buf = self._mmap
+        for pos in self._positions(key):
+            index = offset + (pos >> 3)
+            buf[index] = buf[index] | (1 << (pos & 7))
+        self.count += 1
+
+    def __contains__(self, key):
+        offset = self.HEADER.size
+        buf = self._mmap
+        for pos in self._positions(key):
+            if not buf[offset + (pos >> 3)] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def flush(self, watermark=None):
+        """
+        Write the header back and flush dirty pages to disk.
+
+        Args:
+            watermark (int): Position in the authoritative store covered by the filter
+        """
+        if watermark is not None:
+            self.watermark = watermark
+        self.HEADER.pack_into(
+            self._mmap, 0, self.MAGIC, self.num_bits, self.num_hashes, self.capacity, self.count, self.watermark
+        )
+        self._mmap.flush()
+
+    def close(self):
+        """Unmap and close the filter file."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,220 @@
+"""
+Leveled, non-blocking logging for the import.
+
+Records are put on an in-memory queue by a QueueHandler and written to the
+console (or a file) by a listener thread, so a log call in the event loop
+never waits for terminal I/O. Repetitive messages are rate limited per
+message template: after `burst` records in `interval` seconds the rest are
+counted and the count is reported with the next record that gets through.
+Output is plain text or one JSON object per line for machine ingestion.
+On a terminal, a status line (see utils.progress) is kept below the log lines.
+
+Log calls should pass values as arguments ("Found %d notes", count) rather
+than formatting them in, so the template identifies similar messages.
+"""
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = "%(asctime)s %(levelname)-7s %(message)s"
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let at most `burst` records of each message template through per interval.
+    """
+
+    def __init__(self, burst=20, interval=10.0):
+        """
+        Initialize the filter.
+
+        Args:
+            burst (int): Records of one template let through per interval; 0 disables limiting
+            interval (float): Length of the window in seconds
+        """
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.burst:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window and window[2]:
+                    # Report what the previous window held back
+                    record.suppressed = window[2]
+                self.windows[key] = [now, 1, 0]
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+    def pending(self):
+        """
+        Return the messages held back in the current windows.
+
+        Returns:
+            dict: Message template to number of records suppressed
+        """
+        with self._lock:
+            return {key[2]: window[2] for key, window in self.windows.items() if window[2]}
+
+
+class TextFormatter(logging.Formatter):
+    """Plain text lines, noting how many similar messages were suppressed."""
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" ({suppressed} similar messages suppressed)"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class ConsoleHandler(logging.StreamHandler):
+    """Console output that keeps a status line below the log lines."""
+
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self.status = ""
+
+    def emit(self, record):
+        # Called with the handler lock held
+        if self.status:
+            self.stream.write("\r\x1b[K")
+        super().emit(record)
+        if self.status:
+            self.stream.write(self.status)
+            self.flush()
+
+    def set_status(self, text, final=False):
+        """
+        Replace the status line.
+
+        Args:
+            text (str): New status line
+            final (bool): Keep the line as ordinary output and stop redrawing it
+        """
+        with self.lock:
+            self.stream.write("\r\x1b[K" + text + ("\n" if final else ""))
+            self.status = "" if final else text
+            self.flush()
+
+
+_listener = None
+_rate_limit = None
+_target = None
+
+
+def configure_logging(level="INFO", fmt="text", file="", burst=20, interval=10.0):
+    """
+    Send all logging through a queue to the console or a file.
+
+    Calling it again replaces the previous configuration.
+
+    Args:
+        level (str): Lowest level written, e.g. "DEBUG" or "WARNING"
+        fmt (str): "text" or "json"
+        file (str): File to append to; empty writes to standard output
+        burst (int): Records of one message template let through per interval; 0 disables limiting
+        interval (float): Rate limiting window in seconds
+    """
+    global _listener, _rate_limit, _target
+    shutdown_logging()
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+        if existing is _target:
+            existing.close()
+
+    _target = logging.FileHandler(file, encoding="utf-8") if file else ConsoleHandler(sys.stdout)
+    _target.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+
+    _rate_limit = RateLimitFilter(burst, interval)
+    handler = QueueHandler(queue.SimpleQueue())
+    handler.addFilter(_rate_limit)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    _listener = QueueListener(handler.queue, _target)
+    _listener.start()
+
+
+def shutdown_logging():
+    """
+    Report suppressed messages and write out everything queued.
+
+    Logging keeps going to the same destination afterwards, written directly
+    instead of through the queue.
+    """
+    global _listener
+    if _listener is None:
+        return
+    pending = _rate_limit.pending()
+    if pending:
+        logger = logging.getLogger(__name__)
+        _rate_limit.burst = 0
+        for template, suppressed in pending.items():
+            logger.info("%d more messages like %r were suppressed", suppressed, template)
+    _listener.stop()
+    _listener = None
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        if isinstance(existing, QueueHandler):
+            root.removeHandler(existing)
+    root.addHandler(_target)
+
+
+def status_stream():
+    """Return the stream a status line is shown on: the log console, else stderr."""
+    return _target.stream if isinstance(_target, ConsoleHandler) else sys.stderr
+
+
+def show_status(text, final=False):
+    """
+    Show a status line below the console log output.
+
+    Args:
+        text (str): Status line
+        final (bool): Leave the line in place as ordinary output
+    """
+    if isinstance(_target, ConsoleHandler):
+        _target.set_status(text, final)
+    else:
+        sys.stderr.write("\r\x1b[K" + text + ("\n" if final else ""))
+        sys.stderr.flush()
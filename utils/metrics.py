@@ -0,0 +1,234 @@
+"""
+Live metrics in the Prometheus text exposition format.
+
+Migrations and loads run unattended, so their progress is published while
+they run: counters (patients, notes, responses by status, retries, failures
+by class, rows), gauges (in-flight requests, queue depths, throughput,
+timestamp of the last progress) and the per-stage latency histograms of
+utils.timing rendered as summaries. The text can be scraped from a small
+HTTP endpoint on a local port, or written periodically to a file for the
+node_exporter textfile collector. Nothing is exported unless configured.
+"""
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+QUANTILES = (50, 90, 99)
+
+
+def _escape(value):
+    """Escape a label value for the exposition format."""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(labels):
+    """Render a sorted tuple of label pairs."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """
+    Counters and gauges with labels, plus an optional StageTimings source.
+    """
+
+    def __init__(self, namespace="adracare"):
+        """
+        Initialize an empty registry.
+
+        Args:
+            namespace (str): Prefix of every metric name
+        """
+        self.namespace = namespace
+        self.timings = None
+        self._types = {}
+        self._help = {}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, metric_type, help_text):
+        """
+        Declare a metric so it is exported with its type and help text.
+
+        Args:
+            name (str): Metric name without the namespace
+            metric_type (str): "counter" or "gauge"
+            help_text (str): Description shown in the exposition
+        """
+        self._types[name] = metric_type
+        self._help[name] = help_text
+
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter (or gauge)."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def in_progress(self, name, **labels):
+        """Raise a gauge by one for the duration of the enclosed block."""
+        self.inc(name, 1, **labels)
+        try:
+            yield
+        finally:
+            self.inc(name, -1, **labels)
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+
+        Returns:
+            str: The exposition text
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = []
+        described = set()
+        for (name, labels), value in values:
+            full_name = f"{self.namespace}_{name}"
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {full_name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {full_name} {self._types.get(name, 'gauge')}")
+            lines.append(f"{full_name}{_labels(labels)} {value}")
+
+        if self.timings is not None:
+            summary = self.timings.summary()["stages"]
+            if summary:
+                full_name = f"{self.namespace}_stage_duration_seconds"
+                lines.append(f"# HELP {full_name} Time spent per stage")
+                lines.append(f"# TYPE {full_name} summary")
+                for stage, stats in sorted(summary.items()):
+                    for quantile in QUANTILES:
+                        labels = (("stage", stage), ("quantile", str(quantile / 100)))
+                        lines.append(f"{full_name}{_labels(labels)} {round(stats[f'p{quantile}_ms'] / 1000, 9)}")
+                    lines.append(f"{full_name}_sum{_labels((('stage', stage),))} {stats['total_s']}")
+                    lines.append(f"{full_name}_count{_labels((('stage', stage),))} {stats['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """
+    Publish a registry over HTTP, to a textfile, or both, from background threads.
+    """
+
+    def __init__(self, registry, port=0, textfile="", interval=15, host="127.0.0.1"):
+        """
+        Initialize the exporter.
+
+        Args:
+            registry (MetricsRegistry): Metrics to publish
+            port (int): Local port serving /metrics; 0 disables the endpoint
+            textfile (str): File rewritten every interval seconds; empty disables it
+            interval (float): Seconds between textfile updates
+            host (str): Address the endpoint listens on
+        """
+        self.registry = registry
+        self.port = port
+        self.textfile = textfile
+        self.interval = interval
+        self.host = host
+        self._server = None
+        self._stop = threading.Event()
+        self._writer = None
+
+    def start(self):
+        """Start the endpoint and the textfile writer that are configured."""
+        if self.port:
+            registry = self.registry
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = registry.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", CONTENT_TYPE)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    # Scrapes would otherwise be logged to stderr
+                    pass
+
+            try:
+                self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+            except OSError as e:
+                logger.warning("Metrics endpoint disabled: cannot listen on %s:%s (%s)", self.host, self.port, e)
+            else:
+                self._server.daemon_threads = True
+                threading.Thread(target=self._server.serve_forever, daemon=True).start()
+                logger.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+        if self.textfile:
+            self._writer = threading.Thread(target=self._write_periodically, daemon=True)
+            self._writer.start()
+
+    def write_textfile(self):
+        """Rewrite the textfile atomically so collectors never read half a file."""
+        temp_path = f"{self.textfile}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.registry.render())
+        os.replace(temp_path, self.textfile)
+
+    def _write_periodically(self):
+        while not self._stop.is_set():
+            try:
+                self.write_textfile()
+            except OSError as e:
+                logger.warning("Failed to write metrics to %s: %s", self.textfile, e)
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        """Stop exporting, writing the textfile one last time."""
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join()
+            self.write_textfile()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+_metrics = MetricsRegistry()
+
+
+def configure_metrics(namespace="adracare", descriptions=None, port=0, textfile="", interval=15):
+    """
+    Replace the shared registry and start exporting it if configured.
+
+    Args:
+        namespace (str): Prefix of every metric name
+        descriptions (dict): Metric name to (type, help text) for MetricsRegistry.describe
+        port (int): Local port serving /metrics; 0 disables the endpoint
+        textfile (str): File rewritten every interval seconds; empty disables it
+        interval (float): Seconds between textfile updates
+
+    Returns:
+        tuple: (MetricsRegistry, MetricsExporter or None if nothing is exported)
+    """
+    global _metrics
+    _metrics = MetricsRegistry(namespace)
+    for name, (metric_type, help_text) in (descriptions or {}).items():
+        _metrics.describe(name, metric_type, help_text)
+    exporter = None
+    if port or textfile:
+        exporter = MetricsExporter(_metrics, port, textfile, interval)
+        exporter.start()
+    return _metrics, exporter
+
+
+def get_metrics():
+    """Return the shared metrics registry."""
+    return _metrics
@@ -0,0 +1,358 @@
+"""
+Built-in profiling for slow runs.
+
+A Profiler captures a cProfile CPU profile of the calling thread, memory
+snapshots from tracemalloc at stage boundaries and, optionally, a sampling
+profile of the event loop: at a fixed interval a background thread records
+what the loop thread is running and, for every pending task, the chain of
+coroutines it is suspended in and what the innermost one awaits. Everything
+is written as plain artefacts in one directory (pstats file, sorted text
+tables, folded stacks for flame graphs, JSON memory report), so two runs can
+be compared with `python -m utils.profiling diff DIR_A DIR_B`.
+"""
+import os
+import sys
+import json
+import time
+import pstats
+import asyncio
+import cProfile
+import argparse
+import threading
+import tracemalloc
+from datetime import datetime
+
+TOP_LINES = 25
+
+
+def _frame_name(code):
+    """Name a code object as function (file:line) for stable aggregation."""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _awaiting(task):
+    """
+    Describe where a pending task is suspended.
+
+    Returns:
+        list: Coroutine names from the task's outermost coroutine inwards,
+        ending with what the innermost one awaits
+    """
+    chain = []
+    awaitable = task.get_coro()
+    while awaitable is not None:
+        code = getattr(awaitable, "cr_code", None) or getattr(awaitable, "gi_code", None)
+        if code is None:
+            break
+        chain.append(_frame_name(code))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    waiter = getattr(task, "_fut_waiter", None)
+    if isinstance(waiter, asyncio.Task):
+        coro = waiter.get_coro()
+        chain.append(f"<task {getattr(coro, '__qualname__', type(coro).__name__)}>")
+    elif waiter is not None:
+        chain.append(f"<{type(waiter).__name__}>")
+    else:
+        chain.append("<ready>")
+    return chain
+
+
+class Profiler:
+    """
+    CPU, event-loop and memory profile of one run, written to a directory.
+    """
+
+    def __init__(self, directory, label="run", loop_sampling=False, sample_interval=0.01, memory_frames=1):
+        """
+        Initialize the profiler.
+
+        Args:
+            directory (str): Directory the artefacts are written to
+            label (str): Name of what is profiled, recorded in profile.json
+            loop_sampling (bool): Sample the event loop and its tasks
+            sample_interval (float): Seconds between samples
+            memory_frames (int): Stack frames tracemalloc keeps per allocation; the
+                report groups by the innermost one, more only cost time
+        """
+        self.directory = directory
+        self.label = label
+        self.loop_sampling = loop_sampling
+        self.sample_interval = sample_interval
+        self.memory_frames = memory_frames
+        self.cpu = cProfile.Profile()
+        self.running = {}
+        self.awaiting = {}
+        self.samples = 0
+        self.stages = []
+        self._previous_snapshot = None
+        self._loop = None
+        self._thread_id = None
+        self._sampler = None
+        self._stop = threading.Event()
+        self._started = None
+        self._profiling = False
+
+    def start(self):
+        """Start profiling the calling thread."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._started = time.perf_counter()
+        self._thread_id = threading.get_ident()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.memory_frames)
+        self.mark("start")
+        if self.loop_sampling:
+            try:
+                self._loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._loop = None
+            self._sampler = threading.Thread(target=self._sample_periodically, daemon=True)
+            self._sampler.start()
+        self._profiling = True
+        self.cpu.enable()
+        return self
+
+    def mark(self, stage):
+        """
+        Take a memory snapshot at a stage boundary.
+
+        Args:
+            stage (str): Name of the stage that starts or ends here
+        """
+        if not tracemalloc.is_tracing():
+            return
+        # Keep the snapshot itself out of the CPU profile
+        self.cpu.disable()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        entry = {
+            "stage": stage,
+            "seconds": round(time.perf_counter() - self._started, 3),
+            "current_bytes": current,
+            "peak_bytes": peak,
+            "top": [
+                {"where": str(stat.traceback[0]), "bytes": stat.size, "blocks": stat.count}
+                for stat in snapshot.statistics("lineno")[:TOP_LINES]
+            ]
+        }
+        if self._previous_snapshot is not None:
+            entry["growth"] = [
+                {"where": str(stat.traceback[0]), "bytes": stat.size_diff, "blocks": stat.count_diff}
+                for stat in snapshot.compare_to(self._previous_snapshot, "lineno")[:TOP_LINES]
+                if stat.size_diff
+            ]
+        self._previous_snapshot = snapshot
+        self.stages.append(entry)
+        if self._profiling:
+            self.cpu.enable()
+
+    def _sample(self):
+        """Record one sample of the loop thread's stack and the pending tasks."""
+        frame = sys._current_frames().get(self._thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+        if stack:
+            key = ";".join(reversed(stack))
+            self.running[key] = self.running.get(key, 0) + 1
+        if self._loop is not None:
+            for task in asyncio.all_tasks(self._loop):
+                key = ";".join(_awaiting(task))
+                self.awaiting[key] = self.awaiting.get(key, 0) + 1
+        self.samples += 1
+
+    def _sample_periodically(self):
+        while not self._stop.wait(self.sample_interval):
+            try:
+                self._sample()
+            except RuntimeError:
+                # Tasks or frames changed while being read; skip this sample
+                pass
+
+    def stop(self):
+        """
+        Stop profiling and write the artefacts.
+
+        Returns:
+            str: The directory holding them
+        """
+        self._profiling = False
+        self.cpu.disable()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.mark("end")
+        tracemalloc.stop()
+        elapsed = time.perf_counter() - self._started
+
+        self.cpu.dump_stats(os.path.join(self.directory, "cpu.prof"))
+        with open(os.path.join(self.directory, "cpu.txt"), "w") as f:
+            stats = pstats.Stats(self.cpu, stream=f).strip_dirs()
+            f.write("Sorted by cumulative time\n")
+            stats.sort_stats("cumulative").print_stats(40)
+            f.write("Sorted by own time\n")
+            stats.sort_stats("tottime").print_stats(40)
+
+        files = ["cpu.prof", "cpu.txt", "memory.json"]
+        if self.loop_sampling:
+            for name, samples in (("loop_running", self.running), ("loop_awaiting", self.awaiting)):
+                with open(os.path.join(self.directory, f"{name}.folded"), "w") as f:
+                    for key, count in sorted(samples.items(), key=lambda item: -item[1]):
+                        f.write(f"{key} {count}\n")
+                files.append(f"{name}.folded")
+            with open(os.path.join(self.directory, "loop.txt"), "w") as f:
+                f.write(self._format_loop_summary())
+            files.append("loop.txt")
+
+        with open(os.path.join(self.directory, "memory.json"), "w") as f:
+            json.dump(self.stages, f, indent=2)
+        with open(os.path.join(self.directory, "profile.json"), "w") as f:
+            json.dump({
+                "label": self.label,
+                "finished_at": datetime.now().isoformat(),
+                "elapsed_seconds": round(elapsed, 3),
+                "loop_samples": self.samples,
+                "sample_interval": self.sample_interval,
+                "peak_bytes": max((stage["peak_bytes"] for stage in self.stages), default=0),
+                "stages": [{key: stage[key] for key in ("stage", "seconds", "current_bytes", "peak_bytes")}
+                           for stage in self.stages],
+                "files": files
+            }, f, indent=2)
+        return self.directory
+
+    def _format_loop_summary(self):
+        """Render the most frequent loop and task samples as text."""
+        lines = [f"{self.samples} samples every {self.sample_interval * 1000:.0f} ms", "",
+                 "Loop thread running (innermost frame):"]
+        innermost = {}
+        for key, count in self.running.items():
+            frame = key.rsplit(";", 1)[-1]
+            innermost[frame] = innermost.get(frame, 0) + count
+        for frame, count in sorted(innermost.items(), key=lambda item: -item[1])[:TOP_LINES]:
+            lines.append(f"{100.0 * count / max(1, self.samples):7.1f}%  {frame}")
+        lines += ["", "Tasks suspended (task-samples, coroutine awaiting what):"]
+        suspended = {}
+        for key, count in self.awaiting.items():
+            parts = key.split(";")
+            where = " -> ".join(parts[-2:]) if len(parts) > 1 else parts[0]
+            suspended[where] = suspended.get(where, 0) + count
+        for where, count in sorted(suspended.items(), key=lambda item: -item[1])[:TOP_LINES]:
+            lines.append(f"{count:9}  {where}")
+        return "\n".join(lines) + "\n"
+
+
+_profiler = None
+
+
+def configure_profiler(directory, label="run", loop_sampling=False, **options):
+    """
+    Start the shared profiler.
+
+    Args:
+        directory (str): Directory the artefacts are written to
+        label (str): Name of what is profiled
+        loop_sampling (bool): Also sample the running event loop and its tasks
+        **options: sample_interval and memory_frames for Profiler
+
+    Returns:
+        Profiler: The started profiler
+    """
+    global _profiler
+    _profiler = Profiler(directory, label, loop_sampling, **options).start()
+    return _profiler
+
+
+def mark_stage(stage):
+    """Take a memory snapshot with the shared profiler, if one is running."""
+    if _profiler is not None:
+        _profiler.mark(stage)
+
+
+def stop_profiler():
+    """
+    Stop the shared profiler and write its artefacts.
+
+    Returns:
+        str or None: Directory of the artefacts, None if nothing was profiled
+    """
+    global _profiler
+    if _profiler is None:
+        return None
+    directory = _profiler.stop()
+    _profiler = None
+    return directory
+
+
+def profile_directory(report_path, stamp=None):
+    """
+    Return a directory for profile artefacts next to a run report.
+
+    Args:
+        report_path (str): Path of the run report, e.g. results.json
+        stamp (str): Suffix identifying the run; defaults to the current time
+
+    Returns:
+        str: e.g. profile_results_20250101120000 in the report's directory
+    """
+    stamp = stamp or datetime.now().strftime("%Y%m%d%H%M%S")
+    directory, name = os.path.split(report_path)
+    return os.path.join(directory, f"profile_{os.path.splitext(name)[0]}_{stamp}")
+
+
+def diff_profiles(before, after, limit=30):
+    """
+    Compare the artefacts of two profiled runs.
+
+    Args:
+        before (str): Directory of the baseline profile
+        after (str): Directory of the profile to compare
+        limit (int): Number of functions listed
+
+    Returns:
+        str: Table of the functions whose cumulative and own time changed most,
+        followed by the peak memory per stage
+    """
+    def load(directory):
+        stats = pstats.Stats(os.path.join(directory, "cpu.prof")).stats
+        return {
+            f"{func[2]} ({os.path.basename(func[0])}:{func[1]})": (calls, tottime, cumtime)
+            for func, (_, calls, tottime, cumtime, _) in stats.items()
+        }
+
+    old, new = load(before), load(after)
+    rows = []
+    for name in set(old) | set(new):
+        old_calls, old_own, old_cum = old.get(name, (0, 0.0, 0.0))
+        new_calls, new_own, new_cum = new.get(name, (0, 0.0, 0.0))
+        rows.append((new_cum - old_cum, new_own - old_own, old_cum, new_cum, old_calls, new_calls, name))
+    rows.sort(key=lambda row: -abs(row[0]))
+
+    lines = [f"{'Cum before':>11}{'Cum after':>11}{'Change':>10}{'Own change':>12}{'Calls before':>14}"
+             f"{'Calls after':>13}  Function"]
+    for change, own_change, old_cum, new_cum, old_calls, new_calls, name in rows[:limit]:
+        lines.append(f"{old_cum:>11.3f}{new_cum:>11.3f}{change:>+10.3f}{own_change:>+12.3f}"
+                     f"{old_calls:>14}{new_calls:>13}  {name}")
+
+    memory = []
+    for directory in (before, after):
+        with open(os.path.join(directory, "profile.json")) as f:
+            memory.append({stage["stage"]: stage["peak_bytes"] for stage in json.load(f)["stages"]})
+    lines += ["", f"{'Stage':<24}{'Peak MiB before':>16}{'Peak MiB after':>16}"]
+    for stage in list(memory[0]) + [stage for stage in memory[1] if stage not in memory[0]]:
+        values = [f"{m[stage] / 2**20:>16.1f}" if stage in m else f"{'-':>16}" for m in memory]
+        lines.append(f"{stage:<24}{values[0]}{values[1]}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two profiles written with --profile")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    diff = subcommands.add_parser("diff", help="show the largest changes between two profile directories")
+    diff.add_argument("before")
+    diff.add_argument("after")
+    diff.add_argument("--limit", type=int, default=30, help="number of functions listed")
+    args = parser.parse_args()
+    print(diff_profiles(args.before, args.after, args.limit))
@@ -0,0 +1,259 @@
+"""
+Progress and ETA reporting for the fetch and load phases.
+
+Work is counted with plain integer additions (patients and notes done,
+failures, retries, ...); a background thread reads the counts at a fixed
+interval, works out a rolling throughput and the ETA, and shows them as a
+status line on a terminal and/or rewrites a JSON status file that
+dashboards can poll. Nothing is formatted or written per item.
+"""
+import os
+import json
+import time
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from utils.log import show_status, status_stream
+
+
+def _format_duration(seconds):
+    """Render seconds as H:MM:SS."""
+    return str(timedelta(seconds=int(seconds)))
+
+
+class ProgressReporter:
+    """
+    Counts of completed work with a periodic status line and status file.
+    """
+
+    def __init__(self, phase, totals=None, interval=2.0, status_file="", tty=False, window=30.0, eta_unit=None):
+        """
+        Initialize the reporter.
+
+        Args:
+            phase (str): Name of the phase shown in the status, e.g. "fetch" or "load"
+            totals (dict): Unit (e.g. "patients", "notes") to its total, in display order
+            interval (float): Seconds between refreshes
+            status_file (str): JSON file rewritten every refresh; empty disables it
+            tty (bool): Show a status line on the terminal
+            window (float): Seconds of recent progress the throughput is measured over
+            eta_unit (str): Unit the ETA is based on; defaults to the first unit
+        """
+        self.phase = phase
+        self.totals = dict(totals or {})
+        self.estimated = set()
+        self.done = {unit: 0 for unit in self.totals}
+        self.events = {}
+        self.interval = interval
+        self.status_file = status_file
+        self.tty = tty
+        self.eta_unit = eta_unit
+        self.started = time.time()
+        self._started_monotonic = time.monotonic()
+        self._samples = deque(maxlen=max(2, int(window / interval) + 1) if interval else 2)
+        self._stop = threading.Event()
+        self._thread = None
+        self._final = None
+
+    def set_total(self, unit, total, estimated=False):
+        """
+        Set the total of a unit.
+
+        Args:
+            unit (str): Unit name
+            total (int): Expected number of items
+            estimated (bool): The total is a prediction and may be exceeded
+        """
+        self.totals[unit] = total
+        self.done.setdefault(unit, 0)
+        if estimated:
+            self.estimated.add(unit)
+        else:
+            self.estimated.discard(unit)
+
+    def advance(self, unit, amount=1):
+        """Count completed items of a unit."""
+        self.done[unit] = self.done.get(unit, 0) + amount
+
+    def event(self, name, amount=1):
+        """Count an occurrence such as a failure or a retry."""
+        self.events[name] = self.events.get(name, 0) + amount
+
+    def _rates(self, now, done):
+        """Return items per second of each unit over the rolling window."""
+        self._samples.append((now, done))
+        then, before = self._samples[0]
+        if now - then <= 0:
+            then, before = self._started_monotonic, {}
+        elapsed = now - then
+        if elapsed <= 0:
+            return {unit: 0.0 for unit in done}
+        return {unit: (count - before.get(unit, 0)) / elapsed for unit, count in done.items()}
+
+    def _eta(self, done, rates):
+        """Return seconds left, judged by the first unit with known remaining work."""
+        units = list(self.totals)
+        if self.eta_unit in units:
+            units.remove(self.eta_unit)
+            units.insert(0, self.eta_unit)
+        for unit in units:
+            total = self.totals[unit]
+            if not total or (unit in self.estimated and done[unit] >= total):
+                # An exceeded estimate says nothing about the work left
+                continue
+            remaining = max(0, total - done[unit])
+            if not remaining:
+                return 0.0
+            return remaining / rates[unit] if rates[unit] > 0 else None
+        return None
+
+    def snapshot(self, state="running"):
+        """
+        Summarize the progress so far.
+
+        Args:
+            state (str): "running", "finished" or "stopped"
+
+        Returns:
+            dict: Phase, state, timestamps, elapsed seconds, per-unit done, total,
+            percent and rate, the event counts and the ETA
+        """
+        now = time.monotonic()
+        done = dict(self.done)
+        rates = self._rates(now, done)
+        eta = self._eta(done, rates) if state == "running" else None
+        units = {}
+        for unit, count in done.items():
+            total = self.totals.get(unit)
+            units[unit] = {
+                "done": count,
+                "total": total,
+                "estimated": unit in self.estimated,
+                "percent": round(min(100.0, 100.0 * count / total), 1) if total else None,
+                "rate_per_second": round(rates[unit], 3)
+            }
+        return {
+            "phase": self.phase,
+            "state": state,
+            "started_at": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "elapsed_seconds": round(now - self._started_monotonic, 1),
+            "units": units,
+            "events": dict(self.events),
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "eta_at": (datetime.now(timezone.utc) + timedelta(seconds=eta)).isoformat() if eta is not None else None
+        }
+
+    def format_line(self, snapshot):
+        """
+        Render a snapshot as one status line.
+
+        Returns:
+            str: e.g. "[fetch] patients 120/1,000 (12.0%) | notes 3,400/~25,000 | 14.2 notes/s | ETA 0:25:12"
+        """
+        parts = []
+        for unit, stats in snapshot["units"].items():
+            if stats["total"]:
+                approx = "~" if stats["estimated"] else ""
+                part = f"{unit} {stats['done']:,}/{approx}{stats['total']:,}"
+                if not stats["estimated"]:
+                    part += f" ({stats['percent']:.1f}%)"
+            else:
+                part = f"{unit} {stats['done']:,}"
+            parts.append(part)
+        rate_unit = self.eta_unit if self.eta_unit in snapshot["units"] else next(iter(snapshot["units"]), None)
+        if rate_unit:
+            parts.append(f"{snapshot['units'][rate_unit]['rate_per_second']:,.1f} {rate_unit}/s")
+        if snapshot["state"] == "finished":
+            parts.append(f"done in {_format_duration(snapshot['elapsed_seconds'])}")
+        elif snapshot["state"] == "stopped":
+            parts.append(f"stopped after {_format_duration(snapshot['elapsed_seconds'])}")
+        elif snapshot["eta_seconds"] is not None:
+            parts.append(f"ETA {_format_duration(snapshot['eta_seconds'])}")
+        else:
+            parts.append("ETA --")
+        for name, count in sorted(snapshot["events"].items()):
+            parts.append(f"{name} {count:,}")
+        return f"[{snapshot['phase']}] " + " | ".join(parts)
+
+    def write_status_file(self, snapshot):
+        """Rewrite the status file atomically so readers never see half a file."""
+        temp_path = f"{self.status_file}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(snapshot, f, indent=2)
+        os.replace(temp_path, self.status_file)
+
+    def refresh(self, state="running"):
+        """Take a snapshot and publish it to the terminal and the status file."""
+        snapshot = self.snapshot(state)
+        if self.tty:
+            show_status(self.format_line(snapshot), final=state != "running")
+        if self.status_file:
+            try:
+                self.write_status_file(snapshot)
+            except OSError:
+                # A dashboard file must not stop the run; the next refresh tries again
+                pass
+        return snapshot
+
+    def _refresh_periodically(self):
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+    def start(self):
+        """Start refreshing in the background if there is anywhere to report to."""
+        if (self.tty or self.status_file) and self._thread is None:
+            self.refresh()
+            self._thread = threading.Thread(target=self._refresh_periodically, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, state="finished"):
+        """
+        Stop refreshing and publish the final state; later calls return it again.
+
+        Args:
+            state (str): "finished", or "stopped" if the phase ended early
+
+        Returns:
+            dict: The final snapshot
+        """
+        if self._final is None:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+            self._final = self.refresh(state)
+        return self._final
+
+
+_progress = ProgressReporter("idle")
+
+
+def configure_progress(phase, totals=None, interval=2.0, status_file="", tty="auto", **options):
+    """
+    Replace the shared reporter and start it.
+
+    Args:
+        phase (str): Name of the phase
+        totals (dict): Unit to total, in display order
+        interval (float): Seconds between refreshes
+        status_file (str): JSON status file; empty disables it
+        tty (str or bool): "auto" shows the status line only on a terminal
+        **options: window and eta_unit for ProgressReporter
+
+    Returns:
+        ProgressReporter: The new shared reporter
+    """
+    global _progress
+    if tty == "auto":
+        tty = status_stream().isatty()
+    elif isinstance(tty, str):
+        tty = tty.lower() in ("1", "true", "yes")
+    _progress = ProgressReporter(phase, totals, interval, status_file, tty, **options)
+    return _progress.start()
+
+
+def get_progress():
+    """Return the shared progress reporter."""
+    return _progress
@@ -0,0 +1,153 @@
+"""
+Deterministic partitioning of the patient list across shard workers.
+
+A shard is written "k/N": worker k of N handles the patients whose external
+ID hashes to k modulo N. The hash is stable across processes and machines,
+so every worker derives the same partition from the same patient list
+without coordinating. Each shard keeps its own output segment, ledger
+partition and results file, which `merge_shard_results` combines.
+"""
+import json
+import shutil
+import hashlib
+from datetime import datetime
+from utils.sql_writer import output_segments
+from utils.compression import open_text, split_extension
+
+
+def parse_shard(spec):
+    """
+    Parse a shard specification.
+
+    Args:
+        spec (str): Shard as "k/N", e.g. "0/4"
+
+    Returns:
+        tuple: (index, count)
+
+    Raises:
+        ValueError: If spec is not a valid shard
+    """
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {spec!r}; expected k/N, e.g. 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {spec!r}; k must be between 0 and N-1")
+    return index, count
+
+
+def shard_of(external_id, shard_count):
+    """Return the shard index an external patient ID belongs to."""
+    digest = hashlib.blake2b(str(external_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+def shard_patients(patient_ids, shard):
+    """
+    Select the patients handled by one shard, keeping their order.
+
+    Args:
+        patient_ids (list): Resolved external patient IDs
+        shard (tuple): (index, count), or None for all patients
+
+    Returns:
+        list: External patient IDs of the shard
+    """
+    if shard is None:
+        return list(patient_ids)
+    index, count = shard
+    return [patient_id for patient_id in patient_ids if shard_of(patient_id, count) == index]
+
+
+def shard_path(path, shard):
+    """
+    Return the per-shard variant of a file or directory path.
+
+    "output.sql" becomes "output.shard0of4.sql" for shard (0, 4), and
+    "output.sql.gz" "output.shard0of4.sql.gz"; without a shard the path is
+    returned unchanged.
+    """
+    if shard is None:
+        return path
+    index, count = shard
+    root, ext = split_extension(path)
+    return f"{root}.shard{index}of{count}{ext}"
+
+
+def merge_shard_results(shard_count, results_file="results.json", output_file="output.sql"):
+    """
+    Combine the results files and output segments of all shards.
+
+    Patient histories are united (each patient belongs to one shard), errors
+    are concatenated and tagged with their shard, and per-shard statistics are
+    kept under "shards". The output segments are concatenated, in shard
+    order, into a single file that can be loaded in one go. Compressed
+    segments are streamed through, and the merged file is compressed
+    according to its own extension.
+
+    Args:
+        shard_count (int): Number of shards N
+        results_file (str): Unsharded results path; shard files are derived from it
+        output_file (str): Unsharded output path; shard segments are derived from it
+
+    Returns:
+        dict: The merged results
+    """
+    merged = {
+        "merged_at": datetime.now().isoformat(),
+        "shard_count": shard_count,
+        "patients": {},
+        "errors": [],
+        "bytes_fetched": 0,
+        "shards": {}
+    }
+    segments = []
+
+    for index in range(shard_count):
+        shard = (index, shard_count)
+        label = f"{index}/{shard_count}"
+        path = shard_path(results_file, shard)
+        try:
+            with open(path, "r") as f:
+                shard_results = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            print(f"Shard {label}: no usable results in {path} ({e})")
+            merged["shards"][label] = {"missing": True}
+            continue
+
+        merged["patients"].update(shard_results.get("patients", {}))
+        for error in shard_results.get("errors", []):
+            merged["errors"].append({**error, "shard": label})
+        merged["bytes_fetched"] += shard_results.get("bytes_fetched", 0)
+        if "first_run" in shard_results:
+            merged["first_run"] = min(merged.get("first_run", shard_results["first_run"]), shard_results["first_run"])
+        if "last_run" in shard_results:
+            merged["last_run"] = max(merged.get("last_run", shard_results["last_run"]), shard_results["last_run"])
+        merged["shards"][label] = {
+            "last_run": shard_results.get("last_run"),
+            "patients": len(shard_results.get("patients", {})),
+            "bytes_fetched": shard_results.get("bytes_fetched", 0),
+            "html_extraction": shard_results.get("html_extraction"),
+            "http_cache": shard_results.get("http_cache"),
+            "dead_letters": shard_results.get("dead_letters"),
+            "request_hedging": shard_results.get("request_hedging")
+        }
+
+        segments.extend(output_segments(shard_path(output_file, shard)))
+
+    with open(results_file, "w") as f:
+        json.dump(merged, f, indent=2)
+    print(f"Merged results of {shard_count} shards ({len(merged['patients'])} patients) into {results_file}")
+
+    if segments:
+        with open_text(output_file, "w") as out:
+            out.write("-- Adracare Encounter Notes SQL Import\n")
+            out.write(f"-- Merged from {len(segments)} shard segments at: {merged['merged_at']}\n\n")
+            for segment in segments:
+                out.write(f"-- segment: {segment}\n")
+                with open_text(segment) as f:
+                    shutil.copyfileobj(f, out)
+        print(f"Concatenated {len(segments)} output segments into {output_file}")
+
+    return merged
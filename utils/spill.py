@@ -0,0 +1,245 @@
+"""
+Bounded-memory note buffers that spill to disk.
+
+Each patient's new notes collect in a NoteBuffer. All buffers share one
+MemoryBudget; once the notes held in memory pass the budget, the buffers
+holding the most are written to compressed segment files in a temporary
+directory and dropped. Segments are written and read back in frames of
+FRAME_NOTES notes, so spilling and SQL generation only ever hold one frame
+on top of the budget, and the notes come back in their original order: the
+output is the same as when nothing spills.
+Without a budget a NoteBuffer is a plain in-memory list.
+"""
+import os
+import sys
+import zlib
+import pickle
+import shutil
+import logging
+import tempfile
+from api.adracare import NoteRecord
+from utils.timing import get_stage_timings, timed
+
+logger = logging.getLogger(__name__)
+
+# Approximate bytes of a NoteRecord and its ID and timestamp strings, besides the note text
+NOTE_OVERHEAD = 360
+
+# NoteRecord fields in segment rows
+FIELDS = NoteRecord.__slots__
+
+# Notes per compressed frame of a segment
+FRAME_NOTES = 1000
+
+
+def note_size(note):
+    """Return the approximate memory held by a note."""
+    return NOTE_OVERHEAD + (sys.getsizeof(note.text) if note.text is not None else 0) + \
+        (sys.getsizeof(note.notes) if note.notes is not None else 0)
+
+
+class MemoryBudget:
+    """
+    Ceiling on the memory of buffered notes, shared by all NoteBuffers.
+    """
+
+    def __init__(self, limit=0, directory=""):
+        """
+        Initialize the budget.
+
+        Args:
+            limit (int): Bytes of notes kept in memory before buffers spill; 0 never spills
+            directory (str): Where the temporary spill directory is created (default: the
+                system temporary directory)
+        """
+        self.limit = limit
+        self.directory = directory
+        self.used = 0
+        self.peak = 0
+        self.spilled_notes = 0
+        self.spilled_bytes = 0
+        self.segments = 0
+        self._buffers = set()
+        self._path = None
+
+    def segment_path(self):
+        """Return a new segment file path in the run's spill directory."""
+        if self._path is None:
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+            self._path = tempfile.mkdtemp(prefix="adracare_spill_", dir=self.directory or None)
+        self.segments += 1
+        return os.path.join(self._path, f"segment_{self.segments:06d}.bin")
+
+    def charge(self, buffer, size):
+        """
+        Account for notes added to a buffer and spill if the budget is exceeded.
+
+        Args:
+            buffer (NoteBuffer): Buffer the notes were added to
+            size (int): Bytes added
+        """
+        self.used += size
+        self._buffers.add(buffer)
+        if self.used > self.peak:
+            self.peak = self.used
+        if self.limit and self.used > self.limit:
+            # Spill the largest buffers first: fewest, biggest segments
+            for candidate in sorted(self._buffers, key=lambda b: b.memory_bytes, reverse=True):
+                if self.used <= self.limit:
+                    break
+                candidate.spill()
+
+    def release(self, buffer, size):
+        """Account for notes a buffer dropped from memory."""
+        self.used -= size
+        if not buffer.memory_bytes:
+            self._buffers.discard(buffer)
+
+    def stats(self):
+        """
+        Summarize the budget.
+
+        Returns:
+            dict: Limit, peak buffered bytes, notes and bytes spilled and segments written
+        """
+        return {
+            "limit_bytes": self.limit,
+            "peak_bytes": self.peak,
+            "spilled_notes": self.spilled_notes,
+            "spilled_bytes": self.spilled_bytes,
+            "segments": self.segments
+        }
+
+    def close(self):
+        """Delete the spill directory and anything left in it."""
+        if self._path is not None:
+            shutil.rmtree(self._path, ignore_errors=True)
+            self._path = None
+
+
+class NoteBuffer:
+    """
+    Ordered notes of one patient, held in memory until the budget spills them.
+    """
+
+    def __init__(self, budget=None):
+        """
+        Initialize an empty buffer.
+
+        Args:
+            budget (MemoryBudget): Shared budget (default: the one from get_memory_budget())
+        """
+        self.budget = budget or get_memory_budget()
+        self.memory = []
+        self.memory_bytes = 0
+        self.segments = []
+        self.frames = []
+        self.count = 0
+
+    def extend(self, notes):
+        """Append notes, spilling if the budget is exceeded."""
+        if not notes:
+            return
+        size = sum(note_size(note) for note in notes)
+        self.memory.extend(notes)
+        self.memory_bytes += size
+        self.count += len(notes)
+        self.budget.charge(self, size)
+
+    def spill(self):
+        """Write the notes held in memory to a new segment and drop them."""
+        if not self.memory:
+            return
+        written = 0
+        with timed("spill_write"):
+            path = self.budget.segment_path()
+            with open(path, "wb") as f:
+                for start in range(0, len(self.memory), FRAME_NOTES):
+                    rows = [tuple(getattr(note, field) for field in FIELDS)
+                            for note in self.memory[start:start + FRAME_NOTES]]
+                    data = zlib.compress(pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL), 1)
+                    f.write(data)
+                    self.frames.append((path, written, len(data)))
+                    written += len(data)
+        self.segments.append(path)
+        self.budget.spilled_notes += len(self.memory)
+        self.budget.spilled_bytes += written
+        get_stage_timings().count("notes_spilled", len(self.memory))
+        logger.debug("Spilled %d notes (%d bytes) to %s.", len(self.memory), written, path)
+        size = self.memory_bytes
+        self.memory = []
+        self.memory_bytes = 0
+        self.budget.release(self, size)
+
+    def _load(self, path, offset, length):
+        with timed("spill_read"), open(path, "rb") as f:
+            f.seek(offset)
+            rows = pickle.loads(zlib.decompress(f.read(length)))
+        notes = []
+        for row in rows:
+            note = NoteRecord.__new__(NoteRecord)
+            for field, value in zip(FIELDS, row):
+                setattr(note, field, value)
+            notes.append(note)
+        return notes
+
+    def chunk_loaders(self):
+        """
+        Return the notes as chunks to load one at a time, in order.
+
+        Returns:
+            list: Callables returning a list of NoteRecords; the spilled frames come
+            first, then the notes still in memory
+        """
+        memory = self.memory
+        loaders = [lambda frame=frame: self._load(*frame) for frame in self.frames]
+        if memory:
+            loaders.append(lambda: memory)
+        return loaders
+
+    def __iter__(self):
+        for load in self.chunk_loaders():
+            yield from load()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """Drop the notes and delete their segments."""
+        for path in self.segments:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.segments = []
+        self.frames = []
+        size = self.memory_bytes
+        self.memory = []
+        self.memory_bytes = 0
+        self.budget.release(self, size)
+
+
+_budget = MemoryBudget()
+
+
+def configure_memory_budget(limit=0, directory=""):
+    """
+    Replace the shared budget, deleting the previous one's spill directory.
+
+    Args:
+        limit (int): Bytes of notes kept in memory before spilling; 0 never spills
+        directory (str): Parent directory of the spill directory
+
+    Returns:
+        MemoryBudget: The new shared budget
+    """
+    global _budget
+    _budget.close()
+    _budget = MemoryBudget(limit, directory)
+    return _budget
+
+
+def get_memory_budget():
+    """Return the shared note memory budget."""
+    return _budget
@@ -0,0 +1,270 @@
+"""
+Buffered, segmented writer for the generated SQL.
+
+Rendered statements are collected in memory and written in large chunks,
+when the buffer passes a size or an age threshold and at every checkpoint,
+instead of one awaited write per statement. Chunks are encoded and written
+on a dedicated thread, so the event loop only hands them over.
+
+The output can be split into segments of a maximum size: output.sql, then
+output.part002.sql, output.part003.sql, ... Segments are only rotated at a
+checkpoint, so a patient's notes never straddle two files and each segment
+can be loaded on its own. Checkpoint offsets count the bytes of all
+segments together, which is what restore_segments cuts an interrupted
+run's output back to.
+
+An output named "output.sql.gz" or "output.sql.zst" is compressed: every
+chunk is written as its own gzip member or zstd frame (see
+utils.compression), so checkpoint offsets, and the file cut back to one,
+stay valid.
+"""
+import os
+import time
+import asyncio
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from utils.timing import get_stage_timings
+from utils.compression import compression_for, compress_chunk, split_extension
+
+FSYNC_POLICIES = ("checkpoint", "interval", "never")
+
+
+def segment_path(path, index):
+    """
+    Return the path of an output segment.
+
+    "output.sql" is segment 1; segment 2 is "output.part002.sql" ("output.part002.sql.gz"
+    for "output.sql.gz").
+    """
+    if index == 1:
+        return path
+    root, ext = split_extension(path)
+    return f"{root}.part{index:03d}{ext}"
+
+
+def output_segments(path):
+    """
+    List the existing segments of an output, in order.
+
+    Returns:
+        list: Segment paths, empty if the output does not exist
+    """
+    segments = []
+    index = 1
+    while os.path.exists(segment_path(path, index)):
+        segments.append(segment_path(path, index))
+        index += 1
+    return segments
+
+
+def restore_segments(path, offset):
+    """
+    Cut an output back to a checkpointed size.
+
+    An offset of 0 means nothing was checkpointed, and the output is left as
+    it is: it may still be the previous run's, and a writer started at 0
+    replaces it on its first write anyway.
+
+    Args:
+        path (str): Output path (segment 1)
+        offset (int): Bytes of all segments together known to be complete
+
+    Returns:
+        int: Bytes discarded
+
+    Raises:
+        Exception: If the segments hold fewer bytes than were checkpointed
+    """
+    if not offset:
+        return 0
+    segments = output_segments(path)
+    size = sum(os.path.getsize(segment) for segment in segments)
+    if size < offset:
+        raise Exception(f"{path} has {size} bytes but {offset} were checkpointed")
+    remaining = offset
+    for index, segment in enumerate(segments):
+        segment_size = os.path.getsize(segment)
+        if remaining >= segment_size and index < len(segments) - 1:
+            remaining -= segment_size
+            continue
+        if remaining:
+            os.truncate(segment, remaining)
+        else:
+            # The checkpoint fell on a rotation; writing continues in the previous segment
+            os.remove(segment)
+        # Later segments hold only output written after the checkpoint
+        for later in segments[index + 1:]:
+            os.remove(later)
+        break
+    return size - offset
+
+
+class SQLWriter:
+    """
+    Appends SQL text to an output in large, coalesced writes.
+    """
+
+    def __init__(self, path, offset=0, buffer_size=4 * 2**20, flush_interval=5.0, fsync="checkpoint",
+                 fsync_interval=30.0, segment_size=0, compression_level=None):
+        """
+        Initialize the writer.
+
+        Args:
+            path (str): Output path (segment 1)
+            offset (int): Checkpointed bytes to continue after; 0 starts a new output,
+                replacing any previous one on the first write
+            buffer_size (int): Characters buffered before they are written
+            flush_interval (float): Seconds buffered text may wait before it is written
+            fsync (str): "checkpoint" syncs every checkpoint, "interval" at most every
+                fsync_interval seconds, "never" leaves it to the operating system
+            fsync_interval (float): Seconds between syncs with the "interval" policy
+            segment_size (int): Bytes after which the next checkpoint starts a new segment;
+                0 writes a single file
+            compression_level (int): gzip or zstd level for a compressed output (default:
+                the format's default from utils.compression)
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync!r}; expected one of {', '.join(FSYNC_POLICIES)}")
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.segment_size = segment_size
+        self.compression = compression_for(path)
+        self.compression_level = compression_level
+        self.offset = offset
+        self.text_bytes = 0
+        self.flushes = 0
+        self.fsyncs = 0
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._last_fsync = time.monotonic()
+        self._file = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sql-writer")
+        if offset:
+            segments = output_segments(path)
+            self.segment = len(segments)
+            self._segment_bytes = os.path.getsize(segments[-1])
+        else:
+            self.segment = 1
+            self._segment_bytes = 0
+
+    @property
+    def current_path(self):
+        """Path of the segment being written."""
+        return segment_path(self.path, self.segment)
+
+    def _header(self):
+        part = f" (segment {self.segment})" if self.segment > 1 else ""
+        return f"-- Adracare Encounter Notes SQL Import{part}\n-- Generated at: {datetime.now().isoformat()}\n\n"
+
+    async def write(self, text):
+        """Buffer text, writing the buffer out if it is full or old enough."""
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.buffer_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            await self.flush()
+
+    def _write_chunk(self, chunks):
+        """Encode, compress and write buffered text; runs on the writer thread."""
+        started = time.perf_counter()
+        if self._file is None:
+            if self.offset == 0 and self.segment == 1:
+                # A new output replaces the previous run's, including its extra segments
+                for stale in output_segments(self.path)[1:]:
+                    os.remove(stale)
+            new_segment = self._segment_bytes == 0
+            self._file = open(self.current_path, "wb" if new_segment else "ab")
+            if new_segment:
+                chunks = [self._header()] + chunks
+        text = "".join(chunks).encode("utf-8")
+        data = compress_chunk(text, self.compression, self.compression_level)
+        self._file.write(data)
+        self._file.flush()
+        get_stage_timings().record("file_write", time.perf_counter() - started)
+        return len(text), len(data)
+
+    async def flush(self):
+        """
+        Write the buffered text to the current segment.
+
+        The text stays buffered until the write succeeds, so an error (a full
+        disk, say) leaves it in the buffer rather than losing it.
+        """
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        chunks = list(self._buffer)
+        loop = asyncio.get_event_loop()
+        encoded, written = await loop.run_in_executor(self._executor, self._write_chunk, chunks)
+        del self._buffer[:len(chunks)]
+        self._buffered = sum(len(text) for text in self._buffer)
+        self.text_bytes += encoded
+        self._segment_bytes += written
+        self.offset += written
+        self.flushes += 1
+
+    def _sync(self):
+        started = time.perf_counter()
+        os.fsync(self._file.fileno())
+        get_stage_timings().record("fsync", time.perf_counter() - started)
+
+    async def checkpoint(self):
+        """
+        Write everything buffered, sync it according to the policy and rotate a full segment.
+
+        Returns:
+            int: Bytes written to all segments, the offset to checkpoint
+        """
+        await self.flush()
+        if self._file is None:
+            return self.offset
+        loop = asyncio.get_event_loop()
+        now = time.monotonic()
+        if self.fsync == "checkpoint" or (self.fsync == "interval" and now - self._last_fsync >= self.fsync_interval):
+            await loop.run_in_executor(self._executor, self._sync)
+            self._last_fsync = now
+            self.fsyncs += 1
+        if self.segment_size and self._segment_bytes >= self.segment_size:
+            await loop.run_in_executor(self._executor, self._file.close)
+            self._file = None
+            self.segment += 1
+            self._segment_bytes = 0
+        return self.offset
+
+    async def close(self):
+        """Write and sync anything buffered and close the output; later calls do nothing."""
+        if self._executor is None:
+            return
+        await self.flush()
+        if self._file is not None:
+            loop = asyncio.get_event_loop()
+            if self.fsync != "never":
+                await loop.run_in_executor(self._executor, self._sync)
+            await loop.run_in_executor(self._executor, self._file.close)
+            self._file = None
+        self._executor.shutdown()
+        self._executor = None
+
+    def stats(self):
+        """
+        Summarize the output.
+
+        Returns:
+            dict: Bytes written (and before compression, in this session), writes, syncs
+            and segments
+        """
+        segments = 0
+        if self.offset:
+            # A checkpoint that rotated last leaves the next segment unwritten
+            segments = self.segment if self._segment_bytes else self.segment - 1
+        return {
+            "bytes": self.offset,
+            "compression": self.compression,
+            "uncompressed_bytes": self.text_bytes,
+            "flushes": self.flushes,
+            "fsyncs": self.fsyncs,
+            "segments": segments
+        }
@@ -84,9 +84,62 @@
 Functions for processing text and HTML content.
 """
 import re
+import hashlib
+import threading
+from collections import OrderedDict
 from bs4 import BeautifulSoup
+from bs4.dammit import EntitySubstitution
 
-def extract_text_from_html(html_content):
+# Any start/end tag, comment, declaration or processing instruction. Quotes are
+# only honoured directly after "=" so attribute values containing ">" are kept
+# inside the tag, matching how html.parser tokenizes them.
+_MARKUP_RE = re.compile(
+    r'</?[a-zA-Z][^<>"\'=]*(?:=\s*(?:"[^"]*"|\'[^\']*\'|[^<>"\'=\s]*)[^<>"\'=]*)*>'
+    r'|<!--.*?-->'
+    r'|<![a-zA-Z][^<>]*>'
+    r'|<\?[^<>]*>',
+    re.DOTALL
+)
+
+# Markup whose text html.parser and BeautifulSoup treat specially (raw text
+# elements, strings excluded from get_text, ambiguous comment endings, and
+# "</br>", which BeautifulSoup pairs with an earlier "<BR>" depending on case).
+# Documents containing any of these are handed to the BeautifulSoup engine.
+# Matched against a lowercased copy, which is much faster than IGNORECASE.
+_SPECIAL_MARKUP_RE = re.compile(
+    r'<(?:script|style|template|textarea|title|rt|rp|xmp|iframe|noembed|noframes|noscript|plaintext)\b'
+    r'|</br|--!>|<!---?>'
+)
+
+# Semicolon-terminated character references, and any "&" that starts a
+# reference without being one (BeautifulSoup resolves those with its own rules)
+_ENTITY_RE = re.compile(r'&(?:#([0-9]{1,7})|#[xX]([0-9a-fA-F]{1,6})|([a-zA-Z][a-zA-Z0-9]*));')
+_AMBIGUOUS_ENTITY_RE = re.compile(
+    r'&(?=[a-zA-Z#])(?!(?:#[0-9]{1,7}|#[xX][0-9a-fA-F]{1,6}|[a-zA-Z][a-zA-Z0-9]*);)'
+)
+_NAMED_ENTITIES = EntitySubstitution.HTML_ENTITY_TO_CHARACTER
+
+_BR_RE = re.compile(r'<br\s*/?>')
+_NON_PRINTABLE_RE = re.compile(r'[^\x20-\x7E]+')
+
+HTML_EXTRACTORS = ("stream", "bs4")
+_default_extractor = "stream"
+
+
+def configure_html_extractor(engine):
+    """
+    Select the engine used by extract_text_from_html when none is given.
+    
+    Args:
+        engine (str): "stream" for the single-pass extractor or "bs4" for BeautifulSoup
+    """
+    global _default_extractor
+    if engine not in HTML_EXTRACTORS:
+        raise ValueError(f"Unknown HTML extractor '{engine}', expected one of {', '.join(HTML_EXTRACTORS)}")
+    _default_extractor = engine
+
+
+def extract_text_from_html(html_content, engine=None):
     """
     Extract plain text from HTML content:
     - Discards all HTML tags and non-text elements (e.g., images, styling, bullet points).
@@ -96,6 +149,7 @@ def extract_text_from_html(html_content):
     
     Args:
         html_content (str or bytes): The HTML content to process.
+        engine (str): "stream" or "bs4"; defaults to the configured extractor.
         
     Returns:
         str: The cleaned plain text, or an empty string if content is empty.
@@ -107,30 +161,247 @@ def extract_text_from_html(html_content):
     if isinstance(html_content, bytes):
         html_content = html_content.decode('utf-8', errors='ignore')
     
-    # Replace <br> tags with a space
-    html_content = re.sub(r'<br\s*/?>', ' ', html_content)
+    if (engine or _default_extractor) == "stream":
+        text = _strip_markup(html_content)
+        if text is not None:
+            return _normalize_text(text)
     
-    # Parse HTML
-    soup = BeautifulSoup(html_content, 'html.parser')
+    return _extract_text_bs4(html_content)
+
+
+class ExtractionCache:
+    """
+    Bounded LRU of extracted note text keyed by a digest of the HTML.
     
-    # Remove image tags (or any other tags not needed)
-    for img in soup.find_all('img'):
-        img.decompose()
+    Encounter notes are heavily templated, so the same document is often seen
+    many times in a run; keeping recent results avoids parsing it again.
+    """
     
-    # Extract text from HTML
-    text = soup.get_text(separator=" ", strip=True)
+    def __init__(self, max_entries=10000):
+        """
+        Initialize the cache.
+        
+        Args:
+            max_entries (int): Maximum number of documents kept; 0 disables caching
+        """
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.documents = 0
+        self.batch_duplicates = 0
+        self.hits = 0
+        self.misses = 0
+        # Batches may be extracted concurrently from executor threads
+        self.lock = threading.Lock()
+    
+    def get(self, digest):
+        """Return the cached text for digest, or None, updating recency."""
+        text = self.entries.get(digest)
+        if text is not None:
+            self.entries.move_to_end(digest)
+        return text
+    
+    def put(self, digest, text):
+        """Store text for digest, evicting the least recently used entry if full."""
+        if self.max_entries <= 0:
+            return
+        self.entries[digest] = text
+        self.entries.move_to_end(digest)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+    
+    def stats(self):
+        """
+        Summarize how much extraction work the cache saved.
+        
+        Returns:
+            dict: Document, duplicate, hit and miss counts and the overall hit rate
+        """
+        saved = self.batch_duplicates + self.hits
+        return {
+            "documents": self.documents,
+            "batch_duplicates": self.batch_duplicates,
+            "cache_hits": self.hits,
+            "extracted": self.misses,
+            "cached_entries": len(self.entries),
+            "hit_rate": round(saved / self.documents, 4) if self.documents else 0.0
+        }
+
+
+_extraction_cache = ExtractionCache()
+
+
+def configure_extraction_cache(max_entries):
+    """
+    Replace the shared extraction cache with one of the given size.
+    
+    Args:
+        max_entries (int): Maximum number of documents kept; 0 disables caching
+        
+    Returns:
+        ExtractionCache: The new shared cache
+    """
+    global _extraction_cache
+    _extraction_cache = ExtractionCache(max_entries)
+    return _extraction_cache
+
+
+def get_extraction_cache():
+    """Return the shared extraction cache."""
+    return _extraction_cache
+
+
+def extract_texts_from_html(html_documents, engine=None, cache=None):
+    """
+    Extract plain text from a batch of HTML documents.
+    
+    Documents are deduplicated by content digest so each distinct document is
+    extracted once per batch, and results are kept in an LRU across batches.
+    
+    Args:
+        html_documents (list): HTML strings (or bytes) to process
+        engine (str): "stream" or "bs4"; defaults to the configured extractor
+        cache (ExtractionCache): Cache to use; defaults to the shared cache
+        
+    Returns:
+        list: Cleaned plain text for each document, in input order
+    """
+    cache = cache or _extraction_cache
+    texts = [""] * len(html_documents)
+    pending = {}
+    
+    digests = []
+    for index, html_content in enumerate(html_documents):
+        if html_content:
+            raw = html_content.encode('utf-8', errors='surrogatepass') if isinstance(html_content, str) else html_content
+            digests.append((index, html_content, hashlib.blake2b(raw, digest_size=16).digest()))
+    
+    with cache.lock:
+        cache.documents += len(digests)
+        for index, html_content, digest in digests:
+            if digest in pending:
+                cache.batch_duplicates += 1
+                pending[digest][1].append(index)
+                continue
+            
+            text = cache.get(digest)
+            if text is not None:
+                cache.hits += 1
+                texts[index] = text
+                continue
+            
+            pending[digest] = (html_content, [index])
+        cache.misses += len(pending)
+    
+    extracted = []
+    for digest, (html_content, indexes) in pending.items():
+        text = extract_text_from_html(html_content, engine=engine)
+        extracted.append((digest, text))
+        for index in indexes:
+            texts[index] = text
     
-    # Normalize newlines and extra whitespace to a single space
-    text = re.sub(r'[\n\r]+', ' ', text)
-    text = re.sub(r'\s+', ' ', text)
+    with cache.lock:
+        for digest, text in extracted:
+            cache.put(digest, text)
+    
+    return texts
+
+
+def _strip_markup(html_content):
+    """
+    Drop all markup from a document in a single pass and decode entities.
+    
+    Args:
+        html_content (str): The HTML content to process.
+        
+    Returns:
+        str or None: Text with every tag replaced by a space, or None if the
+        document contains markup that must be parsed by BeautifulSoup.
+    """
+    if '<' in html_content:
+        if _SPECIAL_MARKUP_RE.search(html_content.lower()):
+            return None
+        html_content = _MARKUP_RE.sub(' ', html_content)
+        # A leftover "<" means markup the fast path does not understand
+        if '<' in html_content:
+            return None
+    
+    if '&' in html_content:
+        if _AMBIGUOUS_ENTITY_RE.search(html_content):
+            return None
+        try:
+            html_content = _ENTITY_RE.sub(_decode_entity, html_content)
+        except KeyError:
+            return None
+    
+    return html_content
+
+
+def _decode_entity(match):
+    """
+    Resolve one character reference the way BeautifulSoup does.
+    
+    Raises:
+        KeyError: For unknown names and code points BeautifulSoup remaps
+    """
+    decimal, hexadecimal, name = match.groups()
+    if name is not None:
+        return _NAMED_ENTITIES[name]
+    
+    codepoint = int(decimal, 10) if decimal is not None else int(hexadecimal, 16)
+    if 0x20 <= codepoint <= 0x7E or 0xA0 <= codepoint <= 0xD7FF or 0xE000 <= codepoint <= 0xFFFD:
+        return chr(codepoint)
+    raise KeyError(codepoint)
+
+
+def _normalize_text(text):
+    """
+    Apply the whitespace, character and quoting rules shared by both engines.
+    
+    Args:
+        text (str): Text extracted from HTML.
+        
+    Returns:
+        str: The cleaned plain text.
+    """
+    # Normalize newlines and extra whitespace to a single space (str.split
+    # uses the same definition of whitespace as the \s regex class)
+    text = ' '.join(text.split())
     
     # Remove non-printable ASCII characters (keeps space to tilde)
-    text = re.sub(r'[^\x20-\x7E]+', ' ', text)
+    text = _NON_PRINTABLE_RE.sub(' ', text)
     
     # Double-escape single quotes for SQL insertion (ensuring they're properly escaped)
     text = text.replace("'", "''")
     
     # Remove any characters that could cause SQL injection or parsing issues
-    text = re.sub(r'[\\";`]', '', text)
+    for char in '\\";`':
+        if char in text:
+            text = text.replace(char, '')
+    
+    return text.strip()
+
+
+def _extract_text_bs4(html_content):
+    """
+    Extract text with BeautifulSoup. Used as the fallback engine.
+    
+    Args:
+        html_content (str): The HTML content to process.
+        
+    Returns:
+        str: The cleaned plain text.
+    """
+    # Replace <br> tags with a space
+    html_content = _BR_RE.sub(' ', html_content)
+    
+    # Parse HTML
+    soup = BeautifulSoup(html_content, 'html.parser')
+    
+    # Remove image tags (or any other tags not needed)
+    for img in soup.find_all('img'):
+        img.decompose()
+    
+    # Extract text from HTML
+    text = soup.get_text(separator=" ", strip=True)
     
-    return text.strip()
\ No newline at end of file
+    return _normalize_text(text)
@@ -0,0 +1,215 @@
+"""
+Lightweight per-stage timing for the import and load hot paths.
+
+Each stage (authentication, page fetches, JSON decoding, HTML extraction,
+SQL rendering, file writes, statement execution, ...) records its
+durations into a log-linear histogram in the style of HdrHistogram: values
+are bucketed with a fixed relative precision, so recording is O(1), memory
+stays small whatever the number of samples, and percentiles can be read off
+at the end of a run. Counters track totals that are not durations.
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of durations in nanoseconds.
+
+    Values below 2**sub_bucket_bits are kept exactly; larger values keep
+    their top sub_bucket_bits bits, which bounds the relative error of any
+    reported value to 2**(1 - sub_bucket_bits) (about 1.6% by default).
+    """
+
+    def __init__(self, sub_bucket_bits=7):
+        """
+        Initialize the histogram.
+
+        Args:
+            sub_bucket_bits (int): Significant bits kept per value
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value):
+        """Return the bucket index of a value."""
+        shift = value.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return value
+        return (shift << self.sub_bucket_bits) + (value >> shift)
+
+    def _value(self, index):
+        """Return the midpoint of the values in a bucket."""
+        shift = index >> self.sub_bucket_bits
+        if shift == 0:
+            return index
+        mantissa = index & ((1 << self.sub_bucket_bits) - 1)
+        return (mantissa << shift) + (1 << (shift - 1))
+
+    def record(self, value):
+        """
+        Record one duration.
+
+        Args:
+            value (int): Duration in nanoseconds
+        """
+        value = max(0, int(value))
+        index = self._index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """
+        Return the value below which percent of the recorded values fall.
+
+        Args:
+            percent (float): Percentile between 0 and 100
+
+        Returns:
+            int: Duration in nanoseconds, 0 if nothing was recorded
+        """
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.max, max(self.min, self._value(index)))
+        return self.max
+
+
+class StageTimings:
+    """
+    Histograms and counters for the stages of a run.
+    """
+
+    def __init__(self):
+        """Initialize empty timings."""
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        """
+        Record one duration of a stage.
+
+        Args:
+            stage (str): Stage name
+            seconds (float): Duration in seconds
+        """
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = LatencyHistogram()
+            histogram.record(seconds * 1e9)
+
+    def count(self, counter, amount=1):
+        """
+        Add to a counter.
+
+        Args:
+            counter (str): Counter name
+            amount (int): Amount added
+        """
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    @contextmanager
+    def time(self, stage):
+        """Time the enclosed block as one occurrence of stage."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def summary(self):
+        """
+        Summarize the stages and counters.
+
+        Returns:
+            dict: "stages" mapping each stage to its count, total seconds and
+            mean, p50, p90, p99 and max in milliseconds, and "counters"
+        """
+        with self._lock:
+            stages = {}
+            for stage, histogram in self.histograms.items():
+                stages[stage] = {
+                    "count": histogram.count,
+                    "total_s": round(histogram.total / 1e9, 3),
+                    "mean_ms": round(histogram.total / histogram.count / 1e6, 3),
+                    "p50_ms": round(histogram.percentile(50) / 1e6, 3),
+                    "p90_ms": round(histogram.percentile(90) / 1e6, 3),
+                    "p99_ms": round(histogram.percentile(99) / 1e6, 3),
+                    "max_ms": round(histogram.max / 1e6, 3)
+                }
+            return {"stages": stages, "counters": dict(self.counters)}
+
+    def format_summary(self):
+        """
+        Render the summary as a table, slowest stages (by total time) first.
+
+        Returns:
+            str: Table of the stages followed by the counters
+        """
+        summary = self.summary()
+        lines = [
+            f"{'Stage':<24}{'Count':>9}{'Total s':>10}{'Mean ms':>10}{'p50 ms':>10}{'p90 ms':>10}"
+            f"{'p99 ms':>10}{'Max ms':>10}"
+        ]
+        ordered = sorted(summary["stages"].items(), key=lambda item: -item[1]["total_s"])
+        for stage, s in ordered:
+            lines.append(
+                f"{stage:<24}{s['count']:>9}{s['total_s']:>10.3f}{s['mean_ms']:>10.3f}{s['p50_ms']:>10.3f}"
+                f"{s['p90_ms']:>10.3f}{s['p99_ms']:>10.3f}{s['max_ms']:>10.3f}"
+            )
+        for counter, value in sorted(summary["counters"].items()):
+            lines.append(f"{counter:<24}{value:>9}")
+        return "\n".join(lines)
+
+
+_stage_timings = StageTimings()
+
+
+def configure_stage_timings():
+    """
+    Start a new set of stage timings, e.g. at the start of a run.
+
+    Returns:
+        StageTimings: The new shared timings
+    """
+    global _stage_timings
+    _stage_timings = StageTimings()
+    return _stage_timings
+
+
+def get_stage_timings():
+    """Return the shared stage timings."""
+    return _stage_timings
+
+
+def timed(stage):
+    """
+    Time the enclosed block into the shared stage timings.
+
+    Usage:
+        with timed("sql_render"):
+            ...
+    """
+    return _stage_timings.time(stage)
+
+
+def count(counter, amount=1):
+    """Add to a counter of the shared stage timings."""
+    _stage_timings.count(counter, amount)